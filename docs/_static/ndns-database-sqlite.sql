@@ -1,34 +1,50 @@
 DROP TRIGGER IF EXISTS rrs_update;
 DROP TABLE IF EXISTS zones;
 DROP TABLE IF EXISTS rrsets;
+DROP TABLE IF EXISTS blobs;
 DROP TABLE IF EXISTS rrs;
 CREATE TABLE zones (
-  id    INTEGER NOT NULL PRIMARY KEY, 
+  id    INTEGER NOT NULL PRIMARY KEY,
   name blob NOT NULL UNIQUE);
+CREATE TABLE blobs (
+  digest text NOT NULL PRIMARY KEY,
+  data   blob);
 CREATE TABLE rrsets (
-  id       INTEGER NOT NULL PRIMARY KEY, 
-  zone_id integer(10) NOT NULL, 
-  label   text NOT NULL, 
-  class   integer(10) NOT NULL, 
-  type    integer(10) NOT NULL, 
-  ndndata blob, 
-  FOREIGN KEY(zone_id) REFERENCES zones(id) ON UPDATE Cascade ON DELETE Cascade);
+  id              INTEGER NOT NULL PRIMARY KEY,
+  zone_id        integer(10) NOT NULL,
+  label          text NOT NULL,
+  rclass         integer(10) NOT NULL,
+  rtype          integer(10) NOT NULL,
+  ndndata_digest text,
+  rlabel         text,
+  signed_at      integer(10),
+  signed_key_id  integer(10),
+  content_hash   text,
+  dirty          boolean,
+  FOREIGN KEY(zone_id) REFERENCES zones(id) ON UPDATE Cascade ON DELETE Cascade,
+  FOREIGN KEY(ndndata_digest) REFERENCES blobs(digest));
 CREATE TABLE rrs (
-  id        INTEGER NOT NULL PRIMARY KEY, 
-  rrset_id integer(10) NOT NULL, 
-  ttl      integer(10) NOT NULL, 
-  rrdata   blob NOT NULL, 
+  id        INTEGER NOT NULL PRIMARY KEY,
+  rrset_id integer(10) NOT NULL,
+  ttl      integer(10) NOT NULL,
+  rrdata   blob NOT NULL,
   FOREIGN KEY(rrset_id) REFERENCES rrsets(id) ON UPDATE Cascade ON DELETE Cascade);
-CREATE UNIQUE INDEX rrsets_zone_id_label_class_type 
-  ON rrsets (zone_id, label, class, type);
-CREATE INDEX rrs_rrset_id 
+CREATE INDEX ix_rrsets_zone_id_label_rclass_rtype
+  ON rrsets (zone_id, label, rclass, rtype);
+CREATE INDEX ix_rrsets_zone_id_rtype_rlabel
+  ON rrsets (zone_id, rtype, rlabel);
+CREATE INDEX ix_rrsets_ndndata_digest
+  ON rrsets (ndndata_digest);
+CREATE INDEX ix_rrsets_zone_id_dirty
+  ON rrsets (zone_id, dirty);
+CREATE INDEX ix_rrsets_zone_id_signed_at
+  ON rrsets (zone_id, signed_at);
+CREATE INDEX rrs_rrset_id
   ON rrs (rrset_id);
-CREATE INDEX rrs_rrset_id_rrdata 
-  ON rrs (rrset_id, rrdata);
 CREATE TRIGGER rrs_update
 BEFORE INSERT ON rrs
 FOR EACH ROW
 BEGIN
     DELETE FROM rrs WHERE rrset_id = NEW.rrset_id AND rrdata = NEW.rrdata;
 END;
-
+PRAGMA user_version = 4;
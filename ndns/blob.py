@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- Mode:python; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (c) 2013, Regents of the University of California
+#                     Alexander Afanasyev
+#
+# BSD license, See the doc/LICENSE file for more information
+#
+# Author: Alexander Afanasyev <alexander.afanasyev@ucla.edu>
+#
+
+from sqlalchemy import Column, String, Binary
+from ndns import Base
+
+import hashlib
+
+def blob_digest (data):
+    """Get digest, under which ``data`` is stored in the blob table"""
+    return hashlib.sha256 (data).hexdigest ()
+
+class Blob (Base):
+    """
+    Content-addressed storage of signed Data packets:
+
+    .. code-block:: sql
+
+        CREATE TABLE blobs (
+            digest VARCHAR NOT NULL,
+            data BLOB,
+            PRIMARY KEY (digest)
+        );
+
+    ``digest`` is a SHA-256 digest of ``data`` in hex form (see :py:func:`blob_digest`), so identical
+    packets are stored only once.  Blobs are never updated, and are inserted with ``INSERT OR IGNORE``
+    whenever an RR set referencing them is flushed.  Blobs that are no longer referenced are removed
+    by :py:func:`collect_garbage`.
+    """
+    __tablename__ = "blobs"
+
+    digest = Column (String, primary_key = True)
+    data = Column (Binary)
+
+def store_blob (connection, data):
+    """
+    Store blob (if not yet stored)
+
+    :param connection: SQLAlchemy connection or session
+    :returns: digest of the blob
+    """
+    digest = blob_digest (data)
+    connection.execute ("INSERT OR IGNORE INTO blobs (digest, data) VALUES (:digest, :data)",
+                        {"digest": digest, "data": buffer (data)})
+    return digest
+
+def collect_garbage (db):
+    """
+    Delete blobs that are not referenced by any RR set
+
+    :param db: SQLAlchemy engine of the zone database
+    :returns: number of deleted blobs
+    """
+    return db.execute ("DELETE FROM blobs WHERE digest NOT IN "
+                       "(SELECT ndndata_digest FROM rrsets WHERE ndndata_digest IS NOT NULL)").rowcount
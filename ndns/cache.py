@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- Mode:python; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (c) 2013, Regents of the University of California
+#                     Alexander Afanasyev
+#
+# BSD license, See the doc/LICENSE file for more information
+#
+# Author: Alexander Afanasyev <alexander.afanasyev@ucla.edu>
+#
+
+import time
+import heapq
+import threading
+import logging
+from collections import OrderedDict
+
+_LOG = logging.getLogger ("ndns.Cache")
+
+# maximum number of expired entries reclaimed by each put
+_PURGE_ON_PUT = 4
+
+class LruCache (object):
+    """
+    Bounded in-memory cache with least-recently-used eviction
+
+    Each entry can optionally be associated with a group (e.g., zone id), so all entries
+    of the group can be invalidated at once, and with an absolute expiration time, after which
+    the entry is no longer returned.
+
+    Expiration times are also kept in a heap, so expired entries can be reclaimed proactively
+    instead of occupying the cache until they are looked up again or evicted: each :py:meth:`put`
+    reclaims a few of the earliest expired entries, and all of them are reclaimed by
+    :py:meth:`purgeExpired` (optionally called periodically by a background thread started with
+    :py:meth:`startPurger`).  All operations are protected by a lock, so the cache can be shared with
+    the purger thread.
+
+    :param limit: Maximum number of entries in the cache
+    :type limit: int
+    :param byteLimit: Maximum total size of entries (as reported to :py:meth:`put`), None for no limit
+    :type byteLimit: int
+    """
+
+    def __init__ (self, limit = 10000, byteLimit = None):
+        self.limit = limit
+        self.byteLimit = byteLimit
+
+        self._entries = OrderedDict ()
+        self._groups = {}
+        self._bytes = 0
+
+        # heap of (expire, key), may contain stale items for replaced or removed entries
+        self._expiry = []
+        self._lock = threading.RLock ()
+        self._purger = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__ (self):
+        return len (self._entries)
+
+    def __contains__ (self, key):
+        """
+        Check if there is a non-expired entry for the key, without marking it as recently used
+        """
+        with self._lock:
+            entry = self._entries.get (key)
+            return entry is not None and (entry[3] is None or time.time () <= entry[3])
+
+    @property
+    def size (self):
+        """Total size of all entries in the cache"""
+        return self._bytes
+
+    @property
+    def stats (self):
+        with self._lock:
+            return {"entries": len (self._entries),
+                    "bytes": self._bytes,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "expirations": self.expirations}
+
+    def get (self, key):
+        """
+        Get value associated with the key and mark entry as recently used
+
+        :returns: cached value or None if key is not in the cache or has expired
+        """
+        entry = self.getEntry (key)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def getEntry (self, key):
+        """
+        Same as :py:meth:`get`, but also return expiration time of the entry
+
+        :returns: tuple (cached value, expiration time or None) or None if key is not in the cache or has expired
+        """
+        with self._lock:
+            try:
+                entry = self._entries.pop (key)
+            except KeyError:
+                self.misses += 1
+                return None
+
+            self._entries[key] = entry
+
+            if entry[3] is not None and time.time () > entry[3]:
+                self._remove (key)
+                self.misses += 1
+                self.expirations += 1
+                return None
+
+            self.hits += 1
+            return (entry[0], entry[3])
+
+    def put (self, key, value, group = None, size = 0, expire = None):
+        """
+        Add (or replace) cache entry, evicting the least recently used entries if necessary
+
+        :param group: Group to which the entry belongs (see :py:meth:`invalidate`)
+        :param size: Size of the entry, accounted against ``byteLimit``
+        :param expire: Absolute time (as returned by ``time.time ()``) when entry expires
+        """
+        if self.limit <= 0:
+            return
+
+        if self.byteLimit is not None and size > self.byteLimit:
+            return
+
+        with self._lock:
+            self._remove (key)
+            self._purgeExpired (time.time (), _PURGE_ON_PUT)
+
+            self._entries[key] = [value, group, size, expire]
+            self._bytes += size
+            if group is not None:
+                self._groups.setdefault (group, set ()).add (key)
+
+            if expire is not None:
+                heapq.heappush (self._expiry, (expire, key))
+                if len (self._expiry) > 2 * len (self._entries) + 1000:
+                    self._rebuildExpiry ()
+
+            while len (self._entries) > self.limit or \
+                  (self.byteLimit is not None and self._bytes > self.byteLimit):
+                self._remove (next (iter (self._entries)))
+                self.evictions += 1
+
+    def invalidate (self, group):
+        """
+        Remove all entries associated with the group
+        """
+        with self._lock:
+            for key in list (self._groups.get (group, ())):
+                self._remove (key)
+
+    def clear (self):
+        with self._lock:
+            self._entries.clear ()
+            self._groups.clear ()
+            self._expiry = []
+            self._bytes = 0
+
+    def purgeExpired (self, now = None):
+        """
+        Remove all entries that have expired
+
+        :returns: number of removed entries
+        """
+        if now is None:
+            now = time.time ()
+
+        with self._lock:
+            return self._purgeExpired (now, None)
+
+    def _purgeExpired (self, now, limit):
+        # remove expired entries, examining at most ``limit`` heap items (None for no limit)
+        purged = 0
+        examined = 0
+        while len (self._expiry) > 0 and self._expiry[0][0] < now and (limit is None or examined < limit):
+            (expire, key) = heapq.heappop (self._expiry)
+            examined += 1
+            entry = self._entries.get (key)
+            if entry is not None and entry[3] == expire:
+                self._remove (key)
+                purged += 1
+        self.expirations += purged
+        return purged
+
+    def startPurger (self, interval = 60.0):
+        """
+        Start background (daemon) thread, calling :py:meth:`purgeExpired` every ``interval`` seconds
+        """
+        if self._purger is not None:
+            return
+
+        self._purger = threading.Event ()
+        thread = threading.Thread (target = self._purge, args = (self._purger, interval), name = "LruCache purger")
+        thread.daemon = True
+        thread.start ()
+
+    def stopPurger (self):
+        if self._purger is not None:
+            self._purger.set ()
+            self._purger = None
+
+    def _purge (self, stopped, interval):
+        while not stopped.wait (interval):
+            purged = self.purgeExpired ()
+            if purged > 0:
+                _LOG.debug ("Purged %d expired cache entries" % purged)
+
+    def _rebuildExpiry (self):
+        # drop heap items of replaced and removed entries
+        self._expiry = [(entry[3], key) for (key, entry) in self._entries.iteritems () if entry[3] is not None]
+        heapq.heapify (self._expiry)
+
+    def _remove (self, key):
+        try:
+            [value, group, size, expire] = self._entries.pop (key)
+        except KeyError:
+            return
+
+        self._bytes -= size
+        if group is not None:
+            keys = self._groups[group]
+            keys.discard (key)
+            if len (keys) == 0:
+                del self._groups[group]
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- Mode:python; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (c) 2013, Regents of the University of California
+#                     Alexander Afanasyev
+#
+# BSD license, See the doc/LICENSE file for more information
+#
+# Author: Alexander Afanasyev <alexander.afanasyev@ucla.edu>
+#
+
+import sqlite3
+import logging
+
+from rrset import reverse_label
+
+_LOG = logging.getLogger ("ndns.Lookup")
+
+# Statements are always passed in exactly the same form, so sqlite3 module prepares each
+# of them only once and then reuses them from its statement cache
+_SELECT_RRSET = "SELECT blobs.data FROM rrsets JOIN blobs ON blobs.digest = rrsets.ndndata_digest " \
+                "WHERE rrsets.zone_id = ? AND rrsets.label = ? AND rrsets.rtype = ? LIMIT 1"
+
+_SELECT_EXISTS = "SELECT 1 FROM rrsets " \
+                 "WHERE rrsets.zone_id = ? AND rrsets.label = ? AND rrsets.rtype = ? AND rrsets.ndndata_digest IS NOT NULL LIMIT 1"
+
+_SELECT_RRDATA = "SELECT rrs.rrdata FROM rrsets JOIN rrs ON rrs.rrset_id = rrsets.id " \
+                 "WHERE rrsets.zone_id = ? AND rrsets.label = ? AND rrsets.rtype = ? " \
+                 "ORDER BY rrs.id LIMIT 1"
+
+_SELECT_BELOW = "SELECT 1 FROM rrsets " \
+                "WHERE rrsets.zone_id = ? AND rrsets.rtype = ? AND rrsets.rlabel > ? AND rrsets.rlabel < ? LIMIT 1"
+
+_SELECT_BELOW_APEX = "SELECT 1 FROM rrsets " \
+                     "WHERE rrsets.zone_id = ? AND rrsets.rtype = ? AND rrsets.rlabel > '' LIMIT 1"
+
+class RecordLookup (object):
+    """
+    Read-only access to RR sets for the serving path, bypassing the ORM
+
+    Uses a dedicated connection to the zone database and returns plain tuples, so lookups
+    do not compile SQL, create :py:class:`ndns.rrset.RRSet` objects, or populate the session's
+    identity map.  Changes committed through other connections (e.g., ORM session of the same
+    process) are visible immediately.
+
+    :param zonedb: Path to the zone database (``session.zonedb``)
+    """
+
+    def __init__ (self, zonedb):
+        self._conn = sqlite3.connect (zonedb, check_same_thread = False, cached_statements = 16)
+        self._conn.text_factory = str
+
+    def close (self):
+        self._conn.close ()
+
+    def get (self, zone_id, label, rtype):
+        """
+        Get signed Data packet of the RR set
+
+        :param label: RR set label, relative to the zone (``dns.name.Name.to_text ()``)
+        :returns: Data packet in wire format or None if there is no such RR set
+        """
+        row = self._conn.execute (_SELECT_RRSET, (zone_id, label, rtype)).fetchone ()
+        if row is None or row[0] is None:
+            return None
+        return str (row[0])
+
+    def exists (self, zone_id, label, rtype):
+        """
+        Check if there is a signed RR set, without fetching its Data packet
+        """
+        return self._conn.execute (_SELECT_EXISTS, (zone_id, label, rtype)).fetchone () is not None
+
+    def get_rrdata (self, zone_id, label, rtype):
+        """
+        Get wire-formatted RDATA of the first RR in the RR set (e.g., for single-record RR sets like NDNCERTSEQ)
+
+        :returns: RDATA or None if there is no such RR set
+        """
+        row = self._conn.execute (_SELECT_RRDATA, (zone_id, label, rtype)).fetchone ()
+        if row is None:
+            return None
+        return str (row[0])
+
+    def has_below (self, zone_id, label, rtype):
+        """
+        Check if there is RR set of type ``rtype`` below ``label`` (see :py:meth:`ndns.rrset.RRSet.is_below`)
+        """
+        prefix = reverse_label (label)
+        if prefix == "":
+            row = self._conn.execute (_SELECT_BELOW_APEX, (zone_id, rtype)).fetchone ()
+        else:
+            row = self._conn.execute (_SELECT_BELOW, (zone_id, rtype, prefix, "%s/" % prefix[:-1])).fetchone ()
+        return row is not None
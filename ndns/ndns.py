@@ -15,12 +15,14 @@ from sqlalchemy.orm import Session, sessionmaker
 
 Base = declarative_base ()
 from zone import *
+from blob import *
 from rrset import *
 from rr import *
 from key import *
 from dnsifier import *
 from policy.identity import *
 import query
+import schema
 import os
 
 import dns.rdataclass
@@ -74,11 +76,19 @@ def ndns_session (libdir):
         db = create_engine ('sqlite:///%s' % zonedb)
         # db.echo = True
     
-        Base.metadata.create_all (db)
+        if schema.is_empty (db):
+            # new database is created with the current schema right away
+            Base.metadata.create_all (db)
+            schema.set_version (db, schema.SCHEMA_VERSION)
+        else:
+            # migrations are applied only explicitly, by ndns-db-upgrade
+            schema.check (db)
     
         sm = sessionmaker (bind = db)
         session = sm ()
         session.keydir = keydir
+        session.zonedb = zonedb
+        session.snapshotdir = "%s/snapshots" % libdir
 
         sessions[libdir] = session
         return session
@@ -95,40 +105,40 @@ def createSignedData (session, name, content, freshness, key, type = ndn.CONTENT
     co.sign (signingKey)
     return co
 
-def createSignedRRsetData (session, rrset, key, version = None):
-    label = dns.name.from_text (rrset.label).relativize (dns.name.root)
-
-    rdclass = rrset.rclass
-    rdtype = rrset.rtype
-
-    zone_name = rrset.zone.name
-    zone_origin = dns.name.from_text (dnsify (str (zone_name)))
+def createRRsetContent (origin, label, rdclass, rdtype, rrs):
+    """
+    Create content of the RR set Data packet
 
+    :param origin: DNS name of the zone (:py:class:`dns.name.Name`)
+    :param label: Relative DNS label of the RR set (:py:class:`dns.name.Name`)
+    :param rrs: List of tuples (ttl, wire-formatted RDATA)
+    :returns: tuple (content, freshness), freshness is -1 if it should be taken from the zone's SOA
+    """
     ttl = -1
     if rdtype == dns.rdatatype.NDNCERT:
         # Ok. Doing some cheat, treating NDNCERT data completely differently
-        content = rrset.rrs[0].dns_rrdata.cert
-        if (rrset.rrs[0].ttl < ttl):
-            ttl = rrset.rrs[0].ttl
+        (rr_ttl, rrdata) = rrs[0]
+        content = dns.rdata.from_wire (rdclass, rdtype, rrdata, 0, len (rrdata)).cert
+        if (rr_ttl < ttl):
+            ttl = rr_ttl
     else:
         newrrset = dns.rrset.RRset (label, rdclass, rdtype)
-        ttl = -1
-        for rr in rrset.rrs:
-            newrrset.add (ttl = rr.ttl, rd = dns.rdata.from_wire (rdclass, rdtype, rr.rrdata, 0, len (rr.rrdata)))
-            if (ttl == -1 or rr.ttl < ttl):
-                ttl = rr.ttl
+        for (rr_ttl, rrdata) in rrs:
+            newrrset.add (ttl = rr_ttl, rd = dns.rdata.from_wire (rdclass, rdtype, rrdata, 0, len (rrdata)))
+            if (ttl == -1 or rr_ttl < ttl):
+                ttl = rr_ttl
     
         msg = dns.message.Message (id=0)
         msg.answer.append (newrrset)
     
-        content = msg.to_wire (origin = zone_origin)
-    
-    if ttl <= -1:
-        if rrset.zone and rrset.zone.soa and rrset.zone.soa[0]:
-            ttl = rrset.zone.soa[0].rrs[0].ttl
-        else:
-            ttl = 3600
-    
+        content = msg.to_wire (origin = origin)
+
+    return (content, ttl)
+
+def createRRsetName (zone_name, label, rdtype, version = None):
+    """
+    Create NDN name of the RR set Data packet (``<zone>/DNS/<label>/<type>/<version>``)
+    """
     rrset_name = ndn.Name (zone_name)
     rrset_name = rrset_name.append ("DNS")
     if (len (label) > 0):
@@ -136,9 +146,26 @@ def createSignedRRsetData (session, rrset, key, version = None):
         for label in ndn_label:
             rrset_name = rrset_name.append (label)
     rrset_name = rrset_name.append (dns.rdatatype.to_text (rdtype))
-    rrset_name = rrset_name.appendVersion (version)
+    return rrset_name.appendVersion (version)
+
+def createSignedRRsetData (session, rrset, key, version = None):
+    label = dns.name.from_text (rrset.label).relativize (dns.name.root)
+
+    zone_name = rrset.zone.name
+    zone_origin = dns.name.from_text (dnsify (str (zone_name)))
+
+    (content, ttl) = createRRsetContent (zone_origin, label, rrset.rclass, rrset.rtype,
+                                         [(rr.ttl, rr.rrdata) for rr in rrset.rrs])
+    
+    if ttl <= -1:
+        if rrset.zone and rrset.zone.soa and rrset.zone.soa[0]:
+            ttl = rrset.zone.soa[0].rrs[0].ttl
+        else:
+            ttl = 3600
+    
+    rrset_name = createRRsetName (zone_name, label, rrset.rtype, version)
 
-    return createSignedData (session, rrset_name, content, ttl, key, type = ndn.CONTENT_DATA if rdtype != dns.rdatatype.NDNCERT else ndn.CONTENT_KEY)    
+    return createSignedData (session, rrset_name, content, ttl, key, type = ndn.CONTENT_DATA if rrset.rtype != dns.rdatatype.NDNCERT else ndn.CONTENT_KEY)    
 
 def add_rr (session, zone, origin, name, ttl, rdata):
     # print "Create record: '%s %s %d %s'" % (name, dns.rdatatype.to_text (rdata.rdtype), ttl, rdata.to_text ())
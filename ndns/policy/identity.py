@@ -19,6 +19,11 @@ _LOG = logging.getLogger ("ndns.policy.Identity")
 class IdentityPolicy:
     """
     Implementation of an identity policy
+
+    Verified keys are cached in ``trustedCache`` until they expire.  If ``persistentCache``
+    (:py:class:`ndns.query.persistent_cache.PersistentCache`) is set, verified key Data packets are
+    also stored there and looked up when the key is missing in memory, so trust is not re-established
+    from scratch after restart.
     """
 
     def __init__ (self, anchors = [], rules = [], chain_limit = 10, cachingQuery = None):
@@ -29,6 +34,43 @@ class IdentityPolicy:
 
         self.trustedCacheLimit = 10000
         self.trustedCache = {}
+        self.persistentCache = None
+
+    def _getTrusted (self, name):
+        """
+        Get verified key (ndn.Key) from memory or persistent cache
+
+        :raises KeyError: if the key is not cached or expired
+        """
+        name = str (name)
+        try:
+            [key, ttl] = self.trustedCache[name]
+            if time.time () > ttl:
+                del self.trustedCache[name]
+                raise KeyError ()
+            return key
+        except KeyError:
+            if self.persistentCache is None:
+                raise
+
+        stored = self.persistentCache.get (("trusted", name))
+        if stored is None:
+            raise KeyError ()
+
+        (data, not_used, expire) = stored
+        key = ndn.Key.createFromDER (public = ndn.Data.fromWire (data).content)
+        self.trustedCache[name] = [key, expire]
+        return key
+
+    def _putTrusted (self, keyDataPacket):
+        if len(self.trustedCache) > self.trustedCacheLimit:
+            self.trustedCache = {}
+
+        expire = int (time.time ()) + keyDataPacket.signedInfo.freshnessSeconds
+        self.trustedCache[str(keyDataPacket.name)] = [ndn.Key.createFromDER (public = keyDataPacket.content), expire]
+
+        if self.persistentCache is not None:
+            self.persistentCache.put (("trusted", str (keyDataPacket.name)), str (keyDataPacket.toWire ()), None, expire)
 
     def verifyAsync (self, face, dataPacket, onVerify, limit_left = 10):
         """
@@ -51,11 +93,7 @@ class IdentityPolicy:
         key_name = dataPacket.signedInfo.keyLocator.keyName
 
         try:
-            [key_data, ttl] = self.trustedCache[str(data_name)]
-            if time.time () > ttl:
-                del self.trustedCache[str(data_name)]
-                raise KeyError ()
-
+            self._getTrusted (data_name)
             onVerify (dataPacket, True)
             return
         except KeyError:
@@ -78,11 +116,7 @@ class IdentityPolicy:
             return
 
         try:
-            [key, ttl] = self.trustedCache[str(key_name)]
-            if time.time () > ttl:
-                del self.trustedCache[str(key_name)]
-                raise KeyError ()
-
+            key = self._getTrusted (key_name)
             _LOG.info ("%s Using cached trusted version of key [%s]" % ('--' * (11-limit_left), key_name))
 
             onVerify (dataPacket, dataPacket.verify_signature (key))
@@ -168,11 +202,7 @@ class NextLevelProcessor:
             self.parentCallback (self.dataPacket, False)
             return
 
-        if len(self.policy.trustedCache) > self.policy.trustedCacheLimit:
-            self.policy.trustedCache = {}
-
-        self.policy.trustedCache[str(keyDataPacket.name)] = [ndn.Key.createFromDER (public = keyDataPacket.content),
-                                                             int (time.time ()) + keyDataPacket.signedInfo.freshnessSeconds]
+        self.policy._putTrusted (keyDataPacket)
 
         self.parentCallback (self.dataPacket, True)
 
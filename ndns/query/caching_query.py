@@ -12,17 +12,308 @@
 import logging
 import ndn
 import time
+import functools
 import dns.rdatatype
+import dns.message
 from simple_query import SimpleQuery
 from iterative_query import IterativeQuery
+from ndns.cache import LruCache
 
 _LOG = logging.getLogger ("ndns.query.Caching")
 
+# approximate per-entry overhead (signature, parsed DNS message, bookkeeping), in addition to name and content
+_ENTRY_OVERHEAD = 512
+
 class CachingQuery:
-    def __init__ (self):
-        self.cache = {}
-        self.cache_zone = {}
-        self.cache_raw = {}
+    """
+    Query interface caching results of iterative, zone FH, and raw queries
+
+    All results share a single :py:class:`ndns.cache.LruCache`, bounded by number of entries and
+    (approximate) total size.  Entries expire according to freshness of the returned Data packets;
+    expired entries are reclaimed on lookup, a few at a time whenever new results are stored, and,
+    if ``purgeInterval`` is specified, all at once by a background thread.
+
+    Negative answers (NEXISTS, and NDNAUTH telling to go deeper) are cached in the spirit of RFC 2308:
+    for the freshness period of the Data packet, but no longer than the SOA minimum (if the answer
+    includes SOA) and ``negativeTtlLimit``.  As NEXISTS means that neither the queried label nor any
+    label below it has records of the queried type, the NEXISTS answer is also remembered for the
+    queried label itself and used to answer queries for all its descendants without going to the
+    network.  NEXISTS does not tell anything about other labels of the zone, so queries for sibling
+    labels are not covered and still go to the network.
+
+    Concurrent requests for the same result are coalesced: while a query is in flight, callbacks of
+    subsequent identical requests are attached to it, and all of them are completed by the single
+    network fetch (and verification).  A request that did not complete within ``inFlightTimeout``
+    seconds is no longer joined; the next identical request is expressed again (and completes all
+    the waiting callbacks).
+
+    If ``persistent`` cache (:py:class:`ndns.query.persistent_cache.PersistentCache`) is specified,
+    results of queries with verification enabled are also written to it (entries loaded from the
+    persistent cache are not verified again), and results missing in memory are looked up there
+    (and loaded back into memory) before going to the network, so the cache survives restarts.
+
+    Popular entries are refreshed ahead of expiration: each lookup of an entry increments its
+    popularity score, which decays exponentially with ``refreshHalfLife``.  When an entry with
+    score of at least ``refreshMinHits`` is served within the last ``refreshFraction`` of its
+    lifetime, the same request is expressed in background (as an in-flight request, so identical
+    requests join it) and the fresh result replaces the entry, while the current copy keeps being
+    served until then.  Busy entries therefore do not expire and make all clients wait for the
+    resolution at the same time.
+
+    Results of iterative and zone FH queries are Data packets returned by the final raw query, so
+    they never outlive the network fetch of that packet: their expiration is capped by the time the
+    packet was fetched plus its freshness, even if the result is stored (e.g., refreshed) later from
+    the cached raw entry.  To get a newer packet, the background refresh of such results fetches again
+    the intermediate entries that are themselves within the last ``refreshFraction`` of their lifetime,
+    instead of taking them from the cache.
+
+    :param limit: Maximum number of cached results
+    :param byteLimit: Maximum total size of cached results, None for no limit
+    :param purgeInterval: Period (in seconds) of reclaiming expired entries in background, None to disable
+    :param negativeTtlLimit: Maximum time (in seconds) to cache negative answers
+    :param inFlightTimeout: Time (in seconds) after which in-flight request is no longer joined
+    :param persistent: On-disk cache backend, None to keep results only in memory
+    :param refreshFraction: Fraction of the entry lifetime, within which popular entries are refreshed, 0 to disable
+    :param refreshMinHits: Minimum (decayed) number of lookups to consider entry popular
+    :param refreshHalfLife: Half-life (in seconds) of the popularity score
+    """
+
+    def __init__ (self, limit = 100000, byteLimit = 64 * 1024 * 1024, purgeInterval = None, negativeTtlLimit = 3 * 3600,
+                  inFlightTimeout = 60, persistent = None, refreshFraction = 0.1, refreshMinHits = 3, refreshHalfLife = 60.0):
+        self.cache = LruCache (limit, byteLimit)
+        self.persistent = persistent
+        if purgeInterval:
+            self.cache.startPurger (purgeInterval)
+
+        self.negativeTtlLimit = negativeTtlLimit
+        self.negativeHits = 0
+
+        # in-flight request key => [start time, list of (onResult, onError) callbacks waiting for the result]
+        self._inFlight = {}
+        self.inFlightTimeout = inFlightTimeout
+        self.coalesced = 0
+
+        # cache key => [popularity score, time of the last lookup]
+        self._popularity = {}
+        self.refreshFraction = refreshFraction
+        self.refreshMinHits = refreshMinHits
+        self.refreshHalfLife = refreshHalfLife
+        self.refreshes = 0
+
+        # Data packet name => expiration time of the packet, as fetched from the network by a raw query
+        self._packetExpiry = LruCache (limit)
+
+    @property
+    def stats (self):
+        stats = self.cache.stats
+        stats["negative_hits"] = self.negativeHits
+        stats["coalesced"] = self.coalesced
+        stats["in_flight"] = len (self._inFlight)
+        stats["refreshes"] = self.refreshes
+        if self.persistent is not None:
+            stats["persistent_hits"] = self.persistent.hits
+            stats["persistent_misses"] = self.persistent.misses
+        return stats
+
+    def _negativeTtl (self, ndn_data, dns_data):
+        """
+        Get caching time of the negative answer, or None if the answer is not negative
+        """
+        if dns_data is None:
+            return None
+
+        if len (dns_data.answer) > 0 and dns_data.answer[0].rdtype == dns.rdatatype.NEXISTS:
+            pass
+        elif len (dns_data.answer) == 0 and len (dns_data.authority) > 0 and \
+             dns_data.authority[0].rdtype == dns.rdatatype.NDNAUTH:
+            pass
+        else:
+            return None
+
+        ttl = min (ndn_data.signedInfo.freshnessSeconds, self.negativeTtlLimit)
+        for rrset in dns_data.authority:
+            if rrset.rdtype == dns.rdatatype.SOA:
+                ttl = min (ttl, rrset[0].minimum)
+        return ttl
+
+    def _ttl (self, ndn_data, dns_data):
+        """
+        Get caching time (full lifetime) of the result
+
+        :returns: tuple (ttl, flag whether the answer is negative)
+        """
+        ttl = self._negativeTtl (ndn_data, dns_data)
+        if ttl is not None:
+            return (ttl, True)
+        return (ndn_data.signedInfo.freshnessSeconds, False)
+
+    def _store (self, key, ndn_data, dns_data, encloser = None, verified = False):
+        (ttl, negative) = self._ttl (ndn_data, dns_data)
+
+        # the full lifetime is kept with the entry, as the baseline for refreshing ahead of expiration
+        size = len (str (ndn_data.name)) + len (ndn_data.content or "") + _ENTRY_OVERHEAD
+        expire = self._packetExpire (key, ndn_data, int (time.time ()) + ttl)
+        self.cache.put (key, (ndn_data, dns_data, ttl), size = size, expire = expire)
+
+        keys = [key]
+        if negative and encloser is not None and dns_data.answer[0].rdtype == dns.rdatatype.NEXISTS:
+            self.cache.put (("nexists",) + encloser, (ndn_data, dns_data, ttl), size = size, expire = expire)
+            keys.append (("nexists",) + encloser)
+
+        if self.persistent is not None and verified:
+            data = str (ndn_data.toWire ())
+            msg = dns_data.to_wire () if dns_data is not None else None
+            for stored in keys:
+                self.persistent.put (stored, data, msg, expire)
+
+    def _lookup (self, key):
+        """
+        Get cached (ndn_data, dns_data) tuple from memory or, if missing there, from the persistent cache
+
+        :returns: tuple ((ndn_data, dns_data), expiration time, full lifetime of the entry) or None
+        """
+        cached = self.cache.getEntry (key)
+        if cached is not None:
+            ((ndn_data, dns_data, ttl), expire) = cached
+            return ((ndn_data, dns_data), expire, ttl)
+        if self.persistent is None:
+            return None
+
+        stored = self.persistent.get (key)
+        if stored is None:
+            return None
+
+        (data, msg, expire) = stored
+        try:
+            ndn_data = ndn.Data.fromWire (data)
+            dns_data = dns.message.from_wire (msg) if msg is not None else None
+        except Exception, e:
+            _LOG.warn ("Ignoring corrupted entry [%s] in persistent cache: %s" % (key[1], e))
+            return None
+
+        ttl = self._ttl (ndn_data, dns_data)[0]
+        size = len (str (ndn_data.name)) + len (ndn_data.content or "") + _ENTRY_OVERHEAD
+        expire = self._packetExpire (key, ndn_data, expire)
+        self.cache.put (key, (ndn_data, dns_data, ttl), size = size, expire = expire)
+        return ((ndn_data, dns_data), expire, ttl)
+
+    def _packetExpire (self, key, ndn_data, expire):
+        """
+        Get expiration time of the entry holding the Data packet
+
+        Raw entries hold packets fetched from the network and define expiration of the packet.  Other
+        entries hold packets returned by raw queries and expire no later than the packet.
+        """
+        name = str (ndn_data.name)
+        if key[0] == "raw":
+            self._packetExpiry.put (name, expire, expire = expire)
+            return expire
+
+        fetched = self._packetExpiry.get (name)
+        if fetched is not None and fetched < expire:
+            return fetched
+        return expire
+
+    def _isExpiring (self, cached):
+        # whether the cached entry is within the last refreshFraction of its lifetime
+        if cached[1] is None:
+            return False
+        return cached[1] - time.time () <= self.refreshFraction * cached[2]
+
+    def _isRefreshDue (self, key, expire, ttl):
+        """
+        Account lookup of the entry and check whether it is popular and close enough to expiration to be refreshed
+        """
+        if self.refreshFraction <= 0 or expire is None:
+            return False
+
+        now = time.time ()
+        popularity = self._popularity.get (key)
+        if popularity is None:
+            if len (self._popularity) >= self.cache.limit:
+                self._prunePopularity (now)
+            popularity = [0.0, now]
+            self._popularity[key] = popularity
+
+        popularity[0] = popularity[0] * 0.5 ** ((now - popularity[1]) / self.refreshHalfLife) + 1
+        popularity[1] = now
+
+        return popularity[0] >= self.refreshMinHits and expire - now <= self.refreshFraction * ttl
+
+    def _prunePopularity (self, now):
+        # forget entries that were not looked up recently (score decayed below one lookup), or everything if all are active
+        self._popularity = dict ((key, popularity) for (key, popularity) in self._popularity.iteritems ()
+                                 if popularity[0] * 0.5 ** ((now - popularity[1]) / self.refreshHalfLife) >= 1)
+        if len (self._popularity) >= self.cache.limit:
+            self._popularity = {}
+
+    def _refreshAhead (self, key, cached, flight, express):
+        if not self._isRefreshDue (key, cached[1], cached[2]) or flight in self._inFlight:
+            return
+
+        _LOG.debug ("Refreshing popular cache entry [%s]" % key[1])
+        self.refreshes += 1
+        self._attach (flight, self._onRefreshed, functools.partial (self._onRefreshError, key))
+        express ()
+
+    def _onRefreshed (self, ndn_data, dns_data):
+        # the result is already stored by ResultCacher
+        pass
+
+    def _onRefreshError (self, key, message):
+        _LOG.info ("Failed to refresh cache entry [%s]: %s" % (key[1], message))
+
+    def _express (self, flight, key, encloser, verify, method, face, *args, **kwargs):
+        # express request on behalf of all callbacks attached to the in-flight request
+        method (face,
+                ResultCacher (self, key, functools.partial (self._onInFlightResult, flight), encloser, verify),
+                functools.partial (self._onInFlightError, flight),
+                *args, **kwargs)
+
+    def _attach (self, key, onResult, onError):
+        """
+        Register callbacks for the request
+
+        :returns: True if identical request is already in flight (callbacks will be called when it completes),
+                  False if the request should be expressed
+        """
+        now = time.time ()
+        flight = self._inFlight.get (key)
+        if flight is not None:
+            flight[1].append ((onResult, onError))
+            if now - flight[0] <= self.inFlightTimeout:
+                self.coalesced += 1
+                return True
+
+            # the request seems to be lost, express it again on behalf of all waiters
+            flight[0] = now
+            return False
+
+        self._inFlight[key] = [now, [(onResult, onError)]]
+        return False
+
+    def _onInFlightResult (self, key, ndn_data, dns_data):
+        for (onResult, onError) in self._inFlight.pop (key, [None, []])[1]:
+            try:
+                onResult (ndn_data, dns_data)
+            except Exception, e:
+                _LOG.warn ("Exception in onResult callback of [%s]: %s" % (key[1], e))
+
+    def _onInFlightError (self, key, message):
+        for (onResult, onError) in self._inFlight.pop (key, [None, []])[1]:
+            try:
+                onError (message)
+            except Exception, e:
+                _LOG.warn ("Exception in onError callback of [%s]: %s" % (key[1], e))
+
+    def _getCoveringNegative (self, zone, label, rrtype):
+        # NEXISTS cached for the label or any of its ancestors (except zone apex)
+        for i in xrange (len (label), 0, -1):
+            cached = self._lookup (("nexists", zone, label[:i], rrtype))
+            if cached is not None:
+                self.negativeHits += 1
+                return cached[0]
+        return None
 
     def expressQuery (self,
                       face,
@@ -37,56 +328,43 @@ class CachingQuery:
         if isinstance (rrtype, str):
             rrtype = dns.rdatatype.from_text (rrtype)
 
-        class Key:
-            def __init__ (self, name, type):
-                self.name = name
-                self.type = type
+        key = ("query", str (name), rrtype)
+        flight = key + (parse_dns, verify)
+        express = functools.partial (self._express, flight, key, None, verify, IterativeQuery.expressQuery,
+                                     face, name, rrtype, parse_dns, verify)
 
-            def __eq__ (self, other):
-                return self.name == other.name and self.type == other.type
-
-            def __ne__ (self, other):
-                return self.name != other.name or self.type != other.type
-
-            def __hash__ (self):
-                return str(self.name).__hash__ () + self.type
-
-        key = Key (name, rrtype)
-        try:
-            [result, msg, ttl] = self.cache[key]
-            if time.time () > ttl:
-                del self.cache[key]
-            else:
-                onResult (result, msg)
-                return
-
-        except KeyError:
-            pass
+        cached = self._lookup (key)
+        if cached is not None:
+            onResult (*cached[0])
+            self._refreshAhead (key, cached, flight, functools.partial (express, cache = _RefreshingQuery (self)))
+            return
 
-        IterativeQuery.expressQuery (face,
-                                     ResultCacher (self.cache, key, onResult), onError,
-                                     name, rrtype, parse_dns, verify, cache = self)
+        if self._attach (flight, onResult, onError):
+            return
+        express (cache = self)
 
     def expressQueryForZoneFh (self, face, onResult, onError, zone, verify):
-        key = str(zone)
-        try:
-            [result, msg, ttl] = self.cache_zone[key]
-            if time.time () > ttl:
-                del self.cache_zone[key]
-            else:
-                onResult (result, msg)
-                return
-        except KeyError:
-            pass
+        key = ("zone", str (zone))
+        flight = key + (verify,)
+        express = functools.partial (self._express, flight, key, None, verify, IterativeQuery.expressQueryForZoneFh,
+                                     face, zone, verify)
 
-        IterativeQuery.expressQueryForZoneFh (face,
-                                              ResultCacher (self.cache_zone, key, onResult), onError, zone, verify, cache = self)
+        cached = self._lookup (key)
+        if cached is not None:
+            onResult (*cached[0])
+            self._refreshAhead (key, cached, flight, functools.partial (express, cache = _RefreshingQuery (self)))
+            return
+
+        if self._attach (flight, onResult, onError):
+            return
+        express (cache = self)
 
     def expressQueryForRaw (self,
                             face,
                             onResult, onError,
                             query,
-                            zone = None, hint = None, label = None, rrtype = None, parse_dns = True, limit_left = 10, verify = True):
+                            zone = None, hint = None, label = None, rrtype = None, parse_dns = True, limit_left = 10, verify = True,
+                            refreshing = False):
         """
         Caching version of the most basic type of querying (:py:meth:`ndns.query.SimpleQuery.expressQueryForRaw`).
         The user has to explicity specify the authority zone, forwarding hint, label, and resource record type.
@@ -121,30 +399,49 @@ class CachingQuery:
         :type rrtype: str
         :param parse_dns: Flag whether to parse DNS message or not (default True)
         :type parse_dns: bool
+        :param refreshing: Flag whether the query is a part of the background refresh (cached result
+                           within the last ``refreshFraction`` of its lifetime is fetched again)
+        :type refreshing: bool
         """
         # _LOG.debug ('expressQueryForRaw')
 
-        key = str (query)
-        try:
-            [result, msg, ttl] = self.cache_raw [key]
-
-            if time.time () > ttl:
-                del self.cache_raw[key]
-            else:
-                onResult (result, msg)
+        key = ("raw", str (query))
+        encloser = None
+        if zone is not None and label is not None and rrtype is not None:
+            encloser = self._encloserKey (zone, label, rrtype)
+
+        flight = key + (parse_dns, verify)
+        express = functools.partial (self._express, flight, key, encloser, verify, SimpleQuery.expressQueryForRaw,
+                                     face, query, zone, hint, label, rrtype, parse_dns, limit_left, verify)
+
+        cached = self._lookup (key)
+        if cached is not None and not (refreshing and self._isExpiring (cached)):
+            onResult (*cached[0])
+            if not refreshing:
+                # lookups made by the refresh itself do not make entries popular
+                self._refreshAhead (key, cached, flight, express)
+            return
+
+        if encloser is not None and len (encloser[1]) > 0:
+            cached = self._getCoveringNegative (*encloser)
+            if cached is not None:
+                onResult (*cached)
                 return
-        except KeyError:
-            pass
 
-        SimpleQuery.expressQueryForRaw (face,
-                                        ResultCacher (self.cache_raw, key, onResult), onError,
-                                        query,
-                                        zone, hint, label, rrtype, parse_dns, limit_left, verify)
+        if self._attach (flight, onResult, onError):
+            return
+        express ()
+
+    @staticmethod
+    def _encloserKey (zone, label, rrtype):
+        if not isinstance (rrtype, str):
+            rrtype = dns.rdatatype.to_text (rrtype)
+        return (str (zone), tuple (str (component) for component in ndn.Name (label)), rrtype)
 
     def expressQueryFor (self,
                          face,
                          onResult, onError,
-                         zone, hint, label, rrtype, parse_dns = True, limit_left = 10, verify = True):
+                         zone, hint, label, rrtype, parse_dns = True, limit_left = 10, verify = True, refreshing = False):
 
         # _LOG.debug ('expressQueryFor')
         if isinstance(rrtype, str):
@@ -160,16 +457,45 @@ class CachingQuery:
         self.expressQueryForRaw (face,
                                  onResult, onError,
                                  query,
-                                 zone, hint, label, rrtype, parse_dns, limit_left, verify)
+                                 zone, hint, label, rrtype, parse_dns, limit_left, verify, refreshing = refreshing)
+
+class _RefreshingQuery:
+    """
+    CachingQuery used by iterative queries expressed to refresh cache entries (steps that are about
+    to expire are fetched from the network instead of being answered from the cache)
+    """
+
+    def __init__ (self, cachingQuery):
+        self.cachingQuery = cachingQuery
+
+    def expressQueryForRaw (self,
+                            face,
+                            onResult, onError,
+                            query,
+                            zone = None, hint = None, label = None, rrtype = None, parse_dns = True, limit_left = 10, verify = True):
+        self.cachingQuery.expressQueryForRaw (face,
+                                              onResult, onError,
+                                              query,
+                                              zone, hint, label, rrtype, parse_dns, limit_left, verify, refreshing = True)
+
+    def expressQueryFor (self,
+                         face,
+                         onResult, onError,
+                         zone, hint, label, rrtype, parse_dns = True, limit_left = 10, verify = True):
+        self.cachingQuery.expressQueryFor (face,
+                                           onResult, onError,
+                                           zone, hint, label, rrtype, parse_dns, limit_left, verify, refreshing = True)
 
 class ResultCacher:
-    def __init__ (self, cache, key, onResult):
-        self.cache = cache
+    def __init__ (self, cachingQuery, key, onResult, encloser = None, verified = False):
+        self.cachingQuery = cachingQuery
         self.key = key
         self.onResult = onResult
+        self.encloser = encloser
+        self.verified = verified
 
     def __call__ (self, ndn_data, dns_data):
-        self.cache[self.key] = [ndn_data, dns_data, int (time.time ()) + ndn_data.signedInfo.freshnessSeconds]
+        self.cachingQuery._store (self.key, ndn_data, dns_data, self.encloser, self.verified)
         self.onResult (ndn_data, dns_data)
 
 
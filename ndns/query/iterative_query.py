@@ -95,13 +95,32 @@ class IterativeQuery:
 
     def _onMostSpecificNsAnswer (self, result, msg):
         if (len(msg.answer)==0 and len(msg.authority)==1 and msg.authority[0].rdtype == dns.rdatatype.NDNAUTH):
-            self.getMostSpecificAnswer (tryEmptyLabel = False)
+            # there is no delegation for the label, but there is one more specific
+            self._goDeeper ()
+            return
 
         if (len(msg.answer) > 0 and msg.answer[0].rdtype == dns.rdatatype.NS):
             self._onNsResult (result, msg)
         else:
-            _LOG.debug ('Got %s instead of NS' % dns.rdatatype.to_text (msg.answer[0].rdtype))
+            if len(msg.answer) > 0:
+                _LOG.debug ('Got %s instead of NS' % dns.rdatatype.to_text (msg.answer[0].rdtype))
+            self._onNoMoreNsDelegation ()
+
+    def _goDeeper (self):
+        if self.i >= len (self.name):
             self._onNoMoreNsDelegation ()
+            return
+
+        component = self.name[self.i]
+        self.i += 1
+
+        self.label_logical = self.label_logical.append (ndnify (str(component)))
+        self.label_real    = self.label_real.append (component)
+
+        self.cachingQuery.expressQueryFor (self.face,
+                                           self._onMostSpecificNsAnswer, self.onError,
+                                           self.zone, self.hint, self.label_logical, dns.rdatatype.NS,
+                                           parse_dns = True, verify = self.verify)
 
     def _onNsResult (self, ns_result, ns_msg):
         ns_rrdata = random.choice (ns_msg.answer[0].items)
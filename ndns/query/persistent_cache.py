@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- Mode:python; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (c) 2013, Regents of the University of California
+#                     Alexander Afanasyev
+#
+# BSD license, See the doc/LICENSE file for more information
+#
+# Author: Alexander Afanasyev <alexander.afanasyev@ucla.edu>
+#
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+_LOG = logging.getLogger ("ndns.query.PersistentCache")
+
+class PersistentCache (object):
+    """
+    On-disk cache of query results, shared between processes and preserved across restarts
+
+    Entries (wire-formatted Data packets, optionally with the wire-formatted DNS message parsed from
+    them, and absolute expiration time) are stored in a single SQLite file and are read only on
+    lookup, when the entry is missing in the in-memory cache.  Entries are not verified again when
+    loaded, so users must store only verified results (:py:class:`ndns.query.CachingQuery` stores
+    only results of queries with verification enabled, :py:class:`ndns.policy.identity.IdentityPolicy`
+    only keys that passed the trust policy).
+
+    Expired entries are deleted and the freed space is returned to the file system every
+    ``compactInterval`` seconds (checked when entries are added) or on explicit :py:meth:`compact`.
+
+    :param path: Path to the cache file
+    :param maxEntries: Maximum number of entries kept after compaction (entries expiring first are dropped)
+    :param compactInterval: Period (in seconds) of automatic compaction
+    """
+
+    def __init__ (self, path, maxEntries = 1000000, compactInterval = 600):
+        self.path = os.path.expanduser (path)
+        self.maxEntries = maxEntries
+        self.compactInterval = compactInterval
+
+        directory = os.path.dirname (self.path)
+        if directory and not os.path.exists (directory):
+            os.makedirs (directory)
+
+        self._lock = threading.Lock ()
+        self._conn = sqlite3.connect (self.path, check_same_thread = False, timeout = 5)
+        self._conn.text_factory = str
+        # incremental vacuum must be enabled before the table is created
+        self._conn.execute ("PRAGMA auto_vacuum = INCREMENTAL")
+        self._conn.execute ("PRAGMA journal_mode = WAL")
+        self._conn.execute ("PRAGMA synchronous = NORMAL")
+        self._conn.execute ("CREATE TABLE IF NOT EXISTS entries (key VARCHAR PRIMARY KEY, data BLOB, msg BLOB, expire INTEGER)")
+        self._conn.execute ("CREATE INDEX IF NOT EXISTS ix_entries_expire ON entries (expire)")
+        self._conn.commit ()
+
+        self._lastCompact = time.time ()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key (key):
+        if isinstance (key, tuple):
+            return "\t".join (str (component) for component in key)
+        return str (key)
+
+    def get (self, key):
+        """
+        :returns: tuple (wire-formatted Data packet, wire-formatted DNS message or None, expiration time)
+                  or None if there is no such entry or it has expired
+        """
+        with self._lock:
+            try:
+                row = self._conn.execute ("SELECT data, msg, expire FROM entries WHERE key = ? AND expire > ?",
+                                          (self._key (key), int (time.time ()))).fetchone ()
+            except sqlite3.Error, e:
+                _LOG.warn ("Cannot read entry from persistent cache [%s]: %s" % (self.path, e))
+                row = None
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return (str (row[0]), str (row[1]) if row[1] is not None else None, row[2])
+
+    def put (self, key, data, msg, expire):
+        """
+        Store entry
+
+        :param data: Wire-formatted Data packet
+        :param msg: Wire-formatted DNS message or None
+        :param expire: Absolute expiration time
+        """
+        with self._lock:
+            try:
+                self._conn.execute ("INSERT OR REPLACE INTO entries (key, data, msg, expire) VALUES (?, ?, ?, ?)",
+                                    (self._key (key), buffer (data), buffer (msg) if msg is not None else None, int (expire)))
+                self._conn.commit ()
+            except sqlite3.Error, e:
+                # e.g., the file is locked by another process for too long; the entry is simply not persisted
+                _LOG.warn ("Cannot store entry in persistent cache [%s]: %s" % (self.path, e))
+                self._conn.rollback ()
+                return
+
+        if time.time () - self._lastCompact > self.compactInterval:
+            self.compact ()
+
+    def compact (self):
+        """
+        Delete expired entries (and entries above ``maxEntries``) and return free pages to the file system
+
+        :returns: number of deleted entries
+        """
+        self._lastCompact = time.time ()
+        with self._lock:
+            try:
+                deleted = self._conn.execute ("DELETE FROM entries WHERE expire <= ?", (int (time.time ()),)).rowcount
+                deleted += self._conn.execute ("DELETE FROM entries WHERE key IN "
+                                               "(SELECT key FROM entries ORDER BY expire DESC LIMIT -1 OFFSET ?)",
+                                               (self.maxEntries,)).rowcount
+                self._conn.commit ()
+                # each step of the statement frees one page, so it needs to be stepped to completion
+                self._conn.execute ("PRAGMA incremental_vacuum").fetchall ()
+            except sqlite3.Error, e:
+                _LOG.warn ("Cannot compact persistent cache [%s]: %s" % (self.path, e))
+                self._conn.rollback ()
+                return 0
+
+        _LOG.debug ("Compacted persistent cache [%s], %d entries deleted" % (self.path, deleted))
+        return deleted
+
+    def close (self):
+        with self._lock:
+            self._conn.close ()
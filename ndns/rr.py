@@ -37,7 +37,7 @@ class RR (Base):
     id = Column (Integer, index=True, primary_key = True)
     rrset_id = Column (Integer, ForeignKey ("rrsets.id", onupdate="CASCADE", ondelete="CASCADE"), index=True)
     ttl = Column (Integer, index=True)
-    _rrdata = Column ("rrdata", Binary, index=True)
+    _rrdata = Column ("rrdata", Binary)
 
     @property
     def rrdata (self):
@@ -63,3 +63,11 @@ class RR (Base):
     def has_rrdata (self, other, origin):
         """Facilitate SQL comparison with another RDATA in wire format"""
         return self._rrdata == buffer (other.to_digestable (origin = origin))
+
+def _mark_rrset_dirty (target, value, oldvalue, initiator):
+    # only if RR set is already loaded, to avoid lazy loads (and autoflushes) from within the event
+    rrset = target.__dict__.get ("rrset")
+    if rrset is not None:
+        rrset.dirty = True
+event.listen (RR._rrdata, 'set', _mark_rrset_dirty)
+event.listen (RR.ttl, 'set', _mark_rrset_dirty)
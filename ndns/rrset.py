@@ -10,18 +10,77 @@
 # 
 
 import ndn
+import time
+import struct
+import hashlib
 
-from sqlalchemy import Table, MetaData, Column, ForeignKey, Integer, String, Binary, UniqueConstraint, event
-from sqlalchemy.orm import relationship, backref
-from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy import Table, MetaData, Column, ForeignKey, Integer, String, Binary, Boolean, Index, event, and_
+from sqlalchemy.orm import relationship, backref, Session
+from sqlalchemy.ext.hybrid import hybrid_property, hybrid_method
 from sqlalchemy.orm.collections import attribute_mapped_collection
 from sqlalchemy.orm.collections import collection
-from sqlalchemy.orm import deferred
 
 import ndns
 from ndns import Base
+from blob import Blob, blob_digest, store_blob
 
 import dns.message
+import dns.name
+
+def reverse_label (label):
+    """
+    Convert DNS label (relative to the zone) into a lower-cased string with reversed order of
+    label components, terminated by a period (e.g., ``www.Sub`` becomes ``sub.www.``, while zone apex
+    ``@`` becomes an empty string).
+
+    All labels below the ``label`` share the returned string as a prefix, so they can be found
+    using a simple range search.
+    """
+    name = dns.name.from_text (label, origin = None)
+    if name.is_absolute ():
+        name = name.relativize (dns.name.root)
+
+    return "".join ("%s." % component.lower () for component in reversed (name.labels))
+
+def rrs_content_hash (rrs):
+    """
+    Get hash of RR set content, independent of the order of RRs
+
+    :param rrs: List of tuples (ttl, wire-formatted RDATA)
+    """
+    digest = hashlib.sha256 ()
+    for (ttl, rrdata) in sorted (rrs):
+        digest.update (struct.pack ("!qI", ttl, len (rrdata)))
+        digest.update (rrdata)
+    return digest.hexdigest ()
+
+def lock_rrsets_state (connection, ids):
+    """
+    Start write transaction and get the current state of RR sets (for tools that sign RR sets outside
+    of a transaction and need to detect RR sets changed meanwhile, e.g., by DyNDNS updates)
+
+    The RR sets are touched by a no-op UPDATE, so the write lock is held and the returned state cannot
+    change until the transaction is committed.
+
+    :param connection: Raw connection of the session (``session.connection ()``)
+    :param ids: List of RR set ids
+    :returns: dict RR set id => (digest of the Data packet, content hash of RRs)
+    """
+    if len (ids) == 0:
+        return {}
+
+    placeholders = ",".join ("?" * len (ids))
+    connection.execute ("UPDATE rrsets SET dirty = dirty WHERE id IN (%s)" % placeholders, ids)
+
+    rrs = {}
+    for (rrset_id, ttl, rrdata) in connection.execute ("SELECT rrset_id, ttl, rrdata FROM rrs WHERE rrset_id IN (%s)" %
+                                                       placeholders, ids):
+        rrs.setdefault (rrset_id, []).append ((ttl, str (rrdata)))
+
+    state = {}
+    for (rrset_id, digest) in connection.execute ("SELECT id, ndndata_digest FROM rrsets WHERE id IN (%s)" % placeholders, ids):
+        state[rrset_id] = (digest, rrs_content_hash (rrs.get (rrset_id, [])))
+    return state
 
 class RRSet (Base):
     """
@@ -35,10 +94,34 @@ class RRSet (Base):
             label VARCHAR,
             rclass INTEGER,
             rtype INTEGER,
-            ndndata BLOB,
+            ndndata_digest VARCHAR,
+            rlabel VARCHAR,
+            signed_at INTEGER,
+            signed_key_id INTEGER,
+            content_hash VARCHAR,
+            dirty BOOLEAN,
             PRIMARY KEY (id),
-            FOREIGN KEY(zone_id) REFERENCES zones (id) ON DELETE CASCADE ON UPDATE CASCADE
+            FOREIGN KEY(zone_id) REFERENCES zones (id) ON DELETE CASCADE ON UPDATE CASCADE,
+            FOREIGN KEY(ndndata_digest) REFERENCES blobs (digest)
         );
+        CREATE INDEX ix_rrsets_zone_id_label_rclass_rtype ON rrsets (zone_id, label, rclass, rtype);
+        CREATE INDEX ix_rrsets_zone_id_rtype_rlabel ON rrsets (zone_id, rtype, rlabel);
+        CREATE INDEX ix_rrsets_ndndata_digest ON rrsets (ndndata_digest);
+        CREATE INDEX ix_rrsets_zone_id_dirty ON rrsets (zone_id, dirty);
+        CREATE INDEX ix_rrsets_zone_id_signed_at ON rrsets (zone_id, signed_at);
+
+    ``rlabel`` column contains reversed label (see :py:func:`reverse_label`) and is automatically
+    updated whenever ``label`` is set.
+
+    Signed Data packet of the RR set is not stored in the row itself, but in the content-addressed
+    :py:class:`ndns.blob.Blob` store, referenced by ``ndndata_digest``.  The packet is loaded only when
+    accessed, and is written to the blob store when the RR set is flushed.
+
+    Signing state is tracked to allow incremental re-signing (see :py:mod:`ndns.tools.resign`):
+    ``signed_at`` (UNIX time) and ``signed_key_id`` (:py:class:`ndns.key.Key` id) are recorded whenever
+    the RR set is signed by one of zone's keys, ``content_hash`` is :py:func:`rrs_content_hash` of
+    the signed RRs, and ``dirty`` is set whenever RRs are added or removed.  Data packets signed
+    elsewhere (e.g., DyNDNS updates) have ``signed_key_id`` set to NULL.
 
     :ivar rrset: One-to-many relationship to :py:class:`ndns.rr.RR` data
     :ivar zone: Back-reference to the :py:class:`ndns.zone.Zone` to which the key belongs
@@ -52,9 +135,43 @@ class RRSet (Base):
     label = Column (String, index=True)
     rclass = Column (Integer, index=True)
     rtype = Column (Integer, index=True)
-    _ndndata = Column ("ndndata", Binary, index=True)
-    
-    zone_id_label_rclass_rtype = UniqueConstraint ("zone_id", "label", "rclass", "rtype")
+    ndndata_digest = Column (String, ForeignKey ("blobs.digest"))
+    rlabel = Column (String)
+
+    signed_at = Column (Integer)
+    signed_key_id = Column (Integer)
+    content_hash = Column (String)
+    dirty = Column (Boolean, default = False)
+
+    _blob = relationship ("Blob", lazy = "select", viewonly = True)
+
+    __table_args__ = (Index ("ix_rrsets_zone_id_label_rclass_rtype", "zone_id", "label", "rclass", "rtype"),
+                      Index ("ix_rrsets_zone_id_rtype_rlabel", "zone_id", "rtype", "rlabel"),
+                      Index ("ix_rrsets_ndndata_digest", "ndndata_digest"),
+                      Index ("ix_rrsets_zone_id_dirty", "zone_id", "dirty"),
+                      Index ("ix_rrsets_zone_id_signed_at", "zone_id", "signed_at"))
+
+    @property
+    def _ndndata (self):
+        """
+        Get wire format of the signed Data packet (lazily loaded from the blob store)
+        """
+        try:
+            return self._ndndataWire
+        except AttributeError:
+            if self._blob is None:
+                return None
+            return self._blob.data
+
+    @_ndndata.setter
+    def _ndndata (self, value):
+        if value is None:
+            self.ndndata_digest = None
+        else:
+            value = str (value)
+            self.ndndata_digest = blob_digest (value)
+        self._ndndataWire = value
+        self._ndndataPending = value is not None
 
     @property
     def ndndata (self):
@@ -66,9 +183,12 @@ class RRSet (Base):
     @ndndata.setter
     def ndndata (self, value):
         """
-        Save Data packet in the database in its wire format
+        Save Data packet (signed elsewhere) in the database in its wire format
         """
         self._ndndata = value.toWire ()
+        self.signed_at = int (time.time ())
+        self.signed_key_id = None
+        self.dirty = False
 
     @property
     def dns_label (self):
@@ -77,6 +197,25 @@ class RRSet (Base):
         """
         return dns.name.from_text (self.label).relativize (dns.name.root)
 
+    @hybrid_method
+    def is_below (self, label):
+        """
+        Check if the RR set is more specific than the ``label`` (e.g., ``www.sub`` is below ``sub``)
+
+        In SQL context, results in a range condition on the indexed ``rlabel`` column.
+        """
+        prefix = reverse_label (label)
+        return self.rlabel.startswith (prefix) and len (self.rlabel) > len (prefix)
+
+    @is_below.expression
+    def is_below (cls, label):
+        prefix = reverse_label (label)
+        if prefix == "":
+            return cls.rlabel > ""
+
+        # '/' immediately follows '.' and terminates the range of prefix-matching strings
+        return and_ (cls.rlabel > prefix, cls.rlabel < "%s/" % prefix[:-1])
+
     @property
     def dns_msg (self):
         """
@@ -94,9 +233,29 @@ class RRSet (Base):
         :type key: :py:class:`ndns.key.Key`
         """
         self._ndndata = ndns.createSignedRRsetData (session, self, key).toWire ()
+        self.signed_at = int (time.time ())
+        self.signed_key_id = key.id
+        self.content_hash = rrs_content_hash ([(rr.ttl, str (rr.rrdata)) for rr in self.rrs])
+        self.dirty = False
 
 
 def _check_if_soa (target, value, initiator):
     if target.rtype == dns.rdatatype.SOA:
         target.zone.soa = [target]
 event.listen (RRSet.rrs, 'append', _check_if_soa)
+
+def _mark_dirty (target, value, initiator):
+    target.dirty = True
+event.listen (RRSet.rrs, 'append', _mark_dirty)
+event.listen (RRSet.rrs, 'remove', _mark_dirty)
+
+def _update_rlabel (target, value, oldvalue, initiator):
+    target.rlabel = reverse_label (value) if value is not None else None
+event.listen (RRSet.label, 'set', _update_rlabel)
+
+def _store_ndndata (session, flush_context, instances):
+    for obj in session.new.union (session.dirty):
+        if isinstance (obj, RRSet) and getattr (obj, "_ndndataPending", False):
+            store_blob (session, obj._ndndataWire)
+            obj._ndndataPending = False
+event.listen (Session, 'before_flush', _store_ndndata)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- Mode:python; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (c) 2013, Regents of the University of California
+#                     Alexander Afanasyev
+#
+# BSD license, See the doc/LICENSE file for more information
+#
+# Author: Alexander Afanasyev <alexander.afanasyev@ucla.edu>
+#
+
+"""
+Versioning of the zone database schema
+
+Version of the schema is recorded in SQLite ``user_version`` pragma (databases created before versioning
+was introduced have version 0).  Each migration brings the database from the previous version to the next
+one; migrations are idempotent, so an interrupted upgrade can be safely repeated.
+
+Migrations can take long time on large databases, so they are applied only explicitly by ``ndns-db-upgrade``;
+sessions (:py:func:`ndns.ndns_session`) refuse to open databases with outdated schema.
+"""
+
+import logging
+
+from rrset import reverse_label
+from blob import blob_digest
+
+_LOG = logging.getLogger ("ndns.Schema")
+
+class SchemaVersionError (RuntimeError):
+    pass
+
+def _add_rlabel (db):
+    # reversed label column and index for range searches of more specific records
+    columns = [row[1] for row in db.execute ("PRAGMA table_info(rrsets)")]
+    if not "rlabel" in columns:
+        db.execute ("ALTER TABLE rrsets ADD COLUMN rlabel VARCHAR")
+
+    with db.begin () as conn:
+        for (rrset_id, label) in conn.execute ("SELECT id, label FROM rrsets WHERE rlabel IS NULL").fetchall ():
+            conn.execute ("UPDATE rrsets SET rlabel = ? WHERE id = ?", (reverse_label (label), rrset_id))
+
+    db.execute ("CREATE INDEX IF NOT EXISTS ix_rrsets_zone_id_rtype_rlabel ON rrsets (zone_id, rtype, rlabel)")
+
+def _fix_indexes (db):
+    # composite index for RR set lookups (not unique, as existing databases may contain duplicates)
+    db.execute ("CREATE INDEX IF NOT EXISTS ix_rrsets_zone_id_label_rclass_rtype ON rrsets (zone_id, label, rclass, rtype)")
+
+    # indexes on signatures and RDATA blobs are never used by queries
+    db.execute ("DROP INDEX IF EXISTS ix_rrsets_ndndata")
+    db.execute ("DROP INDEX IF EXISTS ix_rrs_rrdata")
+
+def _move_ndndata_to_blobs (db):
+    # signed Data packets are moved from rrsets rows into content-addressed blob store
+    db.execute ("CREATE TABLE IF NOT EXISTS blobs (digest VARCHAR NOT NULL, data BLOB, PRIMARY KEY (digest))")
+
+    columns = [row[1] for row in db.execute ("PRAGMA table_info(rrsets)")]
+    if not "ndndata_digest" in columns:
+        db.execute ("ALTER TABLE rrsets ADD COLUMN ndndata_digest VARCHAR REFERENCES blobs (digest)")
+
+    if "ndndata" in columns:
+        # SQLite cannot drop columns; the old column is emptied, and space is returned by VACUUM
+        while True:
+            with db.begin () as conn:
+                rows = conn.execute ("SELECT id, ndndata FROM rrsets WHERE ndndata IS NOT NULL LIMIT 1000").fetchall ()
+                for (rrset_id, ndndata) in rows:
+                    digest = blob_digest (ndndata)
+                    conn.execute ("INSERT OR IGNORE INTO blobs (digest, data) VALUES (?, ?)", (digest, ndndata))
+                    conn.execute ("UPDATE rrsets SET ndndata_digest = ?, ndndata = NULL WHERE id = ?", (digest, rrset_id))
+            if len (rows) == 0:
+                break
+
+    db.execute ("CREATE INDEX IF NOT EXISTS ix_rrsets_ndndata_digest ON rrsets (ndndata_digest)")
+
+def _add_signing_state (db):
+    # per-RR set signing state for incremental re-signing (unknown for existing RR sets)
+    columns = [row[1] for row in db.execute ("PRAGMA table_info(rrsets)")]
+    for (column, sqltype) in [("signed_at", "INTEGER"),
+                              ("signed_key_id", "INTEGER"),
+                              ("content_hash", "VARCHAR"),
+                              ("dirty", "BOOLEAN")]:
+        if not column in columns:
+            db.execute ("ALTER TABLE rrsets ADD COLUMN %s %s" % (column, sqltype))
+
+    db.execute ("CREATE INDEX IF NOT EXISTS ix_rrsets_zone_id_dirty ON rrsets (zone_id, dirty)")
+    db.execute ("CREATE INDEX IF NOT EXISTS ix_rrsets_zone_id_signed_at ON rrsets (zone_id, signed_at)")
+
+# MIGRATIONS[i] upgrades the schema from version i to version i+1
+MIGRATIONS = [
+    _add_rlabel,
+    _fix_indexes,
+    _move_ndndata_to_blobs,
+    _add_signing_state,
+]
+
+SCHEMA_VERSION = len (MIGRATIONS)
+
+def get_version (db):
+    """
+    :param db: SQLAlchemy engine of the zone database
+    """
+    return db.execute ("PRAGMA user_version").scalar ()
+
+def is_empty (db):
+    """
+    Check if the database has no tables yet (i.e., it has just been created)
+    """
+    return db.execute ("SELECT count(*) FROM sqlite_master WHERE type = 'table'").scalar () == 0
+
+def set_version (db, version):
+    db.execute ("PRAGMA user_version = %d" % version)
+
+def check (db):
+    """
+    Make sure that the database has the current schema version
+
+    :raises SchemaVersionError: if the database needs to be upgraded (or is newer than supported)
+    """
+    version = get_version (db)
+    if version < SCHEMA_VERSION:
+        raise SchemaVersionError ("Database schema version %d is older than current version %d, run ndns-db-upgrade to upgrade it" %
+                                  (version, SCHEMA_VERSION))
+    if version > SCHEMA_VERSION:
+        raise SchemaVersionError ("Database schema version %d is newer than supported version %d" % (version, SCHEMA_VERSION))
+
+def upgrade (db):
+    """
+    Apply all pending migrations
+
+    :param db: SQLAlchemy engine of the zone database
+    :returns: tuple (version before the upgrade, version after the upgrade)
+    """
+    version = get_version (db)
+    if version > SCHEMA_VERSION:
+        raise SchemaVersionError ("Database schema version %d is newer than supported version %d" % (version, SCHEMA_VERSION))
+
+    initial = version
+    while version < SCHEMA_VERSION:
+        _LOG.info ("Upgrading database schema from version %d to %d" % (version, version + 1))
+        MIGRATIONS[version] (db)
+        version += 1
+        set_version (db, version)
+
+    return (initial, version)
+
+def vacuum (db):
+    """
+    Rebuild the database file, returning space freed by dropped indexes and deleted records to the file system
+    """
+    db.execute ("VACUUM")
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- Mode:python; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (c) 2013, Regents of the University of California
+#                     Alexander Afanasyev
+#
+# BSD license, See the doc/LICENSE file for more information
+#
+# Author: Alexander Afanasyev <alexander.afanasyev@ucla.edu>
+#
+
+import ndn
+import logging
+import multiprocessing
+import threading
+import functools
+import signal
+import time
+
+_LOG = logging.getLogger ("ndns.Signing")
+
+# private keys loaded by the worker process, keyed by the key file name
+_keys = {}
+
+def init_worker ():
+    """
+    Initializer of signing worker processes (signals are handled by the parent process only)
+    """
+    signal.signal (signal.SIGINT,  signal.SIG_IGN)
+    signal.signal (signal.SIGTERM, signal.SIG_DFL)
+    signal.signal (signal.SIGQUIT, signal.SIG_DFL)
+    signal.signal (signal.SIGUSR1, signal.SIG_IGN)
+
+def load_key (keyfile):
+    """
+    Load private key from the file, reusing already loaded keys (within the worker process)
+    """
+    try:
+        return _keys[keyfile]
+    except KeyError:
+        key = ndn.Key ()
+        key.fromPEM (keyfile)
+        _keys[keyfile] = key
+        return key
+
+def _sign (task):
+    """
+    Sign Data packet inside the worker process
+
+    :returns: tuple (wire-formatted signed Data packet, None) or (None, error message)
+    """
+    (keyfile, name, content, freshness, key_locator, type) = task
+    try:
+        signingKey = load_key (keyfile)
+        signedInfo = ndn.SignedInfo (key_digest = signingKey.publicKeyID,
+                                     key_locator = ndn.KeyLocator (ndn.Name (key_locator)),
+                                     freshness = freshness,
+                                     type = type)
+
+        co = ndn.Data (name = ndn.Name (name), signed_info = signedInfo, content = content)
+        co.sign (signingKey)
+        return (str (co.toWire ()), None)
+    except Exception, e:
+        return (None, "%s" % e)
+
+class SigningPool (object):
+    """
+    Pool of worker processes performing private key operations outside the main process
+
+    Results are handed back using ``deliver`` callable (e.g., ``ndn.EventLoop.execute``), so
+    callbacks are always executed in the context of the main event loop, never in the result
+    handler thread of the pool.
+
+    :param keydir: Key directory
+    :type keydir: str
+    :param deliver: Callable accepting a function to be executed (in the event loop) with the signing result
+    :param workers: Number of worker processes (default: number of CPU cores)
+    :type workers: int
+    """
+
+    def __init__ (self, keydir, deliver, workers = None):
+        if deliver is None:
+            raise ValueError ("SigningPool requires deliver callable to hand results back to the event loop")
+
+        self.keydir = keydir
+        self.workers = workers if workers else multiprocessing.cpu_count ()
+        self._deliver = deliver
+
+        self._lock = threading.Lock ()
+        self.pending = 0
+        self.signed = 0
+        self.failed = 0
+        self.totalLatency = 0.0
+        self.maxLatency = 0.0
+
+        self._pool = multiprocessing.Pool (self.workers, init_worker)
+
+    @property
+    def stats (self):
+        with self._lock:
+            return {"workers": self.workers,
+                    "queue_depth": self.pending,
+                    "signed": self.signed,
+                    "failed": self.failed,
+                    "avg_latency": self.totalLatency / self.signed if self.signed > 0 else 0.0,
+                    "max_latency": self.maxLatency}
+
+    def sign (self, name, content, freshness, key, onSigned, type = ndn.CONTENT_DATA):
+        """
+        Queue Data packet for signing
+
+        :param key: :py:class:`ndns.key.Key` object that should be used for signing
+        :param onSigned: Callback receiving signed :py:class:`ndn.Data` packet.  Not called if
+                         signing fails
+        """
+        task = ("%s/%s.pri" % (self.keydir, key.local_key_id),
+                str (name), str (content), freshness, str (key.name), type)
+
+        with self._lock:
+            self.pending += 1
+
+        self._pool.apply_async (_sign, (task,),
+                                callback = functools.partial (self._onSigned, name, time.time (), onSigned))
+
+    def close (self):
+        self._pool.close ()
+        self._pool.join ()
+
+    def _onSigned (self, name, started, onSigned, result):
+        # executed in the result handler thread of the pool, which must never be terminated by an exception
+        try:
+            (wire, error) = result
+            latency = time.time () - started
+
+            with self._lock:
+                self.pending -= 1
+                if wire is None:
+                    self.failed += 1
+                else:
+                    self.signed += 1
+                    self.totalLatency += latency
+                    self.maxLatency = max (self.maxLatency, latency)
+
+            if wire is None:
+                _LOG.warn ("Failed to sign [%s]: %s" % (name, error))
+                return
+
+            dataPacket = ndn.Data.fromWire (wire)
+            self._deliver (functools.partial (onSigned, dataPacket))
+        except Exception, e:
+            _LOG.error ("Failed to deliver signed Data packet [%s]: %s" % (name, e))
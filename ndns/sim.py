@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- Mode:python; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (c) 2013, Regents of the University of California
+#                     Alexander Afanasyev
+#
+# BSD license, See the doc/LICENSE file for more information
+#
+# Author: Alexander Afanasyev <alexander.afanasyev@ucla.edu>
+#
+
+"""
+In-process simulation of NDN forwarding, allowing producers (e.g., :py:class:`ndns.tools.ndns_daemon.NdnsDaemon`)
+and consumers (e.g., :py:class:`ndns.query.CachingQuery`) to exchange Interests and Data without a running
+forwarder.
+
+:py:class:`Face` and :py:class:`EventLoop` mimic ``ndn.Face`` and ``ndn.EventLoop`` (same methods and callback
+signatures), while time is driven by a virtual :py:class:`Clock`, so the results are reproducible::
+
+    network = ndns.sim.Network (latency = 0.010, loss = 0.01, seed = 1)
+    producer = network.createFace ()
+    consumer = network.createFace ()
+    network.setLink (consumer, producer, latency = 0.050)
+
+    daemon.start (producer, ndns.sim.EventLoop (producer))
+    consumer.expressInterest (name, onData, onTimeout)
+    ndns.sim.EventLoop (consumer).run ()
+"""
+
+import heapq
+import random
+import threading
+import logging
+
+_LOG = logging.getLogger ("ndns.Sim")
+
+class Clock (object):
+    """Virtual clock, advanced only by processing of scheduled events"""
+
+    def __init__ (self, start = 0.0):
+        self.now = start
+
+    def time (self):
+        return self.now
+
+class Interest (object):
+    """Minimal Interest packet, carrying only the name and lifetime"""
+
+    def __init__ (self, name, interestLifetime = 4.0):
+        self.name = name
+        self.interestLifetime = interestLifetime
+
+    def __repr__ (self):
+        return "Interest(%s)" % self.name
+
+class _Event (object):
+    __slots__ = ["time", "seq", "callback", "cancelled"]
+
+    def __init__ (self, time, seq, callback):
+        self.time = time
+        self.seq = seq
+        self.callback = callback
+        self.cancelled = False
+
+    def __lt__ (self, other):
+        return (self.time, self.seq) < (other.time, other.seq)
+
+class _PendingInterest (object):
+    __slots__ = ["interest", "face", "onData", "onTimeout", "timeout"]
+
+    def __init__ (self, interest, face, onData, onTimeout):
+        self.interest = interest
+        self.face = face
+        self.onData = onData
+        self.onTimeout = onTimeout
+        self.timeout = None
+
+class Network (object):
+    """
+    Simulated network connecting all faces created with :py:meth:`createFace`
+
+    Each Interest is delivered to the face with the longest matching Interest filter; Data is delivered
+    back to all faces with pending Interests that match the Data name.
+
+    :param latency: Default one-way latency (in seconds) between any two faces
+    :param loss: Default probability that a packet is lost
+    :param seed: Seed for the random number generator deciding packet losses
+    :param clock: :py:class:`Clock` object (new clock is created by default)
+    """
+
+    def __init__ (self, latency = 0.0, loss = 0.0, seed = 0, clock = None):
+        self.latency = latency
+        self.loss = loss
+        self.clock = clock if clock else Clock ()
+
+        self._random = random.Random (seed)
+        self._links = {}
+        self._filters = [] # (prefix, face, onInterest)
+        self._pit = []
+
+        self._events = []
+        self._seq = 0
+        self._lock = threading.Lock ()
+
+        self.sentInterests = 0
+        self.sentData = 0
+        self.lostPackets = 0
+        self.timeouts = 0
+
+    def createFace (self):
+        return Face (self)
+
+    def setLink (self, faceA, faceB, latency = None, loss = None):
+        """
+        Override latency and/or loss between two faces (in both directions)
+        """
+        params = (self.latency if latency is None else latency, self.loss if loss is None else loss)
+        self._links[(id (faceA), id (faceB))] = params
+        self._links[(id (faceB), id (faceA))] = params
+
+    def schedule (self, delay, callback):
+        """
+        Schedule callback to be executed after ``delay`` seconds of virtual time
+
+        :returns: event handle that can be passed to :py:meth:`cancel`
+        """
+        with self._lock:
+            self._seq += 1
+            event = _Event (self.clock.now + delay, self._seq, callback)
+            heapq.heappush (self._events, event)
+            return event
+
+    def cancel (self, event):
+        event.cancelled = True
+
+    def processEvents (self, until = None):
+        """
+        Process scheduled events in order of their virtual time
+
+        :param until: Predicate, checked before each event, to stop processing
+        :returns: True if there are still scheduled events
+        """
+        while True:
+            if until is not None and until ():
+                return True
+
+            with self._lock:
+                if len (self._events) == 0:
+                    return False
+                event = heapq.heappop (self._events)
+
+            if event.cancelled:
+                continue
+
+            self.clock.now = max (self.clock.now, event.time)
+            event.callback ()
+
+    def _link (self, faceA, faceB):
+        return self._links.get ((id (faceA), id (faceB)), (self.latency, self.loss))
+
+    def _isLost (self, loss):
+        if loss > 0 and self._random.random () < loss:
+            self.lostPackets += 1
+            return True
+        return False
+
+    def _expressInterest (self, face, interest, onData, onTimeout):
+        self.sentInterests += 1
+
+        entry = _PendingInterest (interest, face, onData, onTimeout)
+        self._pit.append (entry)
+        entry.timeout = self.schedule (interest.interestLifetime, lambda: self._onTimeout (entry))
+
+        producer = None
+        for (prefix, filterFace, onInterest) in self._filters:
+            if prefix.isPrefixOf (interest.name) and (producer is None or len (prefix) > len (producer[0])):
+                producer = (prefix, filterFace, onInterest)
+
+        if producer is None:
+            return
+
+        (latency, loss) = self._link (face, producer[1])
+        if self._isLost (loss):
+            return
+
+        (prefix, filterFace, onInterest) = producer
+        self.schedule (latency, lambda: onInterest (prefix, interest))
+
+    def _put (self, face, data):
+        self.sentData += 1
+
+        for entry in [entry for entry in self._pit if entry.interest.name.isPrefixOf (data.name)]:
+            (latency, loss) = self._link (face, entry.face)
+            if self._isLost (loss):
+                continue
+
+            self.schedule (latency, lambda entry = entry: self._onData (entry, data))
+
+    def _onData (self, entry, data):
+        if not entry in self._pit:
+            # already satisfied or timed out
+            return
+
+        self._pit.remove (entry)
+        self.cancel (entry.timeout)
+        if entry.onData:
+            entry.onData (entry.interest, data)
+
+    def _onTimeout (self, entry):
+        if not entry in self._pit:
+            return
+
+        self._pit.remove (entry)
+        self.timeouts += 1
+        if entry.onTimeout:
+            entry.onTimeout (entry.interest)
+
+class Face (object):
+    """
+    Simulated face, providing the same interface as ``ndn.Face``
+    """
+
+    def __init__ (self, network):
+        self.network = network
+
+    def setInterestFilter (self, prefix, onInterest):
+        self.network._filters.append ((prefix, self, onInterest))
+
+    def clearInterestFilter (self, prefix):
+        self.network._filters = [(filterPrefix, face, onInterest) for (filterPrefix, face, onInterest) in self.network._filters
+                                 if face is not self or filterPrefix != prefix]
+
+    def expressInterest (self, name, onData, onTimeout = None, interestLifetime = 4.0):
+        self.network._expressInterest (self, Interest (name, interestLifetime), onData, onTimeout)
+
+    def put (self, data):
+        self.network._put (self, data)
+
+    def get (self, name, interestLifetime = 4.0):
+        """
+        Express Interest and process events until Data is received or Interest times out
+
+        :returns: Data packet or None
+        """
+        result = []
+        self.expressInterest (name,
+                              lambda interest, data: result.append (data),
+                              lambda interest: result.append (None),
+                              interestLifetime)
+        self.network.processEvents (until = lambda: len (result) > 0)
+        return result[0] if len (result) > 0 else None
+
+    def defer_verification (self, deferVerification = True):
+        pass
+
+class EventLoop (object):
+    """
+    Simulated event loop, providing the same interface as ``ndn.EventLoop``
+
+    :py:meth:`run` processes events of the whole network until :py:meth:`stop` is called or there
+    are no more scheduled events.
+    """
+
+    def __init__ (self, *faces):
+        self.network = faces[0].network
+        self._running = False
+
+    def run (self):
+        self._running = True
+        self.network.processEvents (until = lambda: not self._running)
+        self._running = False
+
+    def stop (self):
+        self._running = False
+
+    def execute (self, callback):
+        self.network.schedule (0, callback)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- Mode:python; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (c) 2013, Regents of the University of California
+#                     Alexander Afanasyev
+#
+# BSD license, See the doc/LICENSE file for more information
+#
+# Author: Alexander Afanasyev <alexander.afanasyev@ucla.edu>
+#
+
+"""
+Compiled read-only zone snapshots
+
+Snapshot file contains signed Data packets of all RR sets of a zone, indexed by sorted keys, so
+records can be looked up from a memory-mapped file without touching the database::
+
+    header:  "NDNSSNP1", number of entries (uint32), length of zone name (uint32)
+    zone name in NDN wire format
+    index:   for each entry, sorted by key and label:
+             key offset (uint32), key length (uint16), label length (uint16),
+             data offset (uint32), data length (uint32)
+    keys:    key (RR type as uint16, followed by reversed label, see :py:func:`ndns.rrset.reverse_label`),
+             immediately followed by the exact label
+    data:    Data packets in wire format
+
+All numbers are in network byte order.
+"""
+
+import os
+import mmap
+import struct
+import tempfile
+import logging
+
+from rrset import RRSet, reverse_label
+from blob import Blob
+
+_LOG = logging.getLogger ("ndns.Snapshot")
+
+MAGIC = "NDNSSNP1"
+
+_HEADER = struct.Struct ("!8sII")
+_ENTRY = struct.Struct ("!IHHII")
+_RTYPE = struct.Struct ("!H")
+
+def snapshot_path (session, zone_id):
+    """
+    Get path of the snapshot file for the zone (the file may not exist)
+    """
+    return "%s/%d.snapshot" % (session.snapshotdir, zone_id)
+
+def _key (label, rtype):
+    return _RTYPE.pack (rtype) + reverse_label (label)
+
+def compile_zone (session, zone):
+    """
+    Export all RR sets of the zone into the snapshot file
+
+    The new snapshot is written into a temporary file, which then atomically replaces the old one, so
+    the processes that have the old snapshot mapped are not affected.
+
+    :returns: number of entries in the snapshot
+    """
+    entries = []
+    for (label, rtype, ndndata) in session.query (RRSet.label, RRSet.rtype, Blob.data).\
+                                   join (Blob, Blob.digest == RRSet.ndndata_digest).\
+                                   filter (RRSet.zone_id == zone.id):
+        if ndndata is None:
+            continue
+        entries.append ((_key (label, rtype), str (label), str (ndndata)))
+    entries.sort ()
+
+    name = str (zone.name.toWire ())
+
+    indexOffset = _HEADER.size + len (name)
+    keysOffset = indexOffset + _ENTRY.size * len (entries)
+    dataOffset = keysOffset + sum (len (key) + len (label) for (key, label, data) in entries)
+
+    index = []
+    for (key, label, data) in entries:
+        index.append (_ENTRY.pack (keysOffset, len (key), len (label), dataOffset, len (data)))
+        keysOffset += len (key) + len (label)
+        dataOffset += len (data)
+
+    if not os.path.exists (session.snapshotdir):
+        os.makedirs (session.snapshotdir)
+
+    (fd, tmpname) = tempfile.mkstemp (prefix = ".%d." % zone.id, dir = session.snapshotdir)
+    try:
+        with os.fdopen (fd, "wb") as f:
+            f.write (_HEADER.pack (MAGIC, len (entries), len (name)))
+            f.write (name)
+            f.write ("".join (index))
+            for (key, label, data) in entries:
+                f.write (key)
+                f.write (label)
+            for (key, label, data) in entries:
+                f.write (data)
+            f.flush ()
+            os.fsync (f.fileno ())
+
+        os.rename (tmpname, snapshot_path (session, zone.id))
+    except:
+        os.unlink (tmpname)
+        raise
+
+    _LOG.debug ("Compiled snapshot of zone [%s] with %d entries" % (zone.name, len (entries)))
+    return len (entries)
+
+def refresh_snapshot (session, zone):
+    """
+    Rebuild snapshot of the zone if it exists (should be called after zone has been modified)
+
+    :returns: True if snapshot has been rebuilt
+    """
+    if not os.path.exists (snapshot_path (session, zone.id)):
+        return False
+
+    compile_zone (session, zone)
+    return True
+
+def remove_snapshot (session, zone):
+    try:
+        os.unlink (snapshot_path (session, zone.id))
+        return True
+    except OSError:
+        return False
+
+class ZoneSnapshot (object):
+    """
+    Memory-mapped zone snapshot
+
+    :param path: Path of the snapshot file
+    :param name: If specified, zone name (:py:class:`ndn.Name`) that the snapshot must belong to
+    :raises ValueError: if the file is not a valid snapshot or belongs to another zone
+    """
+
+    def __init__ (self, path, name = None):
+        with open (path, "rb") as f:
+            self._mm = mmap.mmap (f.fileno (), 0, access = mmap.ACCESS_READ)
+
+        try:
+            (magic, self._count, nameLength) = _HEADER.unpack_from (self._mm, 0)
+            if magic != MAGIC:
+                raise ValueError ("[%s] is not a zone snapshot" % path)
+
+            self._nameWire = self._mm[_HEADER.size : _HEADER.size + nameLength]
+            if name is not None and self._nameWire != str (name.toWire ()):
+                raise ValueError ("Snapshot [%s] belongs to a different zone" % path)
+
+            self._indexOffset = _HEADER.size + nameLength
+        except:
+            self._mm.close ()
+            raise
+
+    def __len__ (self):
+        return self._count
+
+    def close (self):
+        self._mm.close ()
+
+    def lookup (self, label, rtype):
+        """
+        Find Data packet of RR set
+
+        :param label: RR set label, relative to the zone (``dns.name.Name.to_text ()``)
+        :param rtype: RR type
+        :returns: ``buffer`` referencing Data packet wire inside the mapped file or None if there is no such RR set
+        """
+        key = _key (label, rtype)
+        i = self._lowerBound (key)
+        while i < self._count:
+            (keyOffset, keyLength, labelLength, dataOffset, dataLength) = self._entry (i)
+            if self._mm[keyOffset : keyOffset + keyLength] != key:
+                break
+
+            if self._mm[keyOffset + keyLength : keyOffset + keyLength + labelLength] == label:
+                return buffer (self._mm, dataOffset, dataLength)
+            i += 1
+
+        return None
+
+    def has_below (self, label, rtype):
+        """
+        Check if there is RR set of type ``rtype`` below ``label`` (see :py:meth:`ndns.rrset.RRSet.is_below`)
+        """
+        prefix = _key (label, rtype)
+        i = self._lowerBound (prefix)
+        while i < self._count:
+            (keyOffset, keyLength, labelLength, dataOffset, dataLength) = self._entry (i)
+            key = self._mm[keyOffset : keyOffset + keyLength]
+            if not key.startswith (prefix):
+                return False
+            if len (key) > len (prefix):
+                return True
+            i += 1
+
+        return False
+
+    def _entry (self, i):
+        return _ENTRY.unpack_from (self._mm, self._indexOffset + i * _ENTRY.size)
+
+    def _lowerBound (self, key):
+        lo = 0
+        hi = self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            (keyOffset, keyLength, labelLength, dataOffset, dataLength) = self._entry (mid)
+            if self._mm[keyOffset : keyOffset + keyLength] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
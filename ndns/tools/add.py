@@ -16,7 +16,10 @@ import dns.rdata
 import dns.rrset
 import dns.zone
 import ndns
+import ndns.snapshot
 import ndn
+import StringIO
+from ndns.tools.bulk_import import bulk_import
 
 def add (args):
     _ndns = ndns.ndns_session (args.data_dir)
@@ -36,6 +39,12 @@ def add (args):
 
     origin = dns.name.from_text (zone_dns)
 
+    if getattr (args, 'bulk', False):
+        bulk_import (_ndns, zone, StringIO.StringIO (args.rr) if args.rr else sys.stdin,
+                     batchSize = args.batch_size)
+        ndns.snapshot.refresh_snapshot (_ndns, zone)
+        return
+
     if args.rr:
         zonefile = dns.zone.from_text (args.rr, origin = origin, check_origin = False)
     else:
@@ -55,3 +64,4 @@ def add (args):
 
     if getattr (args, 'commit', True):
         _ndns.commit ()
+        ndns.snapshot.refresh_snapshot (_ndns, zone)
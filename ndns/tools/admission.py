@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- Mode:python; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (c) 2013, Regents of the University of California
+#                     Alexander Afanasyev
+#
+# BSD license, See the doc/LICENSE file for more information
+#
+# Author: Alexander Afanasyev <alexander.afanasyev@ucla.edu>
+#
+
+import time
+from collections import deque
+
+from ndns.cache import LruCache
+
+# request classes, in order of preference
+PRIORITY_SIGNED = 0  # answers that are already signed (direct requests for existing RR sets or cached answers)
+PRIORITY_SIGN = 1    # answers that need to be signed (negative answers, forwarding hint encapsulation)
+PRIORITY_DYNDNS = 2  # DyNDNS updates (verification, database update, and signing)
+
+PRIORITY_NAMES = ["signed", "sign", "dyndns"]
+
+class TokenBucket (object):
+    """
+    Token bucket allowing on average ``rate`` requests per second, with bursts up to ``burst`` requests
+    """
+
+    __slots__ = ["rate", "burst", "tokens", "updated"]
+
+    def __init__ (self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def consume (self, now):
+        self.tokens = min (self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+        return True
+
+class AdmissionControl (object):
+    """
+    Admission control for incoming requests
+
+    Each request is first checked against token buckets of its source prefix and of its zone (rate of 0
+    disables the corresponding limit).  Admitted requests are placed into a bounded queue, which is
+    served in order of priority (see ``PRIORITY_*`` constants) and, within the same priority, in order
+    of arrival.  When the queue is full, a new request replaces the newest queued request of a lower
+    priority, or is dropped if there is no such request.
+
+    Number of rejected requests is tracked in ``shed`` dictionary, keyed by reason ("source", "zone", or "queue").
+
+    :param maxBuckets: Maximum number of tracked source prefixes (least recently seen are forgotten)
+    """
+
+    def __init__ (self, sourceRate = 0, sourceBurst = None, zoneRate = 0, zoneBurst = None,
+                  queueSize = 1000, maxBuckets = 100000, clock = time.time):
+        self.sourceRate = sourceRate
+        self.sourceBurst = sourceBurst if sourceBurst else max (1, sourceRate)
+        self.zoneRate = zoneRate
+        self.zoneBurst = zoneBurst if zoneBurst else max (1, zoneRate)
+        self.queueSize = queueSize
+        self._clock = clock
+
+        self._sourceBuckets = LruCache (maxBuckets)
+        self._zoneBuckets = {}
+
+        self._queues = [deque () for name in PRIORITY_NAMES]
+        self._queued = 0
+
+        self.shed = {"source": 0, "zone": 0, "queue": 0}
+        self.admitted = 0
+
+    def __len__ (self):
+        return self._queued
+
+    def admit (self, source, zone, priority, request):
+        """
+        Check limits and queue the request
+
+        :param source: Source prefix of the request (any hashable value), None if source is not known
+        :param zone: Zone of the request (any hashable value)
+        :param priority: One of ``PRIORITY_*`` values
+        :param request: Callable to be returned by :py:meth:`pop`
+        :returns: True if request has been queued
+        """
+        now = self._clock ()
+
+        if self.sourceRate > 0 and source is not None:
+            bucket = self._sourceBuckets.get (source)
+            if bucket is None:
+                bucket = TokenBucket (self.sourceRate, self.sourceBurst, now)
+                self._sourceBuckets.put (source, bucket)
+            if not bucket.consume (now):
+                self.shed["source"] += 1
+                return False
+
+        if self.zoneRate > 0:
+            bucket = self._zoneBuckets.get (zone)
+            if bucket is None:
+                bucket = self._zoneBuckets[zone] = TokenBucket (self.zoneRate, self.zoneBurst, now)
+            if not bucket.consume (now):
+                self.shed["zone"] += 1
+                return False
+
+        if self._queued >= self.queueSize:
+            for lower in range (len (self._queues) - 1, priority, -1):
+                if len (self._queues[lower]) > 0:
+                    self._queues[lower].pop ()
+                    self._queued -= 1
+                    self.shed["queue"] += 1
+                    break
+            else:
+                self.shed["queue"] += 1
+                return False
+
+        self._queues[priority].append (request)
+        self._queued += 1
+        self.admitted += 1
+        return True
+
+    def pop (self):
+        """
+        :returns: the oldest queued request of the highest priority or None if queue is empty
+        """
+        for queue in self._queues:
+            if len (queue) > 0:
+                self._queued -= 1
+                return queue.popleft ()
+        return None
+
+    def forgetZone (self, zone):
+        self._zoneBuckets.pop (zone, None)
+
+    def depth (self, priority):
+        return len (self._queues[priority])
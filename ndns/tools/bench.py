@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# -*- Mode:python; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (c) 2013, Regents of the University of California
+#                     Alexander Afanasyev
+#
+# BSD license, See the doc/LICENSE file for more information
+#
+# Author: Alexander Afanasyev <alexander.afanasyev@ucla.edu>
+#
+
+import ndn
+import dns.rdatatype
+
+import ndns
+import sys
+import math
+import time
+import random
+import threading
+import logging
+
+_LOG = logging.getLogger ("ndns.Bench")
+
+def load_queries (file, ndnLabels = False):
+    """
+    Load queries from the file, one query per line in form ``<label> <RR-TYPE> [<forwarding hint>]``.
+    Label ``@`` denotes zone apex; empty lines and lines starting with ``#`` are ignored.
+
+    :returns: list of (label, rrtype, hint) tuples
+    """
+    queries = []
+    for line in file:
+        line = line.strip ()
+        if line == "" or line.startswith ("#"):
+            continue
+
+        fields = line.split ()
+        if len (fields) < 2:
+            raise ValueError ("Invalid query line [%s]" % line)
+
+        queries.append ((_parseLabel (fields[0], ndnLabels),
+                         dns.rdatatype.to_text (dns.rdatatype.from_text (fields[1])),
+                         ndn.Name (fields[2]) if len (fields) > 2 else None))
+    return queries
+
+def synthetic_queries (labels, rrtypes, missRatio = 0.0, hint = None, hintRatio = 0.0, seed = 0, ndnLabels = False):
+    """
+    Generate infinite sequence of queries
+
+    :param labels: list of existing labels to query for
+    :param rrtypes: list of RR types to query for
+    :param missRatio: fraction of queries for unique (most likely non-existing) labels
+    :param hint: forwarding hint
+    :param hintRatio: fraction of queries sent using the forwarding hint
+    """
+    rand = random.Random (seed)
+    labels = [_parseLabel (label, ndnLabels) for label in labels]
+    rrtypes = [dns.rdatatype.to_text (dns.rdatatype.from_text (rrtype)) for rrtype in rrtypes]
+
+    seq = 0
+    while True:
+        seq += 1
+        if len (labels) == 0 or rand.random () < missRatio:
+            label = ndn.Name ().append ("bench-miss-%d-%d" % (seed, seq))
+        else:
+            label = rand.choice (labels)
+
+        yield (label,
+               rand.choice (rrtypes),
+               hint if hint is not None and rand.random () < hintRatio else None)
+
+def _parseLabel (label, ndnLabels):
+    if label == "@":
+        return ndn.Name ()
+    if not ndnLabels:
+        label = ndns.ndnify (label)
+    return ndn.Name (label)
+
+def _percentile (sortedValues, fraction):
+    if len (sortedValues) == 0:
+        return 0.0
+    index = int (math.ceil (fraction * len (sortedValues))) - 1
+    return sortedValues[max (0, min (len (sortedValues) - 1, index))]
+
+class Benchmark (object):
+    """
+    Send queries to the zone and collect statistics about answers
+
+    In closed-loop mode (``rate`` is 0), ``concurrency`` queries are kept outstanding at all times.  In open-loop
+    mode, queries are sent at the fixed ``rate`` (queries per second), independently from the answers.
+
+    :param face: Face object (``ndn.Face`` or :py:class:`ndns.sim.Face`)
+    :param loop: Event loop for the face
+    :param zone: Zone to send queries to
+    :param queries: Iterable of (label, rrtype, hint) tuples, repeated if shorter than ``count``
+    :param schedule: Callable (delay, callback) to schedule callback within the event loop.  By default,
+                     uses :py:class:`ndns.sim.Network` scheduler for simulated faces, otherwise queries are
+                     paced by a separate thread
+    :param clock: Callable returning current time (by default, virtual clock for simulated faces or ``time.time``)
+    """
+
+    def __init__ (self, face, loop, zone, queries, count = 1000, rate = 0, concurrency = 10,
+                  verify = False, cachingQuery = None, policy = None, schedule = None, clock = None):
+        self.face = face
+        self.loop = loop
+        self.zone = ndn.Name (zone)
+        self.count = count
+        self.rate = rate
+        self.concurrency = concurrency
+        self.verify = verify
+        self.cachingQuery = cachingQuery if cachingQuery else ndns.query.NonCachingQuery ()
+        self.policy = policy if policy else ndns.TrustPolicy
+
+        network = getattr (face, "network", None)
+        if schedule is None and network:
+            schedule = network.schedule
+        if clock is None:
+            clock = network.clock.time if network else time.time
+        self._schedule = schedule
+        self._clock = clock
+
+        self._queries = queries
+        self._iter = iter (queries)
+
+        self.sent = 0
+        self.outstanding = 0
+        self.answers = 0
+        self.timeouts = 0
+        self.verifyFailures = 0
+        self.errors = 0
+        self.latencies = []
+        self.started = None
+        self.finished = None
+
+    def run (self):
+        """
+        Send all queries and run the event loop until all of them are answered or timed out
+        """
+        self.started = self._clock ()
+
+        if self.rate > 0 and self._schedule:
+            for i in xrange (self.count):
+                self._schedule (float (i) / self.rate, self._sendNext)
+        elif self.rate > 0:
+            pacer = threading.Thread (target = self._pace)
+            pacer.daemon = True
+            pacer.start ()
+        else:
+            for i in xrange (min (self.concurrency, self.count)):
+                self._sendNext ()
+
+        self.loop.run ()
+        if self.finished is None:
+            self.finished = self._clock ()
+
+    def report (self, out = sys.stdout):
+        completed = self.answers + self.timeouts + self.verifyFailures + self.errors
+        duration = (self.finished or self._clock ()) - self.started
+        latencies = sorted (self.latencies)
+
+        out.write (";; Queries sent:          %d\n" % self.sent)
+        out.write (";; Queries completed:     %d\n" % completed)
+        out.write (";;   answers:             %d\n" % self.answers)
+        out.write (";;   timeouts:            %d\n" % self.timeouts)
+        out.write (";;   verification failed: %d\n" % self.verifyFailures)
+        out.write (";;   other errors:        %d\n" % self.errors)
+        out.write (";; Run time (s):          %f\n" % duration)
+        out.write (";; Queries per second:    %f\n" % (completed / duration if duration > 0 else 0.0))
+        out.write (";; Latency (ms):          p50 %.3f, p99 %.3f, p999 %.3f, max %.3f\n" %
+                   (_percentile (latencies, 0.50) * 1000,
+                    _percentile (latencies, 0.99) * 1000,
+                    _percentile (latencies, 0.999) * 1000,
+                    (latencies[-1] if len (latencies) > 0 else 0.0) * 1000))
+
+    def _pace (self):
+        # open-loop mode without a scheduler: send queries from a separate thread via the event loop
+        time.sleep (0.1) # let the event loop start
+        started = time.time ()
+        for i in xrange (self.count):
+            wait = started + float (i) / self.rate - time.time ()
+            if wait > 0:
+                time.sleep (wait)
+            self.loop.execute (self._sendNext)
+
+    def _nextQuery (self):
+        try:
+            return next (self._iter)
+        except StopIteration:
+            self._iter = iter (self._queries)
+            return next (self._iter)
+
+    def _sendNext (self):
+        if self.sent >= self.count:
+            return
+
+        (label, rrtype, hint) = self._nextQuery ()
+        if self.sent == 0:
+            self.started = self._clock ()
+        self.sent += 1
+        self.outstanding += 1
+
+        started = self._clock ()
+        self.cachingQuery.expressQueryFor (self.face,
+                                           lambda result, msg: self._onResult (started, result, msg),
+                                           lambda errmsg, *k, **kw: self._onError (started, errmsg),
+                                           self.zone, hint, label, rrtype, verify = self.verify)
+
+    def _onResult (self, started, result, msg):
+        if self.verify:
+            return self._onVerify (started, result, True)
+
+        self.policy.verifyAsync (self.face, result,
+                                 lambda data, status: self._onVerify (started, data, status))
+
+    def _onVerify (self, started, data, status):
+        if status:
+            self.answers += 1
+            self.latencies.append (self._clock () - started)
+        else:
+            self.verifyFailures += 1
+        self._onCompleted ()
+
+    def _onError (self, started, errmsg):
+        if errmsg == "Query timed out":
+            self.timeouts += 1
+        elif errmsg == "Query answer not trusted":
+            self.verifyFailures += 1
+        else:
+            _LOG.debug ("Query failed: %s" % errmsg)
+            self.errors += 1
+        self._onCompleted ()
+
+    def _onCompleted (self):
+        self.outstanding -= 1
+
+        if self.rate <= 0:
+            self._sendNext ()
+
+        if self.sent >= self.count and self.outstanding == 0:
+            self.finished = self._clock ()
+            self.loop.stop ()
+
+def bench (args, out = None, face = None, loop = None, cachingQuery = None, policy = None):
+    """
+    Run benchmark as requested by ``ndns-dig --bench`` command line arguments
+    """
+    if out is None:
+        out = sys.stdout
+
+    if face is None:
+        face = ndn.Face ()
+    if loop is None:
+        loop = ndn.EventLoop (face)
+
+    if args.bench_file:
+        with open (args.bench_file) as f:
+            queries = load_queries (f, args.ndn)
+        if len (queries) == 0:
+            sys.stderr.write ("ERROR: No queries in [%s]\n" % args.bench_file)
+            exit (5)
+    else:
+        labels = args.bench_labels.split (",") if args.bench_labels else ([args.name] if args.name else [])
+        queries = synthetic_queries (labels, (args.bench_rrtypes or args.rrtype).split (","),
+                                     args.bench_miss_ratio,
+                                     ndn.Name (args.fh) if args.fh else None, args.bench_hint_ratio,
+                                     args.bench_seed, args.ndn)
+
+    benchmark = Benchmark (face, loop, args.zone, queries,
+                           count = args.bench_count, rate = args.bench_rate, concurrency = args.bench_concurrency,
+                           verify = args.verify, cachingQuery = cachingQuery, policy = policy)
+    benchmark.run ()
+    benchmark.report (out)
+    return benchmark
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- Mode:python; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (c) 2013, Regents of the University of California
+#                     Alexander Afanasyev
+#
+# BSD license, See the doc/LICENSE file for more information
+#
+# Author: Alexander Afanasyev <alexander.afanasyev@ucla.edu>
+#
+
+"""
+Bulk import of zone files
+
+Unlike :py:func:`ndns.tools.add.add`, which creates and signs a separate RR set for each individual
+record, the bulk import groups all records of the zone file into RR sets in memory, signs each RR
+set exactly once, and writes RRs and signed Data packets using batched ``executemany`` inserts
+within a single transaction.  New RR sets are inserted one by one, so their ids are assigned by
+SQLite and do not collide with RR sets added concurrently by other processes.  Records for RR sets
+that already exist in the zone are merged into them (the existing RR set is re-signed).
+
+The zone file is parsed in chunks of lines, so memory is used only for the compact (wire-format)
+representation of the records, not for the whole parsed zone.
+"""
+
+import sys
+import time
+import logging
+
+import dns.name
+import dns.rdatatype
+import dns.zone
+
+import ndn
+import ndns
+from ndns.rrset import reverse_label, rrs_content_hash
+from ndns.blob import blob_digest
+
+_LOG = logging.getLogger ("ndns.BulkImport")
+
+def _line_state (line, depth):
+    # returns parenthesis depth after the line (ignoring quoted strings and comments)
+    quoted = False
+    escaped = False
+    for char in line:
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == '"':
+            quoted = not quoted
+        elif quoted:
+            continue
+        elif char == ';':
+            break
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+    return depth
+
+def zone_chunks (file, lines = 10000):
+    """
+    Split zone file into chunks of about ``lines`` lines, each of which can be parsed separately
+
+    Chunks are split only before a line that starts with an owner name (outside of parentheses), and
+    most recent ``$ORIGIN`` and ``$TTL`` directives are repeated at the beginning of each chunk.
+    """
+    directives = {}
+    chunk = []
+    depth = 0
+    for line in file:
+        if depth == 0 and len (chunk) >= lines and line[:1] not in (' ', '\t', ';', '$', '\n', '\r', ''):
+            yield "".join (chunk)
+            chunk = []
+
+        if len (chunk) == 0:
+            chunk = [directives[d] for d in sorted (directives)]
+
+        if depth == 0 and line.startswith ('$'):
+            directive = line.split (None, 1)[0].upper ()
+            if directive in ("$ORIGIN", "$TTL"):
+                directives[directive] = line if line.endswith ("\n") else "%s\n" % line
+
+        chunk.append (line)
+        depth = _line_state (line, depth)
+
+    if len (chunk) > 0:
+        yield "".join (chunk)
+
+class BulkImport (object):
+    """
+    Import records into the existing zone
+
+    :param session: NDNS session
+    :param zone: :py:class:`ndns.zone.Zone` object
+    :param batchSize: Number of RR sets, whose RRs and Data packets are written by one ``executemany`` batch
+    """
+
+    def __init__ (self, session, zone, batchSize = 1000):
+        self.session = session
+        self.zone = zone
+        self.batchSize = batchSize
+
+        self.origin = zone.dns_name
+        self.zoneName = zone.name
+        self.key = zone.default_key
+        self.defaultTtl = zone.soa[0].rrs[0].ttl
+
+        # (label, rclass, rtype) => {wire-formatted RDATA: ttl}
+        self.rrsets = {}
+
+        self.records = 0
+        self.signed = 0
+        self.merged = 0
+
+    def parse (self, file, chunkLines = 10000):
+        """
+        Parse zone file (or any iterable of lines) and group records into RR sets
+        """
+        for chunk in zone_chunks (file, chunkLines):
+            self.parseText (chunk)
+
+    def parseText (self, text):
+        zonefile = dns.zone.from_text (text, origin = self.origin, check_origin = False)
+
+        for (name, ttl, rdata) in zonefile.iterate_rdatas ():
+            if ttl == 0:
+                ttl = self.defaultTtl
+
+            key = (name.to_text (), rdata.rdclass, rdata.rdtype)
+            rrs = self.rrsets.get (key)
+            if rrs is None or dns.rdatatype.is_singleton (rdata.rdtype):
+                rrs = {}
+                self.rrsets[key] = rrs
+
+            rrs[rdata.to_digestable (origin = self.origin)] = ttl
+            self.records += 1
+
+    def _sign (self, label, rclass, rtype, rrs):
+        dns_label = dns.name.from_text (label).relativize (dns.name.root)
+        (content, ttl) = ndns.createRRsetContent (self.origin, dns_label, rclass, rtype, rrs)
+        if ttl <= -1:
+            ttl = self.defaultTtl
+
+        name = ndns.createRRsetName (self.zoneName, dns_label, rtype)
+        dataPacket = ndns.createSignedData (self.session, name, content, ttl, self.key,
+                                            type = ndn.CONTENT_DATA if rtype != dns.rdatatype.NDNCERT else ndn.CONTENT_KEY)
+        self.signed += 1
+        return str (dataPacket.toWire ())
+
+    def write (self):
+        """
+        Sign all parsed RR sets and write them into the database (within the session's transaction)
+        """
+        conn = self.session.connection ()
+
+        existing = {}
+        for (rrset_id, label, rclass, rtype) in conn.execute ("SELECT id, label, rclass, rtype FROM rrsets WHERE zone_id = ?",
+                                                                 (self.zone.id,)):
+            existing[(label, rclass, rtype)] = rrset_id
+
+        batch = []
+        for (key, rrs) in self.rrsets.iteritems ():
+            batch.append ((key, rrs))
+            if len (batch) >= self.batchSize:
+                self._writeBatch (conn, batch, existing)
+                batch = []
+        if len (batch) > 0:
+            self._writeBatch (conn, batch, existing)
+
+        self.rrsets = {}
+
+    def _writeBatch (self, conn, batch, existing):
+        blobs = {}
+        updatedRRsets = []
+        rrs = []
+
+        for ((label, rclass, rtype), records) in batch:
+            rrset_id = existing.get ((label, rclass, rtype))
+            isNew = rrset_id is None
+            if not isNew:
+                if not dns.rdatatype.is_singleton (rtype):
+                    for (rrdata, ttl) in conn.execute ("SELECT rrdata, ttl FROM rrs WHERE rrset_id = ?", (rrset_id,)):
+                        records.setdefault (str (rrdata), ttl)
+                conn.execute ("DELETE FROM rrs WHERE rrset_id = ?", (rrset_id,))
+                self.merged += 1
+
+            recordList = [(ttl, rrdata) for (rrdata, ttl) in records.iteritems ()]
+            wire = self._sign (label, rclass, rtype, recordList)
+            digest = blob_digest (wire)
+            blobs[digest] = wire
+            signed = (int (time.time ()), self.key.id, rrs_content_hash (recordList))
+
+            if isNew:
+                # id is assigned by SQLite and needed for the RRs (blob is inserted at the end of the batch)
+                rrset_id = conn.execute ("INSERT INTO rrsets (zone_id, label, rclass, rtype, ndndata_digest, rlabel, "
+                                         "signed_at, signed_key_id, content_hash, dirty) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                                         (self.zone.id, label, rclass, rtype, digest, reverse_label (label)) + signed).lastrowid
+            else:
+                updatedRRsets.append ((digest,) + signed + (rrset_id,))
+
+            for (ttl, rrdata) in recordList:
+                rrs.append ((rrset_id, ttl, buffer (rrdata)))
+
+        conn.execute ("INSERT OR IGNORE INTO blobs (digest, data) VALUES (?, ?)",
+                      [(digest, buffer (wire)) for (digest, wire) in blobs.iteritems ()])
+        if len (updatedRRsets) > 0:
+            conn.execute ("UPDATE rrsets SET ndndata_digest = ?, signed_at = ?, signed_key_id = ?, content_hash = ?, dirty = 0 "
+                          "WHERE id = ?", updatedRRsets)
+        if len (rrs) > 0:
+            conn.execute ("INSERT INTO rrs (rrset_id, ttl, rrdata) VALUES (?, ?, ?)", rrs)
+
+        _LOG.debug ("Wrote batch of %d RR sets (%d RRs)" % (len (batch), len (rrs)))
+
+def bulk_import (session, zone, file, batchSize = 1000, chunkLines = 10000, out = sys.stderr):
+    """
+    Import zone file into the zone, commit the transaction, and report the import rate to ``out``
+
+    :returns: :py:class:`BulkImport` object with the import statistics
+    """
+    started = time.time ()
+
+    bulk = BulkImport (session, zone, batchSize)
+    bulk.parse (file, chunkLines)
+    rrsets = len (bulk.rrsets)
+    parsed = time.time ()
+
+    bulk.write ()
+    session.commit ()
+    session.expire_all ()
+    finished = time.time ()
+
+    elapsed = max (finished - started, 1e-6)
+    out.write ("Imported %d records (%d RR sets, %d merged with existing) in %.1f seconds: %.0f records/s\n" %
+               (bulk.records, rrsets, bulk.merged, elapsed, bulk.records / elapsed))
+    out.write ("    parsing %.1f s, signing and writing %.1f s (%.0f signatures/s)\n" %
+               (parsed - started, finished - parsed, bulk.signed / max (finished - parsed, 1e-6)))
+    return bulk
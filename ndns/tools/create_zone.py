@@ -18,7 +18,9 @@ import dns.rdata
 import dns.rrset
 import dns.rdtypes.IN.NDNCERT
 import ndns
+import ndns.snapshot
 import ndn
+from ndns.tools.bulk_import import bulk_import
 
 def create_zone (args):
     _ndns = ndns.ndns_session (args.data_dir)
@@ -127,3 +129,9 @@ def create_zone (args):
     
     if getattr (args, 'commit', True):
         _ndns.commit ()
+
+    if getattr (args, 'import_file', None):
+        _ndns.flush ()
+        with open (args.import_file) as zonefile:
+            bulk_import (_ndns, zone, zonefile, batchSize = args.batch_size)
+        ndns.snapshot.refresh_snapshot (_ndns, zone)
@@ -25,10 +25,14 @@ _LOG = logging.getLogger ("dyndns.Daemon")
 
 class DyndnsDaemon (object):
 #public:
-    def __init__ (self, data_dir, session, face):
+    def __init__ (self, data_dir, session, face, onZoneChanged = None, signer = None, lookup = None):
         self.data_dir = data_dir
         self.session = session
         self._face = face # ndn.Face () # this should not be necessary...
+        self._onZoneChanged = onZoneChanged
+        self._signer = signer
+        # ndns.lookup.RecordLookup, if available, is used for read-only checks instead of ORM queries
+        self._lookup = lookup
 
     def _processDyNDNS (self, zone, basename, interest):
         zone = self.session.query (ndns.Zone).filter_by (id = zone.id).first ()
@@ -88,8 +92,9 @@ class DyndnsDaemon (object):
                             count += 1
 
                     self.session.commit ()
-                    result = ndns.createSignedData (self.session, interest.name.appendVersion (), "OK: Deleted %d RR sets%s" % (count, extra_msg), 1, zone.default_key)
-                    self._face.put (result)
+                    self._notifyZoneChanged (zone)
+                    self._signData (interest.name.appendVersion (), "OK: Deleted %d RR sets%s" % (count, extra_msg), 1, zone.default_key,
+                                    self._face.put)
                 else:
                     dns_rrset = msg.answer[0]
                     rrset = self.session.query (ndns.RRSet).\
@@ -110,9 +115,9 @@ class DyndnsDaemon (object):
                         rr = ndns.RR (rrset = rrset, ttl = dns_rrset.ttl, rrdata = rdata)
                     
                     self.session.commit ()
+                    self._notifyZoneChanged (zone)
                     
-                    result = ndns.createSignedData (self.session, interest.name.appendVersion (), "OK", 1, zone.default_key)
-                    self._face.put (result)
+                    self._signData (interest.name.appendVersion (), "OK", 1, zone.default_key, self._face.put)
 
             except Exception, e:
                 _LOG.warn ("Undecodeable component in DyNDNS update: [%s]" % update)
@@ -126,11 +131,22 @@ class DyndnsDaemon (object):
         key_label = dns.name.from_text (ndns.dnsify (str (ndn.Name (keyName[len(basename):-1])))).\
             relativize (origin = dns.name.root)
 
-        key = self.session.query (ndns.RRSet).with_parent (zone).filter_by (label = key_label.to_text (), rtype = dns.rdatatype.NDNCERT).first ()
-        if not key:
-            _LOG.warn ("Key [%s] has been validated, but does not belong to the zone. Denying update" % keyName)
-            return False
-        
+        if self._lookup:
+            if self._lookup.get (zone.id, key_label.to_text (), dns.rdatatype.NDNCERT) is None:
+                _LOG.warn ("Key [%s] has been validated, but does not belong to the zone. Denying update" % keyName)
+                return False
+
+            rrdata = self._lookup.get_rrdata (zone.id, key_label.to_text (), dns.rdatatype.NDNCERTSEQ)
+            if rrdata is not None and \
+               dns.rdata.from_wire (dns.rdataclass.IN, dns.rdatatype.NDNCERTSEQ, rrdata, 0, len (rrdata)).seq >= seqno:
+                _LOG.warn ("Replay attack detected, denying the update with sequence number [%s]" % seqno)
+                return False
+        else:
+            key = self.session.query (ndns.RRSet).with_parent (zone).filter_by (label = key_label.to_text (), rtype = dns.rdatatype.NDNCERT).first ()
+            if not key:
+                _LOG.warn ("Key [%s] has been validated, but does not belong to the zone. Denying update" % keyName)
+                return False
+
         current_key_seq = self.session.query (ndns.RRSet).with_parent (zone).filter_by (label = key_label.to_text (), rtype = dns.rdatatype.NDNCERTSEQ).first ()
         
         if not current_key_seq:
@@ -147,5 +163,16 @@ class DyndnsDaemon (object):
         current_key_seq.rrs[0].rrdata = updated_rr
         current_key_seq.refresh_ndndata (self.session, zone.default_key)
         self.session.commit ()
+        self._notifyZoneChanged (zone)
 
         return True
+
+    def _notifyZoneChanged (self, zone):
+        if self._onZoneChanged:
+            self._onZoneChanged (zone)
+
+    def _signData (self, name, content, freshness, key, onSigned):
+        if self._signer:
+            self._signer (name, content, freshness, key, onSigned)
+        else:
+            onSigned (ndns.createSignedData (self.session, name, content, freshness, key))
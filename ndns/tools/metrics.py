@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- Mode:python; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (c) 2013, Regents of the University of California
+#                     Alexander Afanasyev
+#
+# BSD license, See the doc/LICENSE file for more information
+#
+# Author: Alexander Afanasyev <alexander.afanasyev@ucla.edu>
+#
+
+import bisect
+
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+class _Histogram (object):
+    __slots__ = ["counts", "sum", "count"]
+
+    def __init__ (self, buckets):
+        self.counts = [0] * (len (buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+def _escape (value):
+    return str (value).replace ("\\", "\\\\").replace ("\"", "\\\"").replace ("\n", "\\n")
+
+class Metrics (object):
+    """
+    Collection of counters, gauges, and histograms that can be exported in Prometheus text format
+
+    Each metric has to be defined before use, specifying names of its labels.  Values of labels
+    are then passed as a tuple in the same order.
+    """
+
+    def __init__ (self):
+        self._metrics = [] # name, type, help, label names, buckets
+        self._values = {}  # name => {label values => value}
+        self._buckets = {} # name => histogram buckets
+
+    def define (self, name, type, help, labels = (), buckets = DEFAULT_BUCKETS):
+        """
+        :param type: "counter", "gauge", or "histogram"
+        """
+        self._metrics.append ((name, type, help, labels, buckets))
+        self._values[name] = {}
+        self._buckets[name] = buckets
+
+    def inc (self, name, labels = (), value = 1):
+        values = self._values[name]
+        try:
+            values[labels] += value
+        except KeyError:
+            values[labels] = value
+
+    def set (self, name, labels = (), value = 0):
+        self._values[name][labels] = value
+
+    def observe (self, name, value, labels = ()):
+        buckets = self._buckets[name]
+        values = self._values[name]
+        try:
+            histogram = values[labels]
+        except KeyError:
+            histogram = values[labels] = _Histogram (buckets)
+
+        histogram.counts[bisect.bisect_left (buckets, value)] += 1
+        histogram.sum += value
+        histogram.count += 1
+
+    def toText (self):
+        """
+        Format all metrics in Prometheus text exposition format
+        """
+        lines = []
+        for (name, type, help, labelNames, buckets) in self._metrics:
+            lines.append ("# HELP %s %s" % (name, help))
+            lines.append ("# TYPE %s %s" % (name, type))
+
+            for (labelValues, value) in sorted (self._values[name].items ()):
+                labels = ["%s=\"%s\"" % (label, _escape (labelValue)) for (label, labelValue) in zip (labelNames, labelValues)]
+
+                if type != "histogram":
+                    lines.append ("%s%s %s" % (name, self._formatLabels (labels), value))
+                    continue
+
+                cumulative = 0
+                for (bound, count) in zip (list (buckets) + ["+Inf"], value.counts):
+                    cumulative += count
+                    lines.append ("%s_bucket%s %d" % (name, self._formatLabels (labels + ["le=\"%s\"" % bound]), cumulative))
+                lines.append ("%s_sum%s %f" % (name, self._formatLabels (labels), value.sum))
+                lines.append ("%s_count%s %d" % (name, self._formatLabels (labels), value.count))
+
+        return "\n".join (lines) + "\n"
+
+    def _formatLabels (self, labels):
+        if len (labels) == 0:
+            return ""
+        return "{%s}" % ",".join (labels)
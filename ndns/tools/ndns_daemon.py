@@ -13,10 +13,18 @@ from dyndns_daemon import DyndnsDaemon
 import logging
 import ndn
 import dns.rdataclass, dns.rdatatype, dns.rdata, dns.rrset, dns.zone
-import os, functools
+import os, functools, time, threading
+from sqlalchemy.orm import sessionmaker
 
 # part of lib/
 import ndns
+from ndns.cache import LruCache
+from ndns.signing import SigningPool
+from ndns.lookup import RecordLookup
+from ndns.snapshot import ZoneSnapshot, snapshot_path, refresh_snapshot
+from zone_trie import ZoneTrie
+from metrics import Metrics
+from admission import AdmissionControl, PRIORITY_SIGNED, PRIORITY_SIGN, PRIORITY_DYNDNS, PRIORITY_NAMES
 from ndns.policy.identity import *
 import dns.rdtypes.IN.NDNAUTH
 import dns.rdtypes.IN.NEXISTS
@@ -24,54 +32,303 @@ import dns.rdtypes.IN.NDNCERTSEQ
 
 _LOG = logging.getLogger ("ndns.Daemon")
 
+METRICS_PREFIX = ndn.Name ("/localhost/ndns-daemon/metrics")
+
 class NdnsDaemon (object):
 #public:
-    def __init__ (self, data_dir, scopes = [], enable_dyndns = True):
+    def __init__ (self, data_dir, scopes = [], enable_dyndns = True,
+                  answer_cache_size = 10000, negative_cache_size = 10000, negative_cache_bytes = 16777216,
+                  encap_cache_size = 10000, dispatch_trie = False, signing_workers = 0,
+                  metrics_file = None, metrics_interval = 60,
+                  source_rate = 0, source_burst = None, zone_rate = 0, zone_burst = None, queue_size = 0,
+                  snapshot_rebuild_interval = 10):
         self.data_dir = data_dir
+        self._ndns = None
         self._scopes = [ndn.Name (scope) for scope in scopes]
 
-        self._zones = []
+        self._zones = {} # zone id => zone name
         self._autoScope = []
         self._enable_dyndns = enable_dyndns
 
+        # (zone id, label, rtype) => ready to be served Data packet
+        self._answerCache = LruCache (answer_cache_size)
+        # (zone id, label, rtype) => signed NEXISTS or NDNAUTH Data packet
+        self._negativeCache = LruCache (negative_cache_size, negative_cache_bytes)
+        # (scope, inner Data packet name) => signed encapsulating Data packet
+        self._encapCache = LruCache (encap_cache_size)
+
+        # zone id => memory-mapped compiled zone (zones without snapshot are served from the database)
+        self._snapshots = {}
+        # ids of updated zones, whose snapshots are dropped and wait to be rebuilt in background
+        self._staleSnapshots = set ()
+        self._rebuildingSnapshots = set ()
+        self._snapshotRebuildInterval = snapshot_rebuild_interval
+        self._snapshotRebuildScheduled = False
+        self._lastSnapshotRebuild = 0
+
+        # when enabled, only scopes and top-level prefixes are registered and requests
+        # are dispatched to zones internally
+        self._trie = ZoneTrie () if dispatch_trie else None
+        self._trieFilters = {}
+
+        # number of processes for signing dynamic responses (0 to sign within the event loop)
+        self._signingWorkers = signing_workers
+        self._signingPool = None
+
+        # direct read-only access to the zone database for the serving path
+        self._lookup = None
+
+        # when enabled, requests are rate-limited and processed in order of priority, see admission.py
+        if source_rate > 0 or zone_rate > 0 or queue_size > 0:
+            self._admission = AdmissionControl (source_rate, source_burst, zone_rate, zone_burst,
+                                                queue_size if queue_size > 0 else 1000)
+        else:
+            self._admission = None
+        self._drainScheduled = False
+        self._drainBatch = 100
+
+        self._metricsFile = metrics_file
+        self._metricsInterval = metrics_interval
+        self._zoneLabels = {} # zone id => zone name, as used in metrics
+
+        self._metrics = Metrics ()
+        self._metrics.define ("ndns_requests_total", "counter", "Requests received, by zone and path (direct, hinted, dyndns)", ("zone", "path"))
+        self._metrics.define ("ndns_queries_total", "counter", "Valid queries, by zone and RR type", ("zone", "rtype"))
+        self._metrics.define ("ndns_answers_total", "counter", "Answers, by zone and result (positive, nexists, ndnauth)", ("zone", "result"))
+        self._metrics.define ("ndns_request_duration_seconds", "histogram", "Time spent processing request in the event loop", ("path",))
+        self._metrics.define ("ndns_signing_duration_seconds", "histogram", "Time spent signing dynamic responses (including queueing)")
+        self._metrics.define ("ndns_cache_entries", "gauge", "Number of cached entries", ("cache",))
+        self._metrics.define ("ndns_cache_hits_total", "counter", "Cache hits", ("cache",))
+        self._metrics.define ("ndns_cache_misses_total", "counter", "Cache misses", ("cache",))
+        self._metrics.define ("ndns_signing_queue_depth", "gauge", "Number of packets waiting to be signed by the worker pool")
+        self._metrics.define ("ndns_admission_shed_total", "counter", "Requests rejected by admission control, by reason (source, zone, queue)", ("reason",))
+        self._metrics.define ("ndns_admission_queue_depth", "gauge", "Number of admitted requests waiting to be processed, by priority", ("priority",))
+        self._metrics.define ("ndns_admission_wait_seconds", "histogram", "Time spent by admitted requests in the queue", ("priority",))
+
     def run (self):
         _LOG.info ('Daemon started')
 
         self._ndns = ndns.ndns_session (self.data_dir)
-        self._face = ndn.Face ()
+
+        if self._signingWorkers > 0:
+            # workers should be forked before the face is created
+            self._signingPool = SigningPool (self._ndns.keydir,
+                                             lambda callback: self._eventLoop.execute (callback),
+                                             workers = self._signingWorkers)
+
+        face = ndn.Face ()
+        self.start (face, ndn.EventLoop (face))
+        self._eventLoop.run ()
+
+        if self._signingPool:
+            self._signingPool.close ()
+
+        _LOG.info ('Daemon stopped')
+
+    def start (self, face, eventLoop):
+        """
+        Start serving zones using the specified face, without running the event loop
+
+        Allows the daemon to share the face and event loop with other applications,
+        e.g., when using simulated faces from :py:mod:`ndns.sim`
+        """
+        if self._ndns is None:
+            self._ndns = ndns.ndns_session (self.data_dir)
+
+        self._face = face
+        self._eventLoop = eventLoop
+        if self._lookup is not None:
+            self._lookup.close ()
+        self._lookup = RecordLookup (self._ndns.zonedb)
 
         if self._enable_dyndns:
-            self._dyndns = DyndnsDaemon (self.data_dir, self._ndns, self._face)
+            self._dyndns = DyndnsDaemon (self.data_dir, self._ndns, self._face,
+                                         onZoneChanged = self._onZoneChanged, signer = self._signData,
+                                         lookup = self._lookup)
 
         self._startZoneServing ()
+        self._loadSnapshots ()
 
-        self._eventLoop = ndn.EventLoop (self._face)
-        self._eventLoop.run ()
+        self._face.setInterestFilter (METRICS_PREFIX, self._onMetricsRequest)
 
-        _LOG.info ('Daemon stopped')
+        if self._metricsFile:
+            self._scheduleMetricsDump ()
 
     def terminate (self):
+        self._face.clearInterestFilter (METRICS_PREFIX)
         self._stopZoneServing ()
+        self._closeSnapshots ()
+        if self._lookup is not None:
+            self._lookup.close ()
+            self._lookup = None
         self._eventLoop.stop ()
         self._face = None
         self._ndns = None
 
     def reloadConfig (self):
-        _LOG.info ('Reload zone information')
-        self._stopZoneServing ()
-        self._startZoneServing ()
+        # can be called from a signal handler, so the work is done by the event loop between requests
+        self._eventLoop.execute (self._reloadConfig_Execute)
 
     def updateLocalPrefix (self, oldPrefix, newPrefix):
         _LOG.info ("Update local prefix from [%s] to [%s]" % (oldPrefix, newPrefix))
         self._eventLoop.execute (functools.partial (self._updateLocalPrefix_Execute, newPrefix))
 
 #private:
+    def _onZoneChanged (self, zone):
+        _LOG.debug ("Zone [%s] has been updated, invalidating cached answers" % zone.name)
+        self._answerCache.invalidate (zone.id)
+        self._negativeCache.invalidate (zone.id)
+        self._encapCache.invalidate (zone.id)
+
+        if zone.id in self._snapshots or zone.id in self._staleSnapshots or zone.id in self._rebuildingSnapshots:
+            # zone is served from the database until the snapshot is rebuilt outside of the event loop
+            if zone.id in self._snapshots:
+                self._snapshots.pop (zone.id).close ()
+            self._staleSnapshots.add (zone.id)
+            self._scheduleSnapshotRebuild ()
+
+    def _scheduleSnapshotRebuild (self):
+        # snapshots are rebuilt at most once per snapshot_rebuild_interval, all updated zones at once
+        if self._snapshotRebuildScheduled:
+            return
+        self._snapshotRebuildScheduled = True
+
+        delay = max (0, self._lastSnapshotRebuild + self._snapshotRebuildInterval - time.time ())
+        timer = threading.Timer (delay, lambda: self._eventLoop.execute (self._startSnapshotRebuild))
+        timer.daemon = True
+        timer.start ()
+
+    def _startSnapshotRebuild (self):
+        if self._face is None:
+            return
+
+        zones = list (self._staleSnapshots)
+        self._rebuildingSnapshots = self._staleSnapshots
+        self._staleSnapshots = set ()
+        self._lastSnapshotRebuild = time.time ()
+
+        thread = threading.Thread (target = self._rebuildSnapshots, args = (zones,), name = "Snapshot rebuild")
+        thread.daemon = True
+        thread.start ()
+
+    def _rebuildSnapshots (self, zones):
+        # executed in a separate thread, using its own session
+        session = sessionmaker (bind = self._ndns.get_bind ()) ()
+        session.snapshotdir = self._ndns.snapshotdir
+
+        rebuilt = []
+        for zone_id in zones:
+            try:
+                zone = session.query (ndns.Zone).get (zone_id)
+                if zone is not None and refresh_snapshot (session, zone):
+                    rebuilt.append (zone_id)
+            except Exception, e:
+                _LOG.warn ("Cannot rebuild snapshot of zone [%d], serving from the database: %s" % (zone_id, e))
+        session.close ()
+
+        self._eventLoop.execute (functools.partial (self._onSnapshotsRebuilt, zones, rebuilt))
+
+    def _onSnapshotsRebuilt (self, zones, rebuilt):
+        self._snapshotRebuildScheduled = False
+        self._rebuildingSnapshots = set ()
+        if self._face is None:
+            return
+
+        for zone_id in rebuilt:
+            # zone could have been updated again or removed while the snapshot was being rebuilt
+            if zone_id in self._staleSnapshots or not zone_id in self._zones:
+                continue
+            self._loadSnapshot (zone_id, self._zones[zone_id])
+
+        _LOG.info ('Rebuilt %d of %d updated zone snapshots' % (len (rebuilt), len (zones)))
+        if len (self._staleSnapshots) > 0:
+            self._scheduleSnapshotRebuild ()
+
+    def _loadSnapshot (self, zone_id, name):
+        path = snapshot_path (self._ndns, zone_id)
+        if not os.path.exists (path):
+            return
+
+        try:
+            if zone_id in self._snapshots:
+                self._snapshots.pop (zone_id).close ()
+            self._snapshots[zone_id] = ZoneSnapshot (path, name)
+        except Exception, e:
+            _LOG.warn ("Cannot load snapshot [%s], serving zone [%s] from the database: %s" % (path, name, e))
+
+    def _loadSnapshots (self):
+        self._closeSnapshots ()
+
+        for zone_id, name in self._zones.items ():
+            # on-disk snapshots of updated zones are outdated until rebuilt
+            if zone_id in self._staleSnapshots or zone_id in self._rebuildingSnapshots:
+                continue
+            self._loadSnapshot (zone_id, name)
+
+        _LOG.info ('Loaded %d zone snapshots' % len (self._snapshots))
+
+    def _closeSnapshots (self):
+        for snapshot in self._snapshots.values ():
+            snapshot.close ()
+        self._snapshots = {}
+
+    def _reloadConfig_Execute (self):
+        if self._face is None:
+            return
+
+        _LOG.info ('Reload zone information')
+        _LOG.info ('Negative cache stats: %s' % self._negativeCache.stats)
+        if self._signingPool:
+            _LOG.info ('Signing pool stats: %s' % self._signingPool.stats)
+        started = time.time ()
+
+        self._answerCache.clear ()
+        self._negativeCache.clear ()
+        self._encapCache.clear ()
+
+        # make sure changes made by other processes are visible
+        self._ndns.expire_all ()
+        zones = dict ((zone.id, zone) for zone in self._ndns.query (ndns.Zone))
+
+        # zone id can be reused by a zone created after the old one has been destroyed
+        removed = [zone_id for zone_id in self._zones
+                   if not zone_id in zones or str (zones[zone_id].name) != str (self._zones[zone_id])]
+        for zone_id in removed:
+            self._disableZone (self._zones.pop (zone_id))
+            if self._admission:
+                self._admission.forgetZone (zone_id)
+
+        added = [zone_id for zone_id in zones if not zone_id in self._zones]
+        for zone_id in added:
+            self._enableZone (zones[zone_id])
+            self._zones[zone_id] = zones[zone_id].name
+
+        # snapshots could have been compiled or rebuilt by the tools
+        self._loadSnapshots ()
+
+        _LOG.info ('Zone information reloaded in %.3f seconds (%d zones added, %d removed, %d served)' %
+                   (time.time () - started, len (added), len (removed), len (self._zones)))
+
     def _updateLocalPrefix_Execute (self, newPrefix):
+        self._encapCache.clear ()
+
+        if self._trie is not None:
+            self._disableScopes ()
+            self._autoScope = [ newPrefix ]
+            self._enableScopes ()
+            return
+
         self._stopZoneServing ()
         self._autoScope = [ newPrefix ]
         self._startZoneServing ()
 
     def _enableZone (self, zone):
+        self._zoneLabels[zone.id] = str (zone.name)
+
+        if self._trie is not None:
+            self._enableTrieZone (zone)
+            return
+
         name = zone.name
 
         self._face.setInterestFilter (ndn.Name (name).append ("DNS"),
@@ -85,8 +342,10 @@ class NdnsDaemon (object):
                                               functools.partial (self._onRequest, ndn.Name (scope).append ("\xF0."), zone))
         _LOG.info ('>> Start serving zone [%s] (%s)' % (name, activeScopes))
 
-    def _disableZone (self, zone):
-        name = zone.name
+    def _disableZone (self, name):
+        if self._trie is not None:
+            self._disableTrieZone (name)
+            return
 
         self._face.clearInterestFilter (name.append ("DNS"))
 
@@ -98,43 +357,180 @@ class NdnsDaemon (object):
 
         _LOG.info ('<< Stop serving zone [%s] (%s)' % (name, activeScopes))
 
+    def _topLevelPrefix (self, name):
+        if len (name) > 0:
+            return ndn.Name (name[:1])
+        else:
+            return ndn.Name ().append ("DNS")
+
+    def _enableTrieZone (self, zone):
+        name = zone.name
+        self._trie.insert (name, zone)
+
+        prefix = self._topLevelPrefix (name)
+        if not str (prefix) in self._trieFilters:
+            self._face.setInterestFilter (prefix, functools.partial (self._onDispatch, ndn.Name ()))
+            self._trieFilters[str (prefix)] = 0
+        self._trieFilters[str (prefix)] += 1
+
+        _LOG.info ('>> Start serving zone [%s] (via [%s])' % (name, prefix))
+
+    def _disableTrieZone (self, name):
+        self._trie.remove (name)
+
+        prefix = self._topLevelPrefix (name)
+        self._trieFilters[str (prefix)] -= 1
+        if self._trieFilters[str (prefix)] == 0:
+            self._face.clearInterestFilter (prefix)
+            del self._trieFilters[str (prefix)]
+
+        _LOG.info ('<< Stop serving zone [%s]' % name)
+
+    def _enableScopes (self):
+        for scope in self._scopes + self._autoScope:
+            prefix = ndn.Name (scope).append ("\xF0.")
+            self._face.setInterestFilter (prefix, functools.partial (self._onDispatch, prefix))
+            _LOG.info ('>> Start serving scope [%s]' % scope)
+
+    def _disableScopes (self):
+        for scope in self._scopes + self._autoScope:
+            self._face.clearInterestFilter (ndn.Name (scope).append ("\xF0."))
+            _LOG.info ('<< Stop serving scope [%s]' % scope)
+
     def _startZoneServing (self):
+        if self._trie is not None:
+            self._enableScopes ()
+
         for zone in self._ndns.query (ndns.Zone):
             self._enableZone (zone)
-            self._zones.append (zone)
+            self._zones[zone.id] = zone.name
 
     def _stopZoneServing (self):
-        for zone in self._zones:
-            self._disableZone (zone)
-        self._zones = []
+        for name in self._zones.values ():
+            self._disableZone (name)
+        self._zones = {}
+
+        if self._trie is not None:
+            self._disableScopes ()
+
+    def _onDispatch (self, scope, basename, interest):
+        zone = self._trie.find (interest.name[len(scope):])
+        if zone is None:
+            _LOG.debug ("No zone is responsible for [%s]" % interest.name)
+            return
+
+        name = zone.name
+        if len (scope) > 0 and ndn.Name (scope[:-1]).isPrefixOf (name):
+            # zones within the scope are reachable without forwarding hint
+            return
+
+        self._onRequest (scope, zone, ndn.Name (scope).append (name).append ("DNS"), interest)
 
     def _onRequest (self, scope, zone, basename, interest):
+        if self._admission is None:
+            self._processRequest (scope, zone, basename, interest)
+            return
+
+        # Interests do not carry source address, so forwarding hint is the only available indication of the source.
+        # Only direct requests with a ready answer get the highest priority: misses need freshly signed
+        # NEXISTS/NDNAUTH answers, and hinted requests need signed encapsulation
+        if self._enable_dyndns and interest.name[-1] == "NDNUPDATE":
+            priority = PRIORITY_DYNDNS
+        elif len (scope) == 0 and self._isAnswerReady (zone, basename, interest.name):
+            priority = PRIORITY_SIGNED
+        else:
+            priority = PRIORITY_SIGN
+
+        if not self._admission.admit (str (scope) if len (scope) > 0 else None, zone.id, priority,
+                                      functools.partial (self._processQueuedRequest, time.time (), priority,
+                                                         scope, zone, basename, interest)):
+            _LOG.debug ("Request [%s] is rejected by admission control" % interest.name)
+            return
+
+        if not self._drainScheduled:
+            self._drainScheduled = True
+            self._eventLoop.execute (self._drainQueue)
+
+    def _drainQueue (self):
+        # process a limited number of requests, so newly arrived requests can be queued (and prioritized)
+        self._drainScheduled = False
+        for i in xrange (self._drainBatch):
+            request = self._admission.pop ()
+            if request is None:
+                return
+            request ()
+
+        self._drainScheduled = True
+        self._eventLoop.execute (self._drainQueue)
+
+    def _processQueuedRequest (self, enqueued, priority, scope, zone, basename, interest):
+        self._metrics.observe ("ndns_admission_wait_seconds", time.time () - enqueued, (PRIORITY_NAMES[priority],))
+        self._processRequest (scope, zone, basename, interest)
+
+    def _processRequest (self, scope, zone, basename, interest):
         _LOG.debug (">> scope [%s], zone [%s], basename [%s], interest [%s]" % (scope, zone.name, basename, interest.name))
+        started = time.time ()
 
-        if self._enable_dyndns:
-            if interest.name[-1] == "NDNUPDATE":
-                self._dyndns._processDyNDNS (zone, basename, interest)
-                return
+        if self._enable_dyndns and interest.name[-1] == "NDNUPDATE":
+            path = "dyndns"
+            self._dyndns._processDyNDNS (zone, basename, interest)
+        else:
+            path = "hinted" if len (scope) > 0 else "direct"
+            self._getRequestedData (zone, ndn.Name (basename [len(scope):]), ndn.Name (interest.name [len(scope):]),
+                                    functools.partial (self._onRequestedData, scope, zone))
+
+        self._metrics.inc ("ndns_requests_total", (self._zoneLabels.get (zone.id), path))
+        self._metrics.observe ("ndns_request_duration_seconds", time.time () - started, (path,))
+
+    def _onRequestedData (self, scope, zone, dataPacket):
+        if len (scope) == 0:
+            self._face.put (dataPacket)
+            return
+
+        cacheKey = (str (scope), str (dataPacket.name))
+        encapPacket = self._encapCache.get (cacheKey)
+        if encapPacket is not None:
+            _LOG.debug ("Using cached encapsulation [%s]" % encapPacket.name)
+            self._face.put (encapPacket)
+            return
+
+        freshness = dataPacket.signedInfo.freshnessSeconds
+
+        # will sign with real key, but not sure if it is really necessary
+        self._signData (ndn.Name (scope).append (dataPacket.name),
+                        dataPacket.toWire (),
+                        freshness,
+                        zone.default_key,
+                        functools.partial (self._onEncapsulated, cacheKey, zone.id, freshness))
+
+    def _onEncapsulated (self, cacheKey, zone_id, freshness, encapPacket):
+        _LOG.debug ("Encapsulating into [%s]" % encapPacket.name)
+
+        # encapsulated packet can be reused while the inner packet is fresh
+        if freshness:
+            self._encapCache.put (cacheKey, encapPacket, group = zone_id,
+                                  expire = time.time () + freshness)
+
+        self._face.put (encapPacket)
+
+    def _signData (self, name, content, freshness, key, onSigned):
+        if self._signingPool is None:
+            started = time.time ()
+            dataPacket = ndns.createSignedData (self._ndns, name, content, freshness, key)
+            self._metrics.observe ("ndns_signing_duration_seconds", time.time () - started)
+            onSigned (dataPacket)
+        else:
+            self._signingPool.sign (name, content, freshness, key,
+                                    functools.partial (self._onSigned, time.time (), onSigned))
 
-        dataPacket = self._getRequestedData (zone, ndn.Name (basename [len(scope):]), ndn.Name (interest.name [len(scope):]))
-        if dataPacket:
-            if len (scope) == 0:
-                self._face.put (dataPacket)
-            else:
-                # will sign with real key, but not sure if it is really necessary
-                encapPacket = ndns.createSignedData (self._ndns,
-                                                     ndn.Name (scope).append (dataPacket.name),
-                                                     dataPacket.toWire (),
-                                                     dataPacket.signedInfo.freshnessSeconds,
-                                                     zone.default_key)
-                _LOG.debug ("Encapsulating into [%s]" % encapPacket.name)
-                self._face.put (encapPacket)
-
-        return
-
-    def _getRequestedData (self, zone, basename, interestName):
-        _LOG.debug (">> REAL: basename [%s], interest [%s]" % (basename, interestName))
+    def _onSigned (self, started, onSigned, dataPacket):
+        self._metrics.observe ("ndns_signing_duration_seconds", time.time () - started)
+        onSigned (dataPacket)
 
+    def _parseRequest (self, basename, interestName):
+        """
+        :returns: tuple (label, RR type) of the request or None if the request is invalid
+        """
         if str(interestName[-1])[0] == '\xFD':
             # allow version to be specified, but ignore it for the database lookup
             request_name = ndn.Name (interestName[:-1])
@@ -153,57 +549,164 @@ class NdnsDaemon (object):
             _LOG.debug ("Invalid request: label [%s] cannot be dnsified (%s)" % (request_name[len(basename):-1], e))
             return None
 
-        rrset = self._ndns.query (ndns.RRSet).with_parent (zone).filter_by (label = label.to_text (), rtype = rrtype).first ()
-
-        if rrset is None:
-            # check if there is more a specific record:
-            more_specific_rrset = self._ndns.query (ndns.RRSet).\
-                with_parent (zone).\
-                filter (ndns.RRSet.label.like ("%%.%s" % label.to_text ()), ndns.RRSet.rtype == rrtype).first ()
-            if more_specific_rrset:
-
-                msg = dns.message.Message (id=0)
-                rrset = dns.rrset.RRset (zone.dns_name, dns.rdataclass.IN, dns.rdatatype.NDNAUTH)
-                # zone.soa[0].rrs[0].ttl
-                rrset.add (ttl = 1, rd = dns.rdtypes.IN.NDNAUTH.NDNAUTH (dns.rdataclass.IN, dns.rdatatype.NDNAUTH, zone.name))
-                msg.authority.append (rrset)
-
-                dataPacket = ndns.createSignedData (self._ndns,
-                                                    interestName.appendVersion (),
-                                                    msg.to_wire (origin = zone.dns_name),
-                                                    zone.soa[0].rrs[0].ttl,
-                                                    # 1,
-                                                    zone.default_key)
-
-                _LOG.debug ("<< Requested record doesn't exist, but there is a more specific record. Returning NDNAUTH as [%s]" % dataPacket.name)
-                return dataPacket
+        return (label, rrtype)
+
+    def _isAnswerReady (self, zone, basename, interestName):
+        """
+        Check (without signing or fetching anything) if the request can be answered with an already signed packet
+        """
+        request = self._parseRequest (basename, interestName)
+        if request is None:
+            return False
+
+        cacheKey = (zone.id, request[0].to_text (), request[1])
+        if cacheKey in self._answerCache or cacheKey in self._negativeCache:
+            return True
+
+        snapshot = self._snapshots.get (zone.id)
+        if snapshot is not None:
+            return snapshot.lookup (cacheKey[1], cacheKey[2]) is not None
+        return self._lookup.exists (zone.id, cacheKey[1], cacheKey[2])
+
+    def _getRequestedData (self, zone, basename, interestName, onData):
+        _LOG.debug (">> REAL: basename [%s], interest [%s]" % (basename, interestName))
+
+        request = self._parseRequest (basename, interestName)
+        if request is None:
+            return
+        (label, rrtype) = request
+
+        zoneLabel = self._zoneLabels.get (zone.id)
+        self._metrics.inc ("ndns_queries_total", (zoneLabel, dns.rdatatype.to_text (rrtype)))
+
+        cacheKey = (zone.id, label.to_text (), rrtype)
+        dataPacket = self._answerCache.get (cacheKey)
+        if dataPacket is None:
+            snapshot = self._snapshots.get (zone.id)
+            if snapshot is not None:
+                wire = snapshot.lookup (label.to_text (), rrtype)
+                if wire is None:
+                    self._getNegativeAnswer (zone, label, rrtype, interestName, onData)
+                    return
+
+                # the only copy is made when the packet is decoded (and then kept in the answer cache)
+                dataPacket = ndn.Data.fromWire (str (wire))
             else:
-                # _LOG.debug ("(!!! no action defined yet!!!) The requested record (%s %s) not found in zone [%s]" %
-                #             (label.to_text (), dns.rdatatype.to_text (rrtype), zone.name))
-
-                msg = dns.message.Message (id=0)
-                rrset = dns.rrset.RRset (label, dns.rdataclass.IN, dns.rdatatype.NEXISTS)
-                # zone.soa[0].rrs[0].ttl
-                rrset.add (ttl = 1, rd = dns.rdtypes.IN.NEXISTS.NEXISTS (dns.rdataclass.IN, dns.rdatatype.NEXISTS))
-                msg.answer.append (rrset)
-
-                dataPacket = ndns.createSignedData (self._ndns,
-                                                    interestName.appendVersion (),
-                                                    msg.to_wire (origin = zone.dns_name),
-                                                    zone.soa[0].rrs[0].ttl,
-                                                    # 1,
-                                                    zone.default_key)
-
-                del rrset
-                _LOG.debug ("<< Requested record nor more specific record exists. Returning NEXISTS as part of [%s]" % dataPacket.name)
-                return dataPacket
-
-        dataPacket = rrset.ndndata
-        del rrset
+                wire = self._lookup.get (zone.id, label.to_text (), rrtype)
+                if wire is None:
+                    self._getNegativeAnswer (zone, label, rrtype, interestName, onData)
+                    return
+
+                dataPacket = ndn.Data.fromWire (wire)
+            self._answerCache.put (cacheKey, dataPacket, group = zone.id)
+
         if not interestName.isPrefixOf (dataPacket.name):
             _LOG.debug ("Request is not in a canonical form (e.g., case mistmatch), requested data found, but cannot be returned")
             _LOG.debug ("        Could be version mistmatch")
-            return None
         else:
             _LOG.debug ("<< Found a valid record, returning data object [%s]" % dataPacket.name)
-            return dataPacket
+            self._metrics.inc ("ndns_answers_total", (zoneLabel, "positive"))
+            onData (dataPacket)
+
+    def _getNegativeAnswer (self, zone, label, rrtype, interestName, onData):
+        cacheKey = (zone.id, label.to_text (), rrtype)
+        cached = self._negativeCache.get (cacheKey)
+        if cached is not None and interestName.isPrefixOf (cached[0].name):
+            _LOG.debug ("<< Returning cached negative answer [%s]" % cached[0].name)
+            self._metrics.inc ("ndns_answers_total", (self._zoneLabels.get (zone.id), cached[1]))
+            onData (cached[0])
+            return
+
+        # check if there is more a specific record (zone apex is never checked):
+        snapshot = self._snapshots.get (zone.id)
+        if len (label) > 0 and snapshot is not None:
+            more_specific_rrset = snapshot.has_below (label.to_text (), rrtype)
+        elif len (label) > 0:
+            more_specific_rrset = self._lookup.has_below (zone.id, label.to_text (), rrtype)
+        else:
+            more_specific_rrset = None
+
+        msg = dns.message.Message (id=0)
+        if more_specific_rrset:
+            result = "ndnauth"
+            _LOG.debug ("<< Requested record doesn't exist, but there is a more specific record. Returning NDNAUTH")
+
+            rrset = dns.rrset.RRset (zone.dns_name, dns.rdataclass.IN, dns.rdatatype.NDNAUTH)
+            # zone.soa[0].rrs[0].ttl
+            rrset.add (ttl = 1, rd = dns.rdtypes.IN.NDNAUTH.NDNAUTH (dns.rdataclass.IN, dns.rdatatype.NDNAUTH, zone.name))
+            msg.authority.append (rrset)
+        else:
+            # _LOG.debug ("(!!! no action defined yet!!!) The requested record (%s %s) not found in zone [%s]" %
+            #             (label.to_text (), dns.rdatatype.to_text (rrtype), zone.name))
+            _LOG.debug ("<< Requested record nor more specific record exists. Returning NEXISTS")
+            result = "nexists"
+
+            rrset = dns.rrset.RRset (label, dns.rdataclass.IN, dns.rdatatype.NEXISTS)
+            # zone.soa[0].rrs[0].ttl
+            rrset.add (ttl = 1, rd = dns.rdtypes.IN.NEXISTS.NEXISTS (dns.rdataclass.IN, dns.rdatatype.NEXISTS))
+            msg.answer.append (rrset)
+
+        soa = zone.soa[0].rrs[0]
+        self._signData (interestName.appendVersion (),
+                        msg.to_wire (origin = zone.dns_name),
+                        soa.ttl,
+                        # 1,
+                        zone.default_key,
+                        # negative answers are cached for SOA minimum TTL (RFC 2308)
+                        functools.partial (self._onNegativeAnswer, cacheKey, zone.id, result, soa.dns_rrdata.minimum, onData))
+
+    def _onNegativeAnswer (self, cacheKey, zone_id, result, ttl, onData, dataPacket):
+        _LOG.debug ("<< Negative answer [%s]" % dataPacket.name)
+        self._negativeCache.put (cacheKey, (dataPacket, result), group = zone_id,
+                                 size = len (dataPacket.toWire ()),
+                                 expire = time.time () + ttl)
+        self._metrics.inc ("ndns_answers_total", (self._zoneLabels.get (zone_id), result))
+        onData (dataPacket)
+
+    def _formatMetrics (self):
+        for (cache, name) in [(self._answerCache, "answer"), (self._negativeCache, "negative"), (self._encapCache, "encap")]:
+            self._metrics.set ("ndns_cache_entries", (name,), len (cache))
+            self._metrics.set ("ndns_cache_hits_total", (name,), cache.hits)
+            self._metrics.set ("ndns_cache_misses_total", (name,), cache.misses)
+
+        if self._signingPool:
+            self._metrics.set ("ndns_signing_queue_depth", (), self._signingPool.stats["queue_depth"])
+
+        if self._admission:
+            for (reason, count) in self._admission.shed.items ():
+                self._metrics.set ("ndns_admission_shed_total", (reason,), count)
+            for (priority, name) in enumerate (PRIORITY_NAMES):
+                self._metrics.set ("ndns_admission_queue_depth", (name,), self._admission.depth (priority))
+
+        return self._metrics.toText ()
+
+    def _onMetricsRequest (self, basename, interest):
+        # local request, signed with the default key of the host
+        key = ndn.Key.getDefault ()
+        signedInfo = ndn.SignedInfo (key_digest = key.publicKeyID,
+                                     key_locator = ndn.KeyLocator.getDefault (),
+                                     freshness = 1)
+
+        co = ndn.Data (name = ndn.Name (METRICS_PREFIX).appendVersion (), signed_info = signedInfo, content = self._formatMetrics ())
+        co.sign (key)
+        self._face.put (co)
+
+    def _scheduleMetricsDump (self):
+        timer = threading.Timer (self._metricsInterval,
+                                 lambda: self._eventLoop.execute (self._dumpMetrics))
+        timer.daemon = True
+        timer.start ()
+
+    def _dumpMetrics (self):
+        if self._face is None:
+            return
+
+        try:
+            tmp = "%s.tmp" % self._metricsFile
+            with open (tmp, "w") as f:
+                f.write (self._formatMetrics ())
+            os.rename (tmp, self._metricsFile)
+        except Exception, e:
+            _LOG.warn ("Cannot write metrics to [%s]: %s" % (self._metricsFile, e))
+
+        self._scheduleMetricsDump ()
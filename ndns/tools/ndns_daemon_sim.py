@@ -12,7 +12,9 @@
 import logging
 import ndn
 import dns.rdataclass, dns.rdatatype, dns.rdata, dns.rrset, dns.zone
-import os, functools
+import functools
+import hashlib
+import random
 
 # part of lib/
 import ndns
@@ -20,31 +22,141 @@ import dns.rdtypes.IN.NDNAUTH
 import dns.rdtypes.IN.NEXISTS
 import dns.rdtypes.IN.NDNCERTSEQ
 
+from ndns.cache import LruCache
+
 _LOG = logging.getLogger ("ndns.DaemonSim")
 
+def _rdata_A (rand, hint, origin):
+    return "10.%d.%d.%d" % (rand.randint (0, 255), rand.randint (0, 255), rand.randint (1, 254))
+
+def _rdata_AAAA (rand, hint, origin):
+    return "fd00::%x:%x" % (rand.randint (0, 0xffff), rand.randint (1, 0xffff))
+
+def _rdata_TXT (rand, hint, origin):
+    return "\"%032x\"" % rand.getrandbits (128)
+
+def _rdata_FH (rand, hint, origin):
+    return "0 0 %s" % hint
+
+def _target (rand, origin):
+    return "t%x.%s" % (rand.getrandbits (32), origin.to_text ())
+
+def _rdata_name (rand, hint, origin):
+    return _target (rand, origin)
+
+def _rdata_MX (rand, hint, origin):
+    return "%d %s" % (rand.randint (0, 100), _target (rand, origin))
+
+def _rdata_SRV (rand, hint, origin):
+    return "%d %d %d %s" % (rand.randint (0, 100), rand.randint (0, 100), rand.randint (1, 65535), _target (rand, origin))
+
+def _rdata_SOA (rand, hint, origin):
+    return "ns1.%s admin.%s %d 3600 600 86400 3600" % (origin.to_text (), origin.to_text (), rand.randint (1, 0x7fffffff))
+
+def _rdata_generic (rand, hint, origin):
+    return "\\# 16 %032x" % rand.getrandbits (128)
+
+# generators of record data for leaf records
+RDATA_GENERATORS = {
+    "A": _rdata_A,
+    "AAAA": _rdata_AAAA,
+    "TXT": _rdata_TXT,
+    "FH": _rdata_FH,
+    "NS": _rdata_name,
+    "CNAME": _rdata_name,
+    "DNAME": _rdata_name,
+    "PTR": _rdata_name,
+    "MX": _rdata_MX,
+    "SRV": _rdata_SRV,
+    "SOA": _rdata_SOA,
+}
+
+def _rdata_generator (rtype):
+    """
+    Get generator of record data for the leaf RR type
+
+    Types that are not known to dnspython get random RFC 3597 generic data; known types without
+    a generator are not supported, as random data cannot be decoded for them.
+
+    :raises ValueError: if the type is not supported
+    """
+    if rtype in RDATA_GENERATORS:
+        return RDATA_GENERATORS[rtype]
+
+    rdtype = dns.rdatatype.from_text (rtype)
+    if dns.rdata.get_rdata_class (dns.rdataclass.IN, rdtype) is dns.rdata.GenericRdata:
+        return _rdata_generic
+
+    raise ValueError ("Leaf RR type [%s] is not supported (supported: %s, and types unknown to dnspython)" %
+                      (rtype, ", ".join (sorted (RDATA_GENERATORS))))
+
 class NdnsDaemonSim (object):
+    """
+    Synthetic authoritative NDNS server
+
+    Instead of serving records from the database, the daemon emulates delegation tree of ``depth`` levels
+    below each zone in the database.  Each synthetic zone ``<zone>/n<i>`` (``0 <= i < fanout``) is delegated
+    from its parent with NS and FH records, and contains ``leaves`` labels (``h<j>``) with records of each of
+    ``leaf_rtypes`` types.  Record data is derived from ``seed`` and the record name, so it is stable between
+    runs.  The tree is never materialized, so the number of emulated zones (``fanout ** depth`` per database zone)
+    is limited only by the size of the name space.
+
+    All responses are signed with the default key of the database zone and cached (up to ``cache_size`` packets
+    and ``cache_bytes`` bytes).  Note that keys of synthetic zones do not exist, so synthetic responses can be
+    verified only with a trust policy that accepts the database zone key for its subzones.
+
+    :param presign: Number of responses to sign at startup (breadth-first from the top of each tree)
+    """
+
 #public:
-    def __init__ (self, data_dir, scopes = [], enable_dyndns = True):
+    def __init__ (self, data_dir, scopes = [], enable_dyndns = True,
+                  depth = 3, fanout = 10, leaves = 10, leaf_rtypes = ("FH", "TXT"), seed = 0,
+                  hint = "/", ttl = 3600, cache_size = 100000, cache_bytes = 67108864, presign = 0):
         self.data_dir = data_dir
+        self._ndns = None
         self._scopes = [ndn.Name (scope) for scope in scopes]
 
         self._zones = []
         self._autoScope = []
         self._enable_dyndns = enable_dyndns
 
-    def run (self):
-        _LOG.info ('Daemon started')
+        self.depth = depth
+        self.fanout = fanout
+        self.leaves = leaves
+        self.leaf_rtypes = [dns.rdatatype.to_text (dns.rdatatype.from_text (rtype)) for rtype in leaf_rtypes]
+        self._generators = dict ((rtype, _rdata_generator (rtype)) for rtype in self.leaf_rtypes)
+        self.seed = seed
+        self.hint = hint
+        self.ttl = ttl
+        self.presign = presign
 
-        self._ndns = ndns.ndns_session (self.data_dir)
-        self._face = ndn.Face ()
+        # request name (without version) => signed Data packet
+        self._cache = LruCache (cache_size, cache_bytes)
 
-        self._startZoneServing ()
+    def run (self):
+        _LOG.info ('Daemon started')
 
-        self._eventLoop = ndn.EventLoop (self._face)
+        face = ndn.Face ()
+        self.start (face, ndn.EventLoop (face))
         self._eventLoop.run ()
 
         _LOG.info ('Daemon stopped')
 
+    def start (self, face, eventLoop):
+        """
+        Start serving synthetic zones using the specified face, without running the event loop
+        """
+        if self._ndns is None:
+            self._ndns = ndns.ndns_session (self.data_dir)
+
+        self._face = face
+        self._eventLoop = eventLoop
+
+        self._startZoneServing ()
+
+        if self.presign > 0:
+            self._presign ()
+
     def terminate (self):
         self._stopZoneServing ()
         self._eventLoop.stop ()
@@ -55,29 +167,29 @@ class NdnsDaemonSim (object):
     def _enableZone (self, zone):
         name = zone.name
 
-        self._face.setInterestFilter (ndn.Name (name).append ("DNS"),
+        self._face.setInterestFilter (ndn.Name (name),
                                       functools.partial (self._onRequest, ndn.Name (), zone))
 
         activeScopes = []
         for scope in self._scopes + self._autoScope:
             if not scope.isPrefixOf (name):
                 activeScopes.append (str (scope))
-                self._face.setInterestFilter (ndn.Name (scope).append ("\xF0.").append (name).append ("DNS"),
+                self._face.setInterestFilter (ndn.Name (scope).append ("\xF0.").append (name),
                                               functools.partial (self._onRequest, ndn.Name (scope).append ("\xF0."), zone))
-        _LOG.info ('>> Start serving zone [%s] (%s)' % (name, activeScopes))
+        _LOG.info ('>> Start serving synthetic tree under zone [%s] (%s)' % (name, activeScopes))
 
     def _disableZone (self, zone):
         name = zone.name
 
-        self._face.clearInterestFilter (ndn.Name (name).append ("DNS"))
+        self._face.clearInterestFilter (ndn.Name (name))
 
         activeScopes = []
         for scope in self._scopes + self._autoScope:
             if not scope.isPrefixOf (name):
                 activeScopes.append (str (scope))
-                self._face.clearInterestFilter (ndn.Name (scope).append ("\xF0.").append (name).append ("DNS"))
+                self._face.clearInterestFilter (ndn.Name (scope).append ("\xF0.").append (name))
 
-        _LOG.info ('<< Stop serving zone [%s] (%s)' % (name, activeScopes))
+        _LOG.info ('<< Stop serving synthetic tree under zone [%s] (%s)' % (name, activeScopes))
 
     def _startZoneServing (self):
         for zone in self._ndns.query (ndns.Zone):
@@ -89,70 +201,134 @@ class NdnsDaemonSim (object):
             self._disableZone (zone)
         self._zones = []
 
+    def _presign (self):
+        signed = 0
+        queue = [(zone, ndn.Name ()) for zone in self._zones]
+        while len (queue) > 0 and signed < self.presign:
+            (zone, path) = queue.pop (0)
+            zoneName = ndn.Name (zone.name).append (path)
+
+            requests = []
+            if len (path) < self.depth:
+                for i in xrange (self.fanout):
+                    child = "n%d" % i
+                    requests.append ((ndn.Name ().append (child), "NS"))
+                    requests.append ((ndn.Name ().append (child).append ("ns1"), "FH"))
+                    queue.append ((zone, ndn.Name (path).append (child)))
+
+            for j in xrange (self.leaves):
+                for rtype in self.leaf_rtypes:
+                    requests.append ((ndn.Name ().append ("h%d" % j), rtype))
+
+            for (label, rtype) in requests:
+                if signed >= self.presign:
+                    break
+                self._getRequestedData (zone, ndn.Name (zone.name), ndn.Name (zoneName).append ("DNS").append (label).append (rtype))
+                signed += 1
+
+        _LOG.info ('Pre-signed %d responses (cache: %s)' % (signed, self._cache.stats))
+
     def _onRequest (self, scope, zone, basename, interest):
         _LOG.debug (">> scope [%s], zone [%s], basename [%s], interest [%s]" % (scope, zone.name, basename, interest.name))
 
         dataPacket = self._getRequestedData (zone, ndn.Name (basename [len(scope):]), ndn.Name (interest.name [len(scope):]))
-        self._face.put (dataPacket)
+        if dataPacket:
+            self._face.put (dataPacket)
 
     def _getRequestedData (self, zone, basename, interestName):
-        _LOG.debug (">> REAL: basename [%s], interest [%s]" % (basename, interestName))
+        _LOG.debug (">> SYNTHETIC: basename [%s], interest [%s]" % (basename, interestName))
 
         if str(interestName[-1])[0] == '\xFD':
-            # allow version to be specified, but ignore it for the database lookup
+            # allow version to be specified, but ignore it for the lookup
             request_name = ndn.Name (interestName[:-1])
         else:
             request_name = interestName
 
+        key = str (request_name)
+        dataPacket = self._cache.get (key)
+        if dataPacket and interestName.isPrefixOf (dataPacket.name):
+            return dataPacket
+
+        components = [str (component) for component in request_name[len(basename):]]
         try:
-            label = dns.name.from_text (ndns.dnsify (str (ndn.Name (request_name[len(basename):-1])))).relativize (origin = dns.name.root)
+            dnsPos = components.index ("DNS")
+        except ValueError:
+            _LOG.debug ("Invalid request: no DNS component in [%s]" % request_name)
+            return None
+
+        path = components[:dnsPos]
+        label = components[dnsPos+1:-1]
+        if dnsPos == len (components) - 1 or not self._isZone (path):
+            _LOG.debug ("Invalid request: [%s] is not a request to a synthetic zone" % request_name)
+            return None
+
+        try:
+            rtype = dns.rdatatype.to_text (dns.rdatatype.from_text (components[-1]))
+            zoneName = ndn.Name (request_name[:len(basename)+dnsPos])
+            dns_zone = dns.name.from_text (ndns.dnsify (str (zoneName)))
+            dns_label = dns.name.from_text (ndns.dnsify (str (ndn.Name (request_name[len(basename)+dnsPos+1:-1])))).relativize (origin = dns.name.root)
         except Exception, e:
-            _LOG.debug ("Invalid request: label [%s] cannot be dnsified (%s)" % (request_name[len(basename):-1], e))
+            _LOG.debug ("Invalid request [%s]: %s" % (request_name, e))
             return None
 
-        if (str(interestName[-1]) == "NS"):
-            msg = dns.message.Message (id=0)
-            rrset = dns.rrset.from_text (label, 3600, dns.rdataclass.IN, dns.rdatatype.NS, "ns1.%s.%s" % (label, zone.dns_name.to_text ()))
-            msg.answer.append (rrset)
-
-            dataPacket = ndns.createSignedData (self._ndns,
-                                                ndn.Name (interestName).appendVersion (),
-                                                msg.to_wire (origin = zone.dns_name),
-                                                zone.soa[0].rrs[0].ttl,
-                                                # 1,
-                                                zone.default_key)
-        elif (str(interestName[-1]) == "FH"):
-            msg = dns.message.Message (id=0)
-            rrset = dns.rrset.from_text (label, 3600, dns.rdataclass.IN, dns.rdatatype.FH, "0 0 /")
-            msg.answer.append (rrset)
-
-            dataPacket = ndns.createSignedData (self._ndns,
-                                                ndn.Name (interestName).appendVersion (),
-                                                msg.to_wire (origin = zone.dns_name),
-                                                zone.soa[0].rrs[0].ttl,
-                                                # 1,
-                                                zone.default_key)
-        else:
-            raise Exception ("NOT ACCEPTABLE REQUEST")
-            
-        # if (interestName[-1] == "FH"):
-            
-        
-        # msg = dns.message.Message (id=0)
-        # rrset = dns.rrset.RRset (dns.name.from_text ("@"), dns.rdataclass.IN, dns.rdatatype.NEXISTS)
-        # # zone.soa[0].rrs[0].ttl
-        # rrset.add (ttl = 1, rd = dns.rdtypes.IN.NEXISTS.NEXISTS (dns.rdataclass.IN, dns.rdatatype.NEXISTS))
-        # msg.answer.append (rrset)
-
-        # dataPacket = ndns.createSignedData (self._ndns,
-        #                                     ndn.Name (interestName).appendVersion (),
-        #                                     msg.to_wire (origin = zone.dns_name),
-        #                                     zone.soa[0].rrs[0].ttl,
-        #                                     # 1,
-        #                                     zone.default_key)
-
-        # print dataPacket.name
-        # print msg.to_text ()
-        
-        # _LOG.debug ("<< Requested record nor more specific record exists. Returning NEXISTS as part of [%s]" % dataPacket.name)
+        msg = dns.message.Message (id=0)
+        try:
+            rdatas = self._lookup (str (zoneName), path, label, rtype, dns_zone)
+            if rdatas is not None:
+                msg.answer.append (dns.rrset.from_text (dns_label, self.ttl, dns.rdataclass.IN, rtype, *rdatas))
+            elif self._hasMoreSpecific (path, label, rtype):
+                rrset = dns.rrset.RRset (dns_zone, dns.rdataclass.IN, dns.rdatatype.NDNAUTH)
+                rrset.add (ttl = 1, rd = dns.rdtypes.IN.NDNAUTH.NDNAUTH (dns.rdataclass.IN, dns.rdatatype.NDNAUTH, zoneName))
+                msg.authority.append (rrset)
+            else:
+                rrset = dns.rrset.RRset (dns_label, dns.rdataclass.IN, dns.rdatatype.NEXISTS)
+                rrset.add (ttl = 1, rd = dns.rdtypes.IN.NEXISTS.NEXISTS (dns.rdataclass.IN, dns.rdatatype.NEXISTS))
+                msg.answer.append (rrset)
+            wire = msg.to_wire (origin = dns_zone)
+        except Exception, e:
+            _LOG.warn ("Cannot generate synthetic response for [%s]: %s" % (request_name, e))
+            return None
+
+        dataPacket = ndns.createSignedData (self._ndns,
+                                            ndn.Name (request_name).appendVersion (),
+                                            wire,
+                                            self.ttl,
+                                            zone.default_key)
+
+        self._cache.put (key, dataPacket, size = len (dataPacket.toWire ()))
         return dataPacket
+
+    def _child (self, component):
+        # index of the synthetic child zone or None
+        if len (component) < 2 or component[0] != "n" or not component[1:].isdigit ():
+            return None
+        index = int (component[1:])
+        if index >= self.fanout or str (index) != component[1:]:
+            return None
+        return index
+
+    def _isZone (self, path):
+        return len (path) <= self.depth and all (self._child (component) is not None for component in path)
+
+    def _lookup (self, zoneName, path, label, rtype, dns_zone):
+        """
+        :returns: list of rdata in text format or None, if the record does not exist
+        """
+        if len (path) < self.depth and len (label) > 0 and self._child (label[0]) is not None:
+            if len (label) == 1 and rtype == "NS":
+                return ["ns1.%s.%s" % (label[0], dns_zone.to_text ())]
+            if len (label) == 2 and label[1] == "ns1" and rtype == "FH":
+                return ["0 0 %s" % self.hint]
+            return None
+
+        if len (label) == 1 and label[0][:1] == "h" and label[0][1:].isdigit () and int (label[0][1:]) < self.leaves \
+                and rtype in self.leaf_rtypes:
+            digest = hashlib.md5 ("%d/%s/%s/%s" % (self.seed, zoneName, label[0], rtype)).hexdigest ()
+            rand = random.Random (int (digest, 16))
+            return [self._generators[rtype] (rand, self.hint, dns_zone)]
+
+        return None
+
+    def _hasMoreSpecific (self, path, label, rtype):
+        # the only records below other labels are FH records of delegated zones' name servers
+        return rtype == "FH" and len (path) < self.depth and len (label) == 1 and self._child (label[0]) is not None
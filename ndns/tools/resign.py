@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- Mode:python; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (c) 2013, Regents of the University of California
+#                     Alexander Afanasyev
+#
+# BSD license, See the doc/LICENSE file for more information
+#
+# Author: Alexander Afanasyev <alexander.afanasyev@ucla.edu>
+#
+
+"""
+Incremental re-signing of RR sets
+
+Only RR sets that need it are re-signed:
+
+- *dirty* RR sets (RRs were added or removed since the last signing), unless the content hash shows
+  that RRs did not actually change
+- RR sets signed by a key that is no longer the zone's signing key (or with unknown signing state)
+- RR sets signed more than ``maxAge`` seconds ago
+
+RR sets are processed in bounded batches: candidates are selected and signed outside of a write
+transaction, and the results of each batch are written in a single short transaction, so the
+re-signing can run continuously next to ndns-daemon and DyNDNS updates.  RR sets that were changed
+while the batch was being signed (different RRs or Data packet) are left for the next pass.
+
+Data packets not signed by zone's keys (e.g., DyNDNS updates signed by the updater) are never
+re-signed.
+"""
+
+import sys
+import time
+import logging
+
+import dns.name
+import dns.rdatatype
+import ndn
+
+import ndns
+import ndns.snapshot
+from ndns.blob import blob_digest
+from ndns.rrset import rrs_content_hash, lock_rrsets_state
+
+_LOG = logging.getLogger ("ndns.Resign")
+
+_SELECT_CANDIDATES = "SELECT id, label, rclass, rtype, signed_at, signed_key_id, content_hash, dirty, ndndata_digest FROM rrsets " \
+                     "WHERE zone_id = ? AND id > ? AND (dirty = 1 OR signed_at IS NULL OR " \
+                     "(signed_key_id IS NOT NULL AND (signed_key_id NOT IN (?, ?) OR signed_at < ?))) " \
+                     "ORDER BY id LIMIT ?"
+
+class Resigner (object):
+    """
+    Incrementally re-sign RR sets of the zone
+
+    :param session: NDNS session
+    :param zone: :py:class:`ndns.zone.Zone` object
+    :param maxAge: Maximum age (in seconds) of signatures, after which RR sets are re-signed
+    :param batchSize: Maximum number of RR sets processed within one transaction
+    """
+
+    def __init__ (self, session, zone, maxAge = 7 * 24 * 3600, batchSize = 100):
+        self.session = session
+        self.zone = zone
+        self.maxAge = maxAge
+        self.batchSize = batchSize
+
+        self.signed = 0
+        self.cleaned = 0
+        self.failed = 0
+        self.changed = 0
+
+        self._cursor = 0
+
+    def _keys (self):
+        zsk = self.zone.default_key
+        ksks = [key for key in self.zone.keys if key.key_type == "KSK"]
+        ksk = ksks[0] if len (ksks) > 0 else None
+        keyRRsets = set (key.rrset_id for key in self.zone.keys if key.key_type != "KSK" and key.rrset_id is not None)
+        return (zsk, ksk, keyRRsets)
+
+    def _isZoneKey (self, conn, rrset_id):
+        # whether the legacy RR set (without signing state) is signed by one of the zone's keys
+        row = conn.execute ("SELECT blobs.data FROM rrsets JOIN blobs ON blobs.digest = rrsets.ndndata_digest "
+                            "WHERE rrsets.id = ?", (rrset_id,)).fetchone ()
+        if row is None:
+            return True
+
+        keyName = ndn.Data.fromWire (str (row[0])).signedInfo.keyLocator.keyName
+        return any (str (key.name) == str (keyName) for key in self.zone.keys)
+
+    def _sign (self, key, label, rclass, rtype, rrs):
+        dns_label = dns.name.from_text (label).relativize (dns.name.root)
+        (content, ttl) = ndns.createRRsetContent (self.zone.dns_name, dns_label, rclass, rtype, rrs)
+        if ttl <= -1:
+            ttl = self.zone.soa[0].rrs[0].ttl if self.zone.soa else 3600
+
+        name = ndns.createRRsetName (self.zone.name, dns_label, rtype)
+        dataPacket = ndns.createSignedData (self.session, name, content, ttl, key,
+                                            type = ndn.CONTENT_DATA if rtype != dns.rdatatype.NDNCERT else ndn.CONTENT_KEY)
+        return str (dataPacket.toWire ())
+
+    def runOnce (self):
+        """
+        Process one batch of RR sets
+
+        :returns: number of examined RR sets (less than ``batchSize`` when a pass over the zone is complete)
+        """
+        (zsk, ksk, keyRRsets) = self._keys ()
+        now = int (time.time ())
+
+        conn = self.session.connection ()
+        candidates = conn.execute (_SELECT_CANDIDATES, (self.zone.id, self._cursor, zsk.id, ksk.id if ksk else zsk.id,
+                                                        now - self.maxAge, self.batchSize)).fetchall ()
+        if len (candidates) == 0:
+            self.session.commit ()
+            self._cursor = 0
+            return 0
+
+        rrs = {}
+        ids = [row[0] for row in candidates]
+        for (rrset_id, ttl, rrdata) in conn.execute ("SELECT rrset_id, ttl, rrdata FROM rrs WHERE rrset_id IN (%s) ORDER BY id" %
+                                                     ",".join ("?" * len (ids)), ids):
+            rrs.setdefault (rrset_id, []).append ((ttl, str (rrdata)))
+
+        # read transaction is finished before signing, so the database is not locked meanwhile
+        legacy = [row[0] for row in candidates if row[4] is None and row[5] is None]
+        external = set (rrset_id for rrset_id in legacy if not self._isZoneKey (conn, rrset_id))
+        self.session.commit ()
+
+        blobs = {}
+        resigned = []
+        cleaned = []
+        # RR set id => (digest, content hash of RRs) as read, the RR set is updated only if both are unchanged
+        expected = {}
+        for (rrset_id, label, rclass, rtype, signed_at, signed_key_id, content_hash, dirty, digest) in candidates:
+            records = rrs.get (rrset_id, [])
+            newHash = rrs_content_hash (records)
+            key = ksk if rrset_id in keyRRsets else zsk
+            expected[rrset_id] = (digest, newHash)
+
+            if rrset_id in external or (signed_key_id is None and signed_at is not None):
+                # signed elsewhere, only remember the current state
+                cleaned.append ((signed_at if signed_at is not None else now, newHash, rrset_id, digest, content_hash))
+                continue
+
+            if key is not None and signed_key_id == key.id and signed_at >= now - self.maxAge and newHash == content_hash:
+                # marked dirty, but RRs did not change
+                cleaned.append ((signed_at, newHash, rrset_id, digest, content_hash))
+                continue
+
+            if key is None:
+                _LOG.warn ("Zone does not have KSK, key RR set [%s] is not re-signed" % label)
+                continue
+
+            try:
+                wire = self._sign (key, label, rclass, rtype, records)
+            except Exception, e:
+                _LOG.warn ("Failed to sign RR set [%s %s]: %s" % (label, dns.rdatatype.to_text (rtype), e))
+                self.failed += 1
+                continue
+
+            newDigest = blob_digest (wire)
+            blobs[newDigest] = wire
+            resigned.append ((newDigest, int (time.time ()), key.id, newHash, rrset_id, digest, content_hash))
+
+        conn = self.session.connection ()
+
+        # skip RR sets changed (e.g., by DyNDNS updates) while the batch was being signed
+        state = lock_rrsets_state (conn, [update[-3] for update in resigned + cleaned])
+        unchanged = lambda update: state.get (update[-3]) == expected[update[-3]]
+        changed = [update for update in resigned + cleaned if not unchanged (update)]
+        if len (changed) > 0:
+            _LOG.debug ("%d RR sets changed while being re-signed, left for the next pass" % len (changed))
+            self.changed += len (changed)
+            resigned = filter (unchanged, resigned)
+            cleaned = filter (unchanged, cleaned)
+
+        if len (blobs) > 0:
+            conn.execute ("INSERT OR IGNORE INTO blobs (digest, data) VALUES (?, ?)",
+                          [(digest, buffer (wire)) for (digest, wire) in blobs.iteritems ()])
+        if len (resigned) > 0:
+            conn.execute ("UPDATE rrsets SET ndndata_digest = ?, signed_at = ?, signed_key_id = ?, content_hash = ?, dirty = 0 "
+                          "WHERE id = ? AND ndndata_digest IS ? AND content_hash IS ?", resigned)
+        if len (cleaned) > 0:
+            conn.execute ("UPDATE rrsets SET signed_at = ?, content_hash = ?, dirty = 0 "
+                          "WHERE id = ? AND ndndata_digest IS ? AND content_hash IS ?", cleaned)
+        self.session.commit ()
+
+        self.signed += len (resigned)
+        self.cleaned += len (cleaned)
+
+        self._cursor = candidates[-1][0]
+        if len (candidates) < self.batchSize:
+            self._cursor = 0
+        return len (candidates)
+
+    def runPass (self, pause = 0.0):
+        """
+        Process all RR sets of the zone that need re-signing
+
+        :param pause: Time (in seconds) to sleep between batches, letting other writers access the database
+        :returns: number of re-signed RR sets
+        """
+        signed = self.signed
+        while self.runOnce () == self.batchSize:
+            if pause > 0:
+                time.sleep (pause)
+        return self.signed - signed
+
+def resign (args, onChanged = None):
+    """
+    :param onChanged: Callable, executed whenever RR sets of some zone were re-signed
+    """
+    _ndns = ndns.ndns_session (args.data_dir)
+
+    if args.zone:
+        zones = []
+        for zone_name in args.zone:
+            zone = _ndns.query (ndns.Zone).filter (ndns.Zone.has_name (ndn.Name (zone_name))).first ()
+            if not zone:
+                sys.stderr.write ("ERROR: zone [%s] is not configured\n" % zone_name)
+                exit (1)
+            zones.append (zone)
+    else:
+        zones = _ndns.query (ndns.Zone).all ()
+
+    resigners = [Resigner (_ndns, zone, maxAge = args.max_age, batchSize = args.batch_size) for zone in zones]
+    while True:
+        for resigner in resigners:
+            started = time.time ()
+            signed = resigner.runPass (pause = args.pause)
+            if signed > 0:
+                ndns.snapshot.refresh_snapshot (_ndns, resigner.zone)
+                if onChanged:
+                    onChanged ()
+
+            if not args.quiet and (signed > 0 or not args.interval):
+                sys.stderr.write ("Zone [%s]: re-signed %d RR sets (%d unchanged, %d changed meanwhile, %d failed) in %.1f seconds\n" %
+                                  (resigner.zone.name, signed, resigner.cleaned, resigner.changed, resigner.failed, time.time () - started))
+            resigner.cleaned = 0
+            resigner.changed = 0
+
+        if not args.interval:
+            break
+        time.sleep (args.interval)
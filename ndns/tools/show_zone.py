@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- Mode:python; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (c) 2013, Regents of the University of California
+#                     Alexander Afanasyev
+#
+# BSD license, See the doc/LICENSE file for more information
+#
+# Author: Alexander Afanasyev <alexander.afanasyev@ucla.edu>
+#
+
+import sys
+import json
+import dns.rdataclass
+import dns.rdatatype
+import dns.rdata
+import dns.rrset
+import dns.message
+from sqlalchemy.orm import subqueryload, joinedload
+import ndns
+import ndn
+
+def iterate_rrsets (session, zone, batchSize = 1000, wire = False):
+    """
+    Iterate over all RR sets of the zone using constant memory
+
+    RR sets are fetched in pages ordered by id (keyset pagination), RRs (and, if ``wire`` is set, signed
+    Data packets) of each page are loaded eagerly in a single query, and the page is detached from the
+    session before the next page is fetched.
+
+    :returns: generator of :py:class:`ndns.rrset.RRSet` objects
+    """
+    last_id = 0
+    while True:
+        query = session.query (ndns.RRSet).\
+            filter (ndns.RRSet.zone_id == zone.id, ndns.RRSet.id > last_id).\
+            order_by (ndns.RRSet.id).\
+            limit (batchSize).\
+            options (subqueryload (ndns.RRSet.rrs))
+        if wire:
+            query = query.options (joinedload (ndns.RRSet._blob))
+
+        page = query.all ()
+        for rrset in page:
+            yield rrset
+
+        if len (page) < batchSize:
+            break
+
+        last_id = page[-1].id
+        for rrset in page:
+            session.expunge (rrset)
+
+def _records (rrset, zone_dns, dataPacket):
+    # generator of (label, ttl, class, type, rdata text) tuples, taken from the Data packet if specified
+    if dataPacket is None:
+        label = rrset.dns_label
+        for rr in rrset.rrs:
+            rdata = dns.rdata.from_wire (rrset.rclass, rrset.rtype, rr.rrdata, 0, len (rr.rrdata))
+            yield (label, rr.ttl, rrset.rclass, rrset.rtype, rdata.to_text ())
+        return
+
+    if rrset.rtype == dns.rdatatype.NDNCERT:
+        rr = rrset.rrs[0]
+        yield (rrset.dns_label, rr.ttl, rrset.rclass, rrset.rtype, rr.dns_rrdata.to_text ())
+    else:
+        dns_rrset = dns.message.from_wire (dataPacket.content).answer[0]
+        for rdata in dns_rrset.items:
+            yield (dns_rrset.name.relativize (zone_dns), dns_rrset.ttl, rdata.rdclass, rdata.rdtype, rdata.to_text ())
+
+def show_zone (args, out = sys.stdout):
+    _ndns = ndns.ndns_session (args.data_dir)
+
+    try:
+        zone_ndn = ndn.Name (args.zone)
+        zone_dns = dns.name.from_text (ndns.dnsify (args.zone))
+    except NameError as e:
+        sys.stderr.write ("ERROR: %s\n\n" % e)
+        exit (1)
+
+    zone = _ndns.query (ndns.Zone).filter (ndns.Zone.has_name (zone_ndn)).first ()
+    if not zone:
+        sys.stderr.write ("ERROR: zone [%s] is not configured\n" % zone_ndn)
+        exit (1)
+
+    format = getattr (args, 'format', 'text')
+    batchSize = getattr (args, 'batch_size', 1000)
+
+    if format == "json":
+        out.write ('{"origin": %s, "zone": %s, "records": [' % (json.dumps (zone_dns.to_text ()), json.dumps (str (zone_ndn))))
+    elif format == "zone":
+        out.write ("$ORIGIN %s\n" % zone_dns)
+    else:
+        out.write (";; Origin: %s (%s)\n" % (zone_dns, zone_ndn))
+
+    first = True
+    for rrset in iterate_rrsets (_ndns, zone, batchSize, args.show_wire):
+        dataPacket = None
+        if args.show_wire:
+            dataPacket = rrset.ndndata
+            if format == "text":
+                out.write (";; DATA packet [%s]\n" % dataPacket.name)
+                out.write (";;   signed by [%s]\n" % dataPacket.signedInfo.keyLocator.keyName)
+
+        for (label, ttl, rdclass, rdtype, rdata) in _records (rrset, zone_dns, dataPacket):
+            if format == "json":
+                record = {"label": label.to_text (),
+                          "ttl": ttl,
+                          "class": dns.rdataclass.to_text (rdclass),
+                          "type": dns.rdatatype.to_text (rdtype),
+                          "rdata": rdata}
+                if args.show_wire:
+                    record["data"] = str (dataPacket.name)
+                    record["signed_by"] = str (dataPacket.signedInfo.keyLocator.keyName)
+                out.write ("%s\n%s" % ("" if first else ",", json.dumps (record)))
+                first = False
+            elif format == "zone":
+                out.write ("%s %d %s %s %s\n" % (label, ttl,
+                                                 dns.rdataclass.to_text (rdclass),
+                                                 dns.rdatatype.to_text (rdtype),
+                                                 rdata))
+            else:
+                out.write ("%s %d %s %s   %s\n" % (label, ttl,
+                                                   dns.rdataclass.to_text (rdclass),
+                                                   dns.rdatatype.to_text (rdtype),
+                                                   rdata))
+
+    if format == "json":
+        out.write ("\n]}\n")
@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# -*- Mode:python; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (c) 2013, Regents of the University of California
+#                     Alexander Afanasyev
+#
+# BSD license, See the doc/LICENSE file for more information
+#
+# Author: Alexander Afanasyev <alexander.afanasyev@ucla.edu>
+#
+
+"""
+Parallel (re-)signing of all RR sets of a zone
+
+RR sets are read from the database in batches ordered by id, signed by a pool of worker
+processes (each worker loads the private key only once, see :py:mod:`ndns.signing`), and updated
+in the database with one transaction per batch.  While the results of one batch are written, the
+next batch is already being signed.  RR sets changed while being signed (e.g., by DyNDNS updates)
+are not overwritten.
+
+After each committed batch, id of the last signed RR set (and ids of RR sets that failed to be
+signed) is saved into the checkpoint file, so an interrupted re-sign continues from where it
+stopped instead of starting over.  If some RR sets failed, the checkpoint is kept after the pass,
+and the next run re-tries only them.
+"""
+
+import os
+import sys
+import time
+import logging
+import multiprocessing
+
+import dns.name
+import dns.rdatatype
+import ndn
+
+import ndns
+import ndns.snapshot
+from ndns.blob import blob_digest
+from ndns.rrset import rrs_content_hash, lock_rrsets_state
+from ndns.signing import init_worker, load_key
+
+_LOG = logging.getLogger ("ndns.SignZone")
+
+_SELECT_RRSETS = "SELECT id, label, rclass, rtype, ndndata_digest FROM rrsets WHERE zone_id = ? AND id > ? ORDER BY id LIMIT ?"
+_SELECT_RRS = "SELECT rrs.rrset_id, rrs.ttl, rrs.rrdata FROM rrs JOIN rrsets ON rrsets.id = rrs.rrset_id " \
+              "WHERE rrsets.zone_id = ? AND rrsets.id BETWEEN ? AND ? ORDER BY rrs.id"
+
+def _signRRset (task):
+    """
+    Create and sign Data packet of the RR set inside the worker process
+
+    :returns: tuple (rrset id, wire-formatted Data packet, content hash, None) or (rrset id, None, None, error message)
+    """
+    (rrset_id, keyfile, key_locator, zone_name, origin, label, rclass, rtype, rrs, defaultTtl) = task
+    try:
+        dns_label = dns.name.from_text (label).relativize (dns.name.root)
+        (content, ttl) = ndns.createRRsetContent (dns.name.from_text (origin), dns_label, rclass, rtype, rrs)
+        if ttl <= -1:
+            ttl = defaultTtl
+
+        signingKey = load_key (keyfile)
+        signedInfo = ndn.SignedInfo (key_digest = signingKey.publicKeyID,
+                                     key_locator = ndn.KeyLocator (ndn.Name (key_locator)),
+                                     freshness = ttl,
+                                     type = ndn.CONTENT_DATA if rtype != dns.rdatatype.NDNCERT else ndn.CONTENT_KEY)
+
+        co = ndn.Data (name = ndns.createRRsetName (ndn.Name (zone_name), dns_label, rtype),
+                       signed_info = signedInfo, content = content)
+        co.sign (signingKey)
+        return (rrset_id, str (co.toWire ()), rrs_content_hash (rrs), None)
+    except Exception, e:
+        return (rrset_id, None, None, "%s" % e)
+
+class ZoneSigner (object):
+    """
+    Re-sign all RR sets of the zone using a pool of worker processes
+
+    NDNCERT RR sets of zone's own (non-KSK) keys are signed by the zone's KSK in the main process;
+    all other RR sets are signed with ``key`` (zone's default key, if not specified).
+
+    :param session: NDNS session
+    :param zone: :py:class:`ndns.zone.Zone` object
+    :param key: :py:class:`ndns.key.Key` to sign with (default: ``zone.default_key``)
+    :param workers: Number of worker processes (default: number of CPU cores)
+    :param batchSize: Number of RR sets signed and committed together
+    :param checkpoint: Path to the checkpoint file, or None to disable checkpointing
+    """
+
+    def __init__ (self, session, zone, key = None, workers = None, batchSize = 1000, checkpoint = None):
+        self.session = session
+        self.zone = zone
+        self.key = key if key else zone.default_key
+        self.workers = workers if workers else multiprocessing.cpu_count ()
+        self.batchSize = batchSize
+        self.checkpoint = checkpoint
+
+        self.total = 0
+        self.signed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.failedIds = []
+        self.changed = 0
+
+        # RR set id => digest of the Data packet when RR set was read for signing
+        self._digests = {}
+
+        self._keyfile = "%s/%s.pri" % (session.keydir, self.key.local_key_id)
+        self._zoneName = str (zone.name)
+        self._origin = zone.dns_name.to_text ()
+        self._defaultTtl = zone.soa[0].rrs[0].ttl if zone.soa else 3600
+
+        ksks = [key for key in zone.keys if key.key_type == "KSK"]
+        self._ksk = ksks[0] if len (ksks) > 0 else None
+        self._kskRRsets = set (key.rrset_id for key in zone.keys if key.key_type != "KSK" and key.rrset_id is not None)
+
+    def _readCheckpoint (self):
+        """
+        :returns: tuple (id of the last signed RR set, list of ids of RR sets that failed to be signed)
+        """
+        if not self.checkpoint or not os.path.exists (self.checkpoint):
+            return (0, [])
+
+        with open (self.checkpoint) as f:
+            try:
+                values = [int (value) for value in f.read ().split ()]
+                (zone_id, key_id, last_id) = values[:3]
+            except ValueError:
+                _LOG.warn ("Ignoring malformed checkpoint file [%s]" % self.checkpoint)
+                return (0, [])
+
+        if zone_id != self.zone.id or key_id != self.key.id:
+            _LOG.warn ("Checkpoint [%s] belongs to a different zone or key, starting over" % self.checkpoint)
+            return (0, [])
+        return (last_id, values[3:])
+
+    def _writeCheckpoint (self, last_id):
+        if not self.checkpoint:
+            return
+
+        tmp = "%s.tmp" % self.checkpoint
+        with open (tmp, "w") as f:
+            f.write ("%d %d %d" % (self.zone.id, self.key.id, last_id))
+            for rrset_id in self.failedIds:
+                f.write (" %d" % rrset_id)
+            f.write ("\n")
+            f.flush ()
+            os.fsync (f.fileno ())
+        os.rename (tmp, self.checkpoint)
+
+    def _readBatch (self, conn, after):
+        rrsets = conn.execute (_SELECT_RRSETS, (self.zone.id, after, self.batchSize)).fetchall ()
+        if len (rrsets) == 0:
+            return ([], after)
+
+        rrs = {}
+        for (rrset_id, ttl, rrdata) in conn.execute (_SELECT_RRS, (self.zone.id, rrsets[0][0], rrsets[-1][0])):
+            rrs.setdefault (rrset_id, []).append ((ttl, str (rrdata)))
+
+        return (self._tasks (rrsets, rrs), rrsets[-1][0])
+
+    def _readFailed (self, conn, ids):
+        # RR sets that failed to be signed during the previous run
+        placeholders = ",".join ("?" * len (ids))
+        rrsets = conn.execute ("SELECT id, label, rclass, rtype, ndndata_digest FROM rrsets WHERE zone_id = ? AND id IN (%s) ORDER BY id" %
+                               placeholders, [self.zone.id] + ids).fetchall ()
+
+        rrs = {}
+        for (rrset_id, ttl, rrdata) in conn.execute ("SELECT rrset_id, ttl, rrdata FROM rrs WHERE rrset_id IN (%s) ORDER BY id" %
+                                                     placeholders, ids):
+            rrs.setdefault (rrset_id, []).append ((ttl, str (rrdata)))
+
+        return self._tasks (rrsets, rrs)
+
+    def _tasks (self, rrsets, rrs):
+        tasks = []
+        for (rrset_id, label, rclass, rtype, digest) in rrsets:
+            if rrset_id in self._kskRRsets:
+                continue
+            self._digests[rrset_id] = digest
+            tasks.append ((rrset_id, self._keyfile, str (self.key.name), self._zoneName, self._origin,
+                           label, rclass, rtype, rrs.get (rrset_id, []), self._defaultTtl))
+        return tasks
+
+    def _writeBatch (self, conn, results):
+        blobs = {}
+        updates = []
+        signed_at = int (time.time ())
+        for (rrset_id, wire, content_hash, error) in results:
+            if wire is None:
+                _LOG.warn ("Failed to sign RR set [%d]: %s" % (rrset_id, error))
+                self.failed += 1
+                self.failedIds.append (rrset_id)
+                continue
+
+            digest = blob_digest (wire)
+            blobs[digest] = wire
+            updates.append ((digest, signed_at, self.key.id, content_hash, rrset_id, self._digests.get (rrset_id)))
+
+        # skip RR sets changed (e.g., by DyNDNS updates) while the batch was being signed
+        state = lock_rrsets_state (conn, [update[4] for update in updates])
+        unchanged = [update for update in updates if state.get (update[4]) == (update[5], update[3])]
+        if len (unchanged) < len (updates):
+            _LOG.info ("%d RR sets changed while being signed, not overwritten" % (len (updates) - len (unchanged)))
+            self.changed += len (updates) - len (unchanged)
+
+        for (rrset_id, wire, content_hash, error) in results:
+            self._digests.pop (rrset_id, None)
+
+        if len (unchanged) > 0:
+            conn.execute ("INSERT OR IGNORE INTO blobs (digest, data) VALUES (?, ?)",
+                          [(digest, buffer (wire)) for (digest, wire) in blobs.iteritems ()])
+            conn.execute ("UPDATE rrsets SET ndndata_digest = ?, signed_at = ?, signed_key_id = ?, content_hash = ?, dirty = 0 "
+                          "WHERE id = ? AND ndndata_digest IS ?", unchanged)
+        self.signed += len (unchanged)
+
+    def _signKeyRRsets (self):
+        if len (self._kskRRsets) == 0:
+            return
+
+        for rrset in self.session.query (ndns.RRSet).filter (ndns.RRSet.id.in_ (self._kskRRsets)):
+            if self._ksk is None:
+                _LOG.warn ("Zone does not have KSK, key RR set [%s] is not re-signed" % rrset.label)
+                continue
+            rrset.refresh_ndndata (self.session, self._ksk)
+            self.signed += 1
+        self.session.commit ()
+
+    def run (self, progress = None):
+        """
+        Sign all RR sets of the zone
+
+        :param progress: Callable receiving the :py:class:`ZoneSigner` after each committed batch
+        :returns: number of signed RR sets
+        """
+        conn = self.session.connection ()
+        self.total = conn.execute ("SELECT COUNT(*) FROM rrsets WHERE zone_id = ?", (self.zone.id,)).scalar ()
+
+        (after, failedIds) = self._readCheckpoint ()
+        if after > 0:
+            self.skipped = conn.execute ("SELECT COUNT(*) FROM rrsets WHERE zone_id = ? AND id <= ?",
+                                         (self.zone.id, after)).scalar () - len (failedIds)
+            _LOG.info ("Resuming from checkpoint, %d RR sets already signed, %d to be re-tried" % (self.skipped, len (failedIds)))
+        else:
+            self._signKeyRRsets ()
+            conn = self.session.connection ()
+
+        pool = multiprocessing.Pool (self.workers, init_worker)
+        try:
+            if len (failedIds) > 0:
+                self._writeBatch (conn, pool.map (_signRRset, self._readFailed (conn, failedIds), chunksize = 16))
+                self.session.commit ()
+                self._writeCheckpoint (after)
+                conn = self.session.connection ()
+
+            (tasks, last_id) = self._readBatch (conn, after)
+            pending = pool.map_async (_signRRset, tasks, chunksize = 16)
+            while last_id > after:
+                after = last_id
+
+                # next batch is signed while results of the current one are written
+                (tasks, last_id) = self._readBatch (conn, after)
+                results = pending.get ()
+                pending = pool.map_async (_signRRset, tasks, chunksize = 16)
+
+                self._writeBatch (conn, results)
+                self.session.commit ()
+                self._writeCheckpoint (after)
+                conn = self.session.connection ()
+
+                if progress:
+                    progress (self)
+        finally:
+            pool.terminate ()
+            pool.join ()
+
+        self.session.expire_all ()
+        if len (self.failedIds) > 0:
+            # keep the checkpoint, so the next run re-tries only the failed RR sets
+            self._writeCheckpoint (after)
+        elif self.checkpoint and os.path.exists (self.checkpoint):
+            os.unlink (self.checkpoint)
+        return self.signed
+
+def sign_zone (args):
+    _ndns = ndns.ndns_session (args.data_dir)
+
+    try:
+        zone_ndn = ndn.Name (args.zone)
+    except NameError as e:
+        sys.stderr.write ("ERROR: %s\n" % e)
+        exit (1)
+
+    zone = _ndns.query (ndns.Zone).filter (ndns.Zone.has_name (zone_ndn)).first ()
+    if not zone:
+        sys.stderr.write ("ERROR: zone [%s] is not configured\n" % zone_ndn)
+        exit (1)
+
+    checkpoint = args.checkpoint
+    if checkpoint is None:
+        checkpoint = "%s/sign-zone-%d.checkpoint" % (os.path.expanduser (args.data_dir), zone.id)
+    if args.restart and os.path.exists (checkpoint):
+        os.unlink (checkpoint)
+
+    signer = ZoneSigner (_ndns, zone, workers = args.workers, batchSize = args.batch_size, checkpoint = checkpoint)
+
+    started = time.time ()
+    def progress (signer):
+        if args.quiet:
+            return
+        done = signer.skipped + signer.signed + signer.failed + signer.changed
+        elapsed = max (time.time () - started, 1e-6)
+        rate = (signer.signed + signer.failed + signer.changed) / elapsed
+        eta = (signer.total - done) / rate if rate > 0 else 0
+        sys.stderr.write ("Signed %d/%d RR sets (%.1f%%), %.0f RR sets/s, ETA %.0f s\n" %
+                          (done, signer.total, 100.0 * done / max (signer.total, 1), rate, eta))
+
+    signer.run (progress)
+    ndns.snapshot.refresh_snapshot (_ndns, zone)
+
+    sys.stderr.write ("Signed %d RR sets of zone [%s] in %.1f seconds using %d workers (%d failed, %d changed meanwhile)\n" %
+                      (signer.signed, zone_ndn, time.time () - started, signer.workers, signer.failed, signer.changed))
+    if signer.failed > 0:
+        exit (2)
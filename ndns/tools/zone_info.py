@@ -17,6 +17,7 @@ import dns.rrset
 import dns.rdtypes.IN.NDNCERT
 import ndns
 import ndn
+from sqlalchemy.orm import subqueryload_all
 from StringIO import StringIO
 
 def zone_info (args, out = None):
@@ -33,7 +34,10 @@ def zone_info (args, out = None):
         parser.print_help ()
         exit (1)
 
-    zone = _ndns.query (ndns.Zone).filter (ndns.Zone.has_name (zone_ndn)).first ()
+    zone = _ndns.query (ndns.Zone).\
+        filter (ndns.Zone.has_name (zone_ndn)).\
+        options (subqueryload_all (ndns.Zone.keys, ndns.Key.rrset, ndns.RRSet.rrs)).\
+        first ()
     if not zone:
         sys.stderr.write ("ERROR: zone [%s] is not configured\n" % zone_ndn)
         exit (1)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- Mode:python; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (c) 2013, Regents of the University of California
+#                     Alexander Afanasyev
+#
+# BSD license, See the doc/LICENSE file for more information
+#
+# Author: Alexander Afanasyev <alexander.afanasyev@ucla.edu>
+#
+
+class _Node (object):
+    __slots__ = ["children", "zone"]
+
+    def __init__ (self):
+        self.children = {}
+        self.zone = None
+
+class ZoneTrie (object):
+    """
+    Name tree of served zones, allowing to find the zone authoritative for an NDNS request
+    (``<zone>/DNS/<label>/<RR-TYPE>``) using longest-prefix match
+    """
+
+    def __init__ (self):
+        self._root = _Node ()
+        self._size = 0
+
+    def __len__ (self):
+        return self._size
+
+    def insert (self, name, zone):
+        """
+        Add zone to the tree
+
+        :param name: Zone name
+        :type name: ndn.Name
+        :param zone: Object to be returned by :py:meth:`find`
+        """
+        node = self._root
+        for component in name:
+            node = node.children.setdefault (str (component), _Node ())
+
+        if node.zone is None:
+            self._size += 1
+        node.zone = zone
+
+    def remove (self, name):
+        """
+        Remove zone from the tree, pruning branches that do not lead to any zone
+        """
+        path = [self._root]
+        for component in name:
+            node = path[-1].children.get (str (component))
+            if node is None:
+                return
+            path.append (node)
+
+        if path[-1].zone is None:
+            return
+
+        path[-1].zone = None
+        self._size -= 1
+
+        for i in range (len (name), 0, -1):
+            node = path[i]
+            if node.zone is not None or len (node.children) > 0:
+                break
+            del path[i-1].children[str (name[i-1])]
+
+    def find (self, name):
+        """
+        Find the most specific zone ``Z``, such that ``name`` starts with ``Z/DNS``
+
+        :returns: zone object or None if there is no matching zone
+        """
+        node = self._root
+        found = None
+        for component in name:
+            component = str (component)
+            if component == "DNS" and node.zone is not None:
+                found = node.zone
+
+            node = node.children.get (component)
+            if node is None:
+                break
+
+        return found
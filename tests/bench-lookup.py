@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- Mode:python; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (c) 2013, Regents of the University of California
+#                     Alexander Afanasyev
+#
+# BSD license, See the doc/LICENSE file for more information
+#
+# Author: Alexander Afanasyev <alexander.afanasyev@ucla.edu>
+#
+
+# Compare per-lookup CPU time of ORM queries (as previously done by ndns-daemon) and
+# ndns.lookup.RecordLookup, using RR sets of an existing NDNS database
+#
+#   python tests/bench-lookup.py --data-dir ~/.ndns -n 100000
+
+import sys
+import argparse
+import random
+import time
+
+import ndns
+from ndns.lookup import RecordLookup
+
+parser = argparse.ArgumentParser(description='Benchmark of RR set lookups')
+parser.add_argument('--data-dir', dest='data_dir', type=str, required=True,
+                    help='''Directory with NDNS database and key files''')
+parser.add_argument('-n', dest='count', type=int, default=10000,
+                    help='''Number of lookups [default: 10000]''')
+parser.add_argument('--miss-ratio', dest='miss_ratio', type=float, default=0.1,
+                    help='''Fraction of lookups for non-existing RR sets [default: 0.1]''')
+args = parser.parse_args()
+
+def orm_lookup (session, zone, label, rtype):
+    rrset = session.query (ndns.RRSet).with_parent (zone).filter_by (label = label, rtype = rtype).first ()
+    if rrset is None:
+        return None
+    return rrset.ndndata
+
+def raw_lookup (lookup, zone, label, rtype):
+    return lookup.get (zone.id, label, rtype)
+
+def run (name, func, target, requests):
+    started = time.clock ()
+    wallStarted = time.time ()
+    found = 0
+    for (zone, label, rtype) in requests:
+        if func (target, zone, label, rtype) is not None:
+            found += 1
+    cpu = time.clock () - started
+    wall = time.time () - wallStarted
+
+    print "%-16s %8d lookups (%d found): %8.2f us CPU/lookup, %8.2f us wall/lookup" % \
+        (name, len (requests), found, cpu / len (requests) * 1e6, wall / len (requests) * 1e6)
+
+if __name__ == '__main__':
+    session = ndns.ndns_session (args.data_dir)
+
+    rrsets = [(rrset.zone, rrset.label, rrset.rtype) for rrset in session.query (ndns.RRSet)]
+    if len (rrsets) == 0:
+        sys.stderr.write ("ERROR: database in [%s] does not have any RR sets\n" % args.data_dir)
+        exit (1)
+
+    rand = random.Random (0)
+    requests = []
+    for i in xrange (args.count):
+        (zone, label, rtype) = rand.choice (rrsets)
+        if rand.random () < args.miss_ratio:
+            label = "bench-miss-%d.%s" % (i, label)
+        requests.append ((zone, label, rtype))
+
+    lookup = RecordLookup (session.zonedb)
+
+    run ("ORM", orm_lookup, session, requests)
+    run ("RecordLookup", raw_lookup, lookup, requests)